@@ -0,0 +1,255 @@
+import os
+import io
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import PIL
+from PIL import Image as PILImage
+
+from fetchx import (SUPPORTED_FORMATS, DOWNSCALE_MODES, ENCODER_PROFILES, IMAGE_BACKENDS, save_format,
+                    encoder_settings, prepare_for_format, get_backend, backend_available)
+
+# Per-stage codec microbenchmark
+#
+# Generates synthetic images and times every step convert_image() goes
+# through, per format, mode and downscale setting, with each image backend
+# that is installed:
+#   decode/<fmt>/<mode>/<size>               open + full load of an encoded file
+#   decode_resize/<fmt>/<mode>/<size>/<ds>   backend decode() + resize(); draft /
+#                                            shrink-on-load happens inside the decoder,
+#                                            so the two can't be timed apart
+#   flatten/<mode>/<size>                    prepare_for_format(img, 'JPEG'): colour
+#                                            normalization with alpha flattening
+#   encode/<fmt>/<mode>/<size>/<profile>     backend encode() with an encoder profile,
+#                                            the output size is recorded next to the time
+#
+# Pillow keys have no prefix, other backends' keys start with their name
+# (vips/decode/...), so both sit side by side in one result file.
+# Results are written as JSON and compared against a stored baseline.
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINE_FILE = os.path.join(HERE, "baseline.json")
+
+SIZES = [(640, 360), (1920, 1080), (3840, 2160)]
+QUICK_SIZES = [(1920, 1080)]
+TARGET = (1366, 768)
+MODES = ['RGB', 'RGBA', 'LA', 'P']
+# jpg and jpeg are the same codec
+FORMATS = sorted({f for f in SUPPORTED_FORMATS if f != 'jpeg'}, key=SUPPORTED_FORMATS.index)
+
+
+def synthetic_image(size, mode):
+    # Gradients plus noise: compresses like a photo, not like a flat fill
+    gradient = PILImage.linear_gradient('L').resize(size)
+    noise = PILImage.effect_noise(size, 48)
+    mandel = PILImage.effect_mandelbrot(size, (-2.0, -1.2, 1.0, 1.2), 64)
+    rgb = PILImage.merge('RGB', (gradient, noise, mandel))
+    if mode == 'RGB':
+        return rgb
+    if mode == 'P':
+        return rgb.quantize(256)
+    alpha = PILImage.radial_gradient('L').resize(size)
+    if mode == 'RGBA':
+        return PILImage.merge('RGBA', (*rgb.split(), alpha))
+    return PILImage.merge('LA', (rgb.convert('L'), alpha))
+
+
+def encode(img, fmt, profile='balanced'):
+    buf = io.BytesIO()
+    img.save(buf, save_format(fmt), **encoder_settings(save_format(fmt), profile))
+    return buf.getvalue()
+
+
+def stage_key(backend, key):
+    return key if backend.name == 'pillow' else f"{backend.name}/{key}"
+
+
+def materialize(backend, img):
+    # libvips only builds a pipeline until something reads the pixels, make
+    # it run here so the time lands in this stage
+    if backend.name == 'vips':
+        return img.copy_memory()
+    return img
+
+
+def timed(fn, repeat):
+    samples = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return {"median_ms": round(statistics.median(samples), 3), "min_ms": round(min(samples), 3)}, result
+
+
+def run_benchmarks(sizes, repeat, backends, log=print):
+    results = {}
+    errors = {}
+
+    def record(key, fn):
+        try:
+            timing, result = timed(fn, repeat)
+        except Exception as e:
+            errors[key] = f"{type(e).__name__}: {e}"
+            log(f"  {key:<48} ERROR {errors[key]}")
+            return None
+        if isinstance(result, (bytes, memoryview)):
+            timing["bytes"] = len(result)
+        results[key] = timing
+        size_note = f"  {timing['bytes'] / 1024:>9.1f} KB" if "bytes" in timing else ""
+        log(f"  {key:<48} {timing['median_ms']:>9.2f} ms{size_note}")
+        return result
+
+    with tempfile.TemporaryDirectory(prefix="fetchx_bench_") as tmp:
+        # Backends open files by path
+        def to_file(name, data):
+            path = os.path.join(tmp, name)
+            with open(path, "wb") as f:
+                f.write(data)
+            return path
+
+        for size in sizes:
+            size_key = f"{size[0]}x{size[1]}"
+            for mode in MODES:
+                img = synthetic_image(size, mode)
+                target_img = img.resize(TARGET)
+                record(f"flatten/{mode}/{size_key}", lambda: prepare_for_format(target_img, 'JPEG'))
+                # Lossless copy of the resized image for every backend to encode from
+                target_path = to_file(f"target_{mode}.png", encode(target_img, 'png', 'speed'))
+                sources = {}
+                for fmt in FORMATS:
+                    # Formats that can't hold this mode get skipped at source level,
+                    # but encoding to them still goes through normalization
+                    try:
+                        sources[fmt] = to_file(f"source_{mode}.{fmt}", encode(img, fmt))
+                    except Exception:
+                        pass
+                for backend in backends:
+                    def key(name):
+                        return stage_key(backend, name)
+
+                    for fmt, path in sources.items():
+                        record(key(f"decode/{fmt}/{mode}/{size_key}"),
+                               lambda: backend.decode(backend.open(path), size, 'quality', reuse=True))
+                        for downscale in DOWNSCALE_MODES:
+                            spec = {"width": TARGET[0], "height": TARGET[1], "downscale": downscale}
+                            record(key(f"decode_resize/{fmt}/{mode}/{size_key}/{downscale}"),
+                                   lambda: materialize(backend, backend.resize(
+                                       backend.decode(backend.open(path), TARGET, downscale), spec)))
+                    if backend.name == 'pillow':
+                        target = target_img
+                    else:
+                        target = backend.decode(backend.open(target_path), TARGET, reuse=True)
+                    for fmt in FORMATS:
+                        # Normalizing is timed on its own (flatten/...), not as part of encoding
+                        try:
+                            prepared = materialize(backend, backend.normalize(target, {"format": fmt}))
+                        except Exception as e:
+                            for profile in ENCODER_PROFILES:
+                                errors[key(f"encode/{fmt}/{mode}/{size_key}/{profile}")] = f"{type(e).__name__}: {e}"
+                            continue
+                        for profile in ENCODER_PROFILES:
+                            spec = {"format": fmt, "encoder": profile}
+                            record(key(f"encode/{fmt}/{mode}/{size_key}/{profile}"),
+                                   lambda: backend.encode(prepared, spec))
+    return results, errors
+
+
+def compare(current, baseline, tolerance, min_delta_ms):
+    regressions, improvements = [], []
+    for key, timing in sorted(current["results"].items()):
+        base = baseline["results"].get(key)
+        if not base:
+            continue
+        # Compare best runs, they are far less noisy than medians on a busy machine
+        ratio = timing["min_ms"] / base["min_ms"] if base["min_ms"] else 1.0
+        delta = timing["min_ms"] - base["min_ms"]
+        if ratio > 1 + tolerance and delta > min_delta_ms:
+            regressions.append((key, base["min_ms"], timing["min_ms"], ratio))
+        elif ratio < 1 - tolerance and -delta > min_delta_ms:
+            improvements.append((key, base["min_ms"], timing["min_ms"], ratio))
+    # A stage that used to work and now raises is always a regression
+    for key, error in sorted(current["errors"].items()):
+        if key in baseline["results"]:
+            regressions.append((key, baseline["results"][key]["min_ms"], error, None))
+    return regressions, improvements
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-stage FetchX codec benchmark")
+    parser.add_argument("--quick", action="store_true", help=f"only {QUICK_SIZES[0][0]}x{QUICK_SIZES[0][1]} sources")
+    parser.add_argument("--backend", choices=IMAGE_BACKENDS + ['all'], default='all',
+                        help="image backend to run the stages with (default: every installed one)")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per measurement, median and best are kept (default: 5)")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="baseline to compare against")
+    parser.add_argument("--update-baseline", action="store_true", help="store these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown ratio (default: 0.25 = 25%%)")
+    parser.add_argument("--min-delta", type=float, default=0.5, help="ignore changes below this many ms (default: 0.5)")
+    args = parser.parse_args(argv)
+    names = IMAGE_BACKENDS if args.backend == 'all' else [args.backend]
+    missing = [name for name in names if not backend_available(name)]
+    if args.backend != 'all' and missing:
+        print(f"The {args.backend} backend is not installed")
+        return 1
+    backends = [get_backend(name) for name in names if name not in missing]
+
+    current = {
+        "meta": {
+            "python": platform.python_version(),
+            "pillow": PIL.__version__,
+            "backends": [backend.name for backend in backends],
+            "machine": f"{platform.system()} {platform.machine()}",
+            "cpu_count": os.cpu_count(),
+            "repeat": args.repeat,
+            "target": f"{TARGET[0]}x{TARGET[1]}",
+            "date": time.strftime("%Y-%m-%d %H:%M:%S")
+        }
+    }
+    if any(backend.name == 'vips' for backend in backends):
+        import pyvips
+        current["meta"]["vips"] = f"{pyvips.version(0)}.{pyvips.version(1)}.{pyvips.version(2)}"
+    print(f"FetchX codec benchmark, Pillow {PIL.__version__}, Python {platform.python_version()}, "
+          f"backends: {', '.join(backend.name for backend in backends)}")
+    current["results"], current["errors"] = run_benchmarks(QUICK_SIZES if args.quick else SIZES, args.repeat,
+                                                           backends)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(current, f, indent=4)
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(current, f, indent=4)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}, run with --update-baseline to create one")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline["meta"].get("machine") != current["meta"]["machine"] or \
+            baseline["meta"].get("cpu_count") != current["meta"]["cpu_count"]:
+        print("Warning: baseline was recorded on a different machine, timings may not be comparable")
+    regressions, improvements = compare(current, baseline, args.tolerance, args.min_delta)
+    for key, before, after, ratio in improvements:
+        print(f"  faster  {key:<48} {before:>9.2f} → {after:>9.2f} ms ({ratio:.2f}x)")
+    for key, before, after, ratio in regressions:
+        if ratio is None:
+            print(f"  BROKEN  {key:<48} {before:>9.2f} ms → {after}")
+        else:
+            print(f"  SLOWER  {key:<48} {before:>9.2f} → {after:>9.2f} ms ({ratio:.2f}x)")
+    print(f"{len(regressions)} regressions, {len(improvements)} improvements "
+          f"against baseline from {baseline['meta'].get('date', '?')}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,312 @@
+import os
+import io
+import re
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from PIL import Image as PILImage
+
+from fetchx import DOWNSCALE_MODES, WATCH_BACKENDS, Task, ImageEngine, save_format, watcher
+
+# End-to-end latency and soak harness
+#
+# Drops images into a scratch watch folder at a steady rate and/or in bursts,
+# runs the real watcher() over it and measures the time from a file landing in
+# the watch folder to the watcher reporting its output as written. Prints
+# p50/p95/p99 latency, throughput and RSS as it goes, and a summary with the
+# RSS growth rate at the end so leaks show up on long soaks.
+
+DONE_RE = re.compile(r"✔ (.+) → (\S+)$")
+ERROR_RE = re.compile(r"Error processing (.+?): ")
+
+
+def parse_size(text):
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def parse_burst(text):
+    count, seconds = text.split("/")
+    return int(count), float(seconds)
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def rss_mb(pid="self"):
+    # Linux only, falls back to peak RSS of this process elsewhere
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if pid != "self":
+        return 0.0
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    except ImportError:
+        return 0.0
+
+
+def slope_per_hour(samples):
+    # Least squares fit of (seconds, MB) samples, in MB per hour
+    if len(samples) < 2:
+        return 0.0
+    n = len(samples)
+    mean_t = sum(t for t, _ in samples) / n
+    mean_v = sum(v for _, v in samples) / n
+    var = sum((t - mean_t) ** 2 for t, _ in samples)
+    if not var:
+        return 0.0
+    cov = sum((t - mean_t) * (v - mean_v) for t, v in samples)
+    return cov / var * 3600
+
+
+class LatencyRecorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.landed = {}
+        self.latencies = []
+        self.window = []
+        self.failed = 0
+        self.produced = 0
+
+    def land(self, filename):
+        with self.lock:
+            self.landed[filename] = time.perf_counter()
+            self.produced += 1
+
+    def log(self, msg):
+        now = time.perf_counter()
+        match = DONE_RE.search(msg)
+        with self.lock:
+            if match:
+                started = self.landed.pop(match.group(1), None)
+                if started is not None:
+                    latency = (now - started) * 1000
+                    self.latencies.append(latency)
+                    self.window.append(latency)
+            elif ERROR_RE.search(msg):
+                self.failed += 1
+
+    def take_window(self):
+        with self.lock:
+            window, self.window = self.window, []
+            return sorted(window), len(self.landed)
+
+
+class Producer:
+    def __init__(self, folder, payload, ext, recorder, rate, burst, burst_every, in_place):
+        self.folder = folder
+        self.payload = payload
+        self.ext = ext
+        self.recorder = recorder
+        self.rate = rate
+        self.burst = burst
+        self.burst_every = burst_every
+        self.in_place = in_place
+        self.counter = 0
+        self.stop = threading.Event()
+
+    def drop(self):
+        self.counter += 1
+        filename = f"shot_{self.counter:07d}.{self.ext}"
+        path = os.path.join(self.folder, filename)
+        if self.in_place:
+            # Like a game writing straight into the folder
+            with open(path, "wb") as f:
+                f.write(self.payload)
+            self.recorder.land(filename)
+        else:
+            tmp_path = os.path.join(self.folder, f".{filename}.part")
+            with open(tmp_path, "wb") as f:
+                f.write(self.payload)
+            self.recorder.land(filename)
+            os.replace(tmp_path, path)
+
+    def run_steady(self):
+        interval = 1.0 / self.rate
+        next_time = time.perf_counter()
+        while not self.stop.is_set():
+            self.drop()
+            next_time += interval
+            self.stop.wait(max(0.0, next_time - time.perf_counter()))
+
+    def run_bursts(self):
+        count, seconds = self.burst
+        while not self.stop.is_set():
+            started = time.perf_counter()
+            for i in range(count):
+                if self.stop.is_set():
+                    return
+                self.drop()
+                self.stop.wait(max(0.0, started + seconds * (i + 1) / count - time.perf_counter()))
+            if not self.burst_every:
+                return
+            self.stop.wait(max(0.0, started + self.burst_every - time.perf_counter()))
+
+    def start(self):
+        threads = []
+        if self.rate:
+            threads.append(threading.Thread(target=self.run_steady, daemon=True))
+        if self.burst:
+            threads.append(threading.Thread(target=self.run_bursts, daemon=True))
+        for t in threads:
+            t.start()
+        return threads
+
+
+def engine_rss(engine):
+    executor = engine._executor if engine else None
+    if executor is None:
+        return 0.0
+    return sum(rss_mb(pid) for pid in list(executor._processes or {}))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="FetchX end-to-end latency and soak harness")
+    parser.add_argument("--duration", type=float, default=60, help="seconds to produce files for (default: 60)")
+    parser.add_argument("--rate", type=float, default=5, help="steady files per second, 0 to disable (default: 5)")
+    parser.add_argument("--burst", type=parse_burst, metavar="COUNT/SECONDS",
+                        help="e.g. 200/2 for a screenshot burst of 200 files in 2 seconds")
+    parser.add_argument("--burst-every", type=float, default=0, help="repeat the burst every N seconds (default: once)")
+    parser.add_argument("--in-place", action="store_true", help="write files in place instead of write-then-rename")
+    parser.add_argument("--source-size", type=parse_size, default=(1920, 1080), help="produced image size (default: 1920x1080)")
+    parser.add_argument("--source-format", default="png", help="produced image format (default: png)")
+    parser.add_argument("--size", type=parse_size, default=(1366, 768), help="task output size (default: 1366x768)")
+    parser.add_argument("--format", default="png", help="task output format (default: png)")
+    parser.add_argument("--downscale", choices=DOWNSCALE_MODES, default="quality")
+    parser.add_argument("--watch-backend", choices=WATCH_BACKENDS, default="auto")
+    parser.add_argument("--workers", type=int, default=0, help="engine worker processes (default: one per core)")
+    parser.add_argument("--no-pool", action="store_true", help="convert inside the watcher thread")
+    parser.add_argument("--report-interval", type=float, default=5, help="seconds between progress lines")
+    parser.add_argument("--drain-timeout", type=float, default=60, help="seconds to wait for the backlog at the end")
+    parser.add_argument("--folder", help="scratch folder to use (default: a new temp folder, removed afterwards)")
+    parser.add_argument("--output", help="write the summary as JSON to this file")
+    parser.add_argument("--max-p99", type=float, help="exit 1 if overall p99 latency exceeds this many ms")
+    parser.add_argument("--max-rss-growth", type=float, help="exit 1 if main process RSS grows faster than this many MB/hour")
+    args = parser.parse_args(argv)
+
+    root = args.folder or tempfile.mkdtemp(prefix="fetchx_soak_")
+    watch_folder = os.path.join(root, "watch")
+    output_folder = os.path.join(root, "output")
+    os.makedirs(watch_folder, exist_ok=True)
+    os.makedirs(output_folder, exist_ok=True)
+
+    source = PILImage.effect_mandelbrot(args.source_size, (-2.0, -1.2, 1.0, 1.2), 64).convert("RGB")
+    buf = io.BytesIO()
+    source.save(buf, save_format(args.source_format))
+    payload = buf.getvalue()
+
+    task = Task("soak", watch_folder, output_folder, args.size[0], args.size[1], fmt=args.format,
+                watch_backend=args.watch_backend, downscale=args.downscale)
+    engine = None if args.no_pool else ImageEngine(args.workers)
+    recorder = LatencyRecorder()
+    watch_thread = threading.Thread(target=watcher, args=(task, recorder.log, 1, engine), daemon=True)
+    watch_thread.start()
+    time.sleep(0.5)
+
+    producer = Producer(watch_folder, payload, args.source_format, recorder, args.rate, args.burst,
+                        args.burst_every, args.in_place)
+    started = time.perf_counter()
+    rss_samples = [(0.0, rss_mb())]
+    print(f"Soaking for {args.duration:.0f}s in {root} "
+          f"({args.source_size[0]}x{args.source_size[1]} .{args.source_format} → "
+          f"{args.size[0]}x{args.size[1]} .{args.format}, payload {len(payload) / 1024:.0f} KB)")
+    producer.start()
+
+    def report(elapsed):
+        window, backlog = recorder.take_window()
+        main_rss = rss_mb()
+        rss_samples.append((elapsed, main_rss))
+        print(f"[{elapsed:7.1f}s] produced {recorder.produced:6d}  done {len(recorder.latencies):6d}  "
+              f"backlog {backlog:5d}  p50 {percentile(window, 50):7.1f}  p95 {percentile(window, 95):7.1f}  "
+              f"p99 {percentile(window, 99):7.1f} ms  rss {main_rss:6.1f} MB (+{engine_rss(engine):.1f} MB workers)",
+              flush=True)
+
+    try:
+        next_report = args.report_interval
+        while time.perf_counter() - started < args.duration:
+            time.sleep(min(0.2, max(0.0, next_report - (time.perf_counter() - started))))
+            if time.perf_counter() - started >= next_report:
+                report(time.perf_counter() - started)
+                next_report += args.report_interval
+    except KeyboardInterrupt:
+        print("Interrupted, draining")
+    producer.stop.set()
+    produced_for = time.perf_counter() - started
+
+    drain_deadline = time.perf_counter() + args.drain_timeout
+    while time.perf_counter() < drain_deadline:
+        with recorder.lock:
+            if len(recorder.landed) <= recorder.failed:
+                break
+        time.sleep(0.1)
+    elapsed = time.perf_counter() - started
+    report(elapsed)
+
+    task.running = False
+    watch_thread.join(timeout=3)
+    if engine:
+        engine.shutdown(wait=True)
+
+    latencies = sorted(recorder.latencies)
+    summary = {
+        "produced": recorder.produced,
+        "processed": len(latencies),
+        "failed": recorder.failed,
+        "unfinished": len(recorder.landed),
+        "duration_s": round(elapsed, 2),
+        "throughput_files_s": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50), 2),
+            "p95": round(percentile(latencies, 95), 2),
+            "p99": round(percentile(latencies, 99), 2),
+            "max": round(latencies[-1], 2) if latencies else 0.0
+        },
+        "rss_mb": {
+            "start": round(rss_samples[0][1], 1),
+            "end": round(rss_samples[-1][1], 1),
+            "max": round(max(v for _, v in rss_samples), 1),
+            "growth_mb_per_hour": round(slope_per_hour(rss_samples), 2)
+        }
+    }
+    print(f"Produced {summary['produced']} files in {produced_for:.1f}s, processed {summary['processed']}, "
+          f"failed {summary['failed']}, unfinished {summary['unfinished']}")
+    print(f"Latency p50 {summary['latency_ms']['p50']} ms  p95 {summary['latency_ms']['p95']} ms  "
+          f"p99 {summary['latency_ms']['p99']} ms  max {summary['latency_ms']['max']} ms")
+    print(f"Throughput {summary['throughput_files_s']} files/s, RSS {summary['rss_mb']['start']} → "
+          f"{summary['rss_mb']['end']} MB ({summary['rss_mb']['growth_mb_per_hour']:+.2f} MB/hour)")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=4)
+    if not args.folder:
+        shutil.rmtree(root, ignore_errors=True)
+
+    failed = False
+    if args.max_p99 is not None and summary["latency_ms"]["p99"] > args.max_p99:
+        print(f"FAIL: p99 latency {summary['latency_ms']['p99']} ms is over {args.max_p99} ms")
+        failed = True
+    if args.max_rss_growth is not None and summary["rss_mb"]["growth_mb_per_hour"] > args.max_rss_growth:
+        print(f"FAIL: RSS grows {summary['rss_mb']['growth_mb_per_hour']} MB/hour, limit is {args.max_rss_growth}")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
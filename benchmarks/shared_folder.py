@@ -0,0 +1,166 @@
+import os
+import io
+import re
+import sys
+import json
+import time
+import shutil
+import signal
+import tempfile
+import argparse
+import threading
+import subprocess
+from collections import Counter
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC)
+
+from PIL import Image as PILImage
+
+from fetchx import CLAIMS_DIR, Task, save_config
+
+# Shared watch folder harness
+#
+# Starts several `python -m fetchx run` processes on one watch folder with a
+# shared task, drops a batch of images into it and checks that every file
+# was converted exactly once: one output per source, nothing left in the
+# watch folder or in the claim folders. --kill-one SIGKILLs an instance
+# halfway through, so its claimed files have to be recovered by the others.
+
+DONE_RE = re.compile(r"✔ (.+) → (\S+)$")
+
+
+def parse_size(text):
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+class Instance:
+    def __init__(self, number, config, workers):
+        self.number = number
+        self.done = []
+        env = dict(os.environ, PYTHONPATH=SRC + os.pathsep + os.environ.get("PYTHONPATH", ""))
+        cmd = [sys.executable, "-m", "fetchx", "run", "--config", config]
+        cmd += ["--workers", str(workers)] if workers else ["--no-pool"]
+        self.process = subprocess.Popen(cmd, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                        text=True, encoding="utf-8")
+        self.reader = threading.Thread(target=self.read, daemon=True)
+        self.reader.start()
+
+    def read(self):
+        for line in self.process.stdout:
+            match = DONE_RE.search(line.rstrip("\n"))
+            if match:
+                self.done.append(match.group(1))
+            elif "Error" in line or "lease" in line or "Journal" in line:
+                print(f"  [{self.number}] {line.rstrip()}", flush=True)
+
+    def stop(self):
+        if self.process.poll() is None:
+            self.process.send_signal(signal.SIGTERM)
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self.reader.join(timeout=2)
+
+
+def leftovers(folder):
+    found = []
+    for dirpath, dirnames, filenames in os.walk(folder):
+        dirnames[:] = [d for d in dirnames if d != ".fetchx_journal"]
+        found.extend(os.path.relpath(os.path.join(dirpath, f), folder) for f in filenames
+                     if f.lower().endswith((".png", ".jpg", ".jpeg", ".webp", ".bmp", ".tiff")))
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="FetchX multi-instance shared folder harness")
+    parser.add_argument("--instances", type=int, default=3, help="FetchX processes to start (default: 3)")
+    parser.add_argument("--files", type=int, default=300, help="images to drop (default: 300)")
+    parser.add_argument("--workers", type=int, default=1, help="engine workers per instance, 0 = no pool (default: 1)")
+    parser.add_argument("--source-size", type=parse_size, default=(1280, 720), help="produced image size (default: 1280x720)")
+    parser.add_argument("--size", type=parse_size, default=(640, 360), help="task output size (default: 640x360)")
+    parser.add_argument("--kill-one", action="store_true", help="SIGKILL the first instance halfway through")
+    parser.add_argument("--timeout", type=float, default=120, help="seconds to wait for the folder to drain")
+    parser.add_argument("--folder", help="scratch folder to use (default: a new temp folder, removed afterwards)")
+    parser.add_argument("--output", help="write the summary as JSON to this file")
+    args = parser.parse_args(argv)
+
+    root = args.folder or tempfile.mkdtemp(prefix="fetchx_shared_")
+    watch_folder = os.path.join(root, "watch")
+    output_folder = os.path.join(root, "output")
+    os.makedirs(watch_folder, exist_ok=True)
+    os.makedirs(output_folder, exist_ok=True)
+    config = os.path.join(root, "fetchx_config.json")
+    save_config([Task("shared", watch_folder, output_folder, args.size[0], args.size[1],
+                      settle_time=0.2, shared=True)], {}, config)
+
+    source = PILImage.effect_mandelbrot(args.source_size, (-2.0, -1.2, 1.0, 1.2), 64).convert("RGB")
+    buf = io.BytesIO()
+    source.save(buf, "PNG")
+    payload = buf.getvalue()
+
+    instances = [Instance(n, config, args.workers) for n in range(1, args.instances + 1)]
+    time.sleep(1.5)
+    print(f"{args.instances} instances on {watch_folder}, dropping {args.files} files", flush=True)
+    started = time.perf_counter()
+    for n in range(args.files):
+        tmp_path = os.path.join(watch_folder, f".shot_{n:06d}.part")
+        with open(tmp_path, "wb") as f:
+            f.write(payload)
+        os.replace(tmp_path, os.path.join(watch_folder, f"shot_{n:06d}.png"))
+
+    killed = False
+    deadline = time.perf_counter() + args.timeout
+    while time.perf_counter() < deadline:
+        outputs = len(os.listdir(output_folder))
+        if args.kill_one and not killed and outputs >= args.files // 2:
+            print(f"Killing instance 1 (pid {instances[0].process.pid}) at {outputs} outputs", flush=True)
+            instances[0].process.kill()
+            # Reap it, a zombie still looks alive to the other instances' pid check
+            instances[0].process.wait()
+            killed = True
+        if outputs >= args.files and not leftovers(watch_folder):
+            break
+        time.sleep(0.2)
+    elapsed = time.perf_counter() - started
+
+    for instance in instances:
+        instance.stop()
+
+    done = Counter(name for instance in instances for name in instance.done)
+    left = leftovers(watch_folder)
+    outputs = len(os.listdir(output_folder))
+    claim_dirs = os.listdir(os.path.join(watch_folder, CLAIMS_DIR)) if os.path.isdir(
+        os.path.join(watch_folder, CLAIMS_DIR)) else []
+    summary = {
+        "instances": args.instances,
+        "files": args.files,
+        "outputs": outputs,
+        "per_instance": [len(instance.done) for instance in instances],
+        "converted_twice": sorted(name for name, count in done.items() if count > 1),
+        "left_in_watch_folder": left,
+        "claim_folders_left": claim_dirs,
+        "killed_one": killed,
+        "duration_s": round(elapsed, 2),
+        "throughput_files_s": round(outputs / elapsed, 2) if elapsed else 0.0
+    }
+    print(f"{outputs}/{args.files} outputs in {elapsed:.1f}s ({summary['throughput_files_s']} files/s), "
+          f"per instance {summary['per_instance']}")
+    print(f"Converted twice: {len(summary['converted_twice'])}, left in watch folder: {len(left)}, "
+          f"claim folders left: {len(claim_dirs)}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=4)
+    if not args.folder:
+        shutil.rmtree(root, ignore_errors=True)
+
+    if outputs != args.files or left or summary["converted_twice"]:
+        print("FAIL: every file should be converted exactly once")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,66 +1,16 @@
 import os
 import sys
-import time
 import json
-import random
-import string
-import threading
+import multiprocessing
 from PyQt6 import QtWidgets, QtGui, QtCore
 from PyQt6.QtCore import Qt
 from PyQt6.QtWidgets import QWidgetAction, QLabel, QGraphicsDropShadowEffect, QPushButton, QFileDialog, QListWidgetItem
-from PIL import Image as PILImage
-
-CONFIG_FILE = "fetchx_config.json"
-APP_VERSION = "Release 1.0"
-
-SUPPORTED_FORMATS = ['png', 'jpg', 'jpeg', 'webp', 'bmp', 'tiff']
-
-class Task:
-    def __init__(self, name, watch_folder, output_folder, width, height, fmt='png', enabled=True):
-        self.name = name
-        self.watch_folder = watch_folder
-        self.output_folder = output_folder
-        self.width = width
-        self.height = height
-        self.format = fmt if fmt else 'png'
-        self.enabled = enabled
-        self.thread = None
-        self.running = False
-
-# Config handling
-
-def load_config():
-    if os.path.exists(CONFIG_FILE):
-        with open(CONFIG_FILE, "r") as f:
-            data = json.load(f)
-            tasks = []
-            for t in data.get("tasks", []):
-                fmt = t.get('format', t.get('fmt', 'png'))
-                tasks.append(Task(
-                    name=t.get('name', ''),
-                    watch_folder=t.get('watch_folder', ''),
-                    output_folder=t.get('output_folder', ''),
-                    width=int(t.get('width', 1366)),
-                    height=int(t.get('height', 768)),
-                    fmt=fmt,
-                    enabled=bool(t.get('enabled', True))
-                ))
-            return tasks
-    return []
-
-
-def save_config(tasks):
-    data = {"tasks": [{
-        "name": t.name,
-        "watch_folder": t.watch_folder,
-        "output_folder": t.output_folder,
-        "width": t.width,
-        "height": t.height,
-        "enabled": t.enabled,
-        "format": t.format
-    } for t in tasks]}
-    with open(CONFIG_FILE, "w") as f:
-        json.dump(data, f, indent=4)
+
+from fetchx import (
+    APP_VERSION, SUPPORTED_FORMATS, DOWNSCALE_MODES, RESIZE_MODES, RESAMPLE_FILTERS, IMAGE_BACKENDS, Task, ImageEngine,
+    MetricsServer, LogPipeline, Scheduler, ConfigStore, task_to_dict, task_from_dict, update_task, apply_task_changes,
+    ignore_lease_breaks
+)
 
 # Startup registration
 def set_startup_enabled(enabled):
@@ -113,101 +63,6 @@ def is_startup_enabled():
     except Exception:
         return False
 
-# Utilities
-
-def random_name(ext='png'):
-    return ''.join(random.choices(string.ascii_letters + string.digits, k=8)) + f".{ext}"
-
-
-def short_path(path):
-    parts = os.path.normpath(path).split(os.sep)
-    return "/".join(parts[-2:]) + "/" if len(parts) >= 2 else path
-
-# Watcher function
-
-def watcher(task, log_callback, task_index):
-    processed_files = set()
-    logged_warnings = set()
-    task.running = True
-    log_callback(f"[Task {task_index}] Watcher started (enabled={task.enabled})")
-    try:
-        while task.running:
-            if not task.enabled:
-                time.sleep(0.5)
-                continue
-            try:
-                if not os.path.exists(task.watch_folder):
-                    if "watch_folder_missing" not in logged_warnings:
-                        log_callback(f"[Task {task_index}] Watch folder is missing: {task.watch_folder}")
-                        logged_warnings.add("watch_folder_missing")
-                    time.sleep(1)
-                    continue
-                else:
-                    logged_warnings.discard("watch_folder_missing")
-
-                if not os.path.exists(task.output_folder):
-                    try:
-                        os.makedirs(task.output_folder, exist_ok=True)
-                    except Exception as e:
-                        if "output_folder_missing" not in logged_warnings:
-                            log_callback(f"[Task {task_index}] Output folder is missing and cannot be created: {task.output_folder} ({e})")
-                            logged_warnings.add("output_folder_missing")
-                        time.sleep(1)
-                        continue
-                else:
-                    logged_warnings.discard("output_folder_missing")
-
-                for filename in os.listdir(task.watch_folder):
-                    src_path = os.path.join(task.watch_folder, filename)
-                    if not os.path.isfile(src_path):
-                        continue
-                    lower = filename.lower()
-                    if lower.endswith(('.png', '.jpg', '.jpeg', '.webp', '.bmp', '.tiff')) and filename not in processed_files:
-                        try:
-                            img = PILImage.open(src_path)
-                            img = img.resize((task.width, task.height))
-                            ext = task.format.lower()
-                            if ext == 'jpg':
-                                save_ext = 'JPEG'
-                            elif ext == 'png':
-                                save_ext = 'PNG'
-                            elif ext == 'webp':
-                                save_ext = 'WEBP'
-                            elif ext == 'bmp':
-                                save_ext = 'BMP'
-                            elif ext == 'tiff':
-                                save_ext = 'TIFF'
-                            else:
-                                save_ext = 'JPEG'
-
-                            rand_name = random_name(ext)
-                            save_path = os.path.join(task.output_folder, rand_name)
-                            # Ensure RGB if saving JPEG
-                            if save_ext == 'JPEG' and img.mode in ('RGBA', 'LA'):
-                                bg = PILImage.new("RGB", img.size, (255,255,255))
-                                bg.paste(img, mask=img.split()[3])
-                                bg.save(save_path, save_ext)
-                            else:
-                                img.save(save_path, save_ext)
-
-                            if os.path.exists(save_path):
-                                try:
-                                    os.remove(src_path)
-                                except Exception:
-                                    pass
-                                processed_files.add(filename)
-                                log_callback(f"[Task {task_index}] ✔ {filename} → {rand_name}")
-                            else:
-                                log_callback(f"[Task {task_index}] Failed to save {filename}, original not deleted")
-                        except Exception as e:
-                            log_callback(f"[Task {task_index}] Error processing {filename}: {e}")
-            except Exception as e:
-                log_callback(f"[Task {task_index}] Unexpected Error: {e} n/ Sowwy idk what happened :<")
-            time.sleep(1)
-    finally:
-        task.running = False
-        log_callback(f"[Task {task_index}] Stopped watching")
-
 # Simple painted switch widget for a smooth rounded toggle
 class Switch(QtWidgets.QAbstractButton):
     def __init__(self, checked=False, parent=None):
@@ -253,7 +108,7 @@ class TaskDialog(QtWidgets.QDialog):
         else:
             self.setWindowTitle("Add New Task")
             
-        self.setFixedSize(560, 420)
+        self.setFixedSize(560, 540)
         self.task = task
         layout = QtWidgets.QVBoxLayout(self)
         layout.setSpacing(16)
@@ -275,6 +130,39 @@ class TaskDialog(QtWidgets.QDialog):
         idx = SUPPORTED_FORMATS.index(current_fmt) if current_fmt in SUPPORTED_FORMATS else 0
         self.format_combo.setCurrentIndex(idx)
 
+        # Downscale speed combobox
+        self.downscale_combo = QtWidgets.QComboBox()
+        for m in DOWNSCALE_MODES:
+            self.downscale_combo.addItem(m.capitalize(), m)
+        current_mode = task.downscale if task else 'quality'
+        self.downscale_combo.setCurrentIndex(DOWNSCALE_MODES.index(current_mode))
+
+        # Resize mode and resampling filter comboboxes
+        self.resize_combo = QtWidgets.QComboBox()
+        for m in RESIZE_MODES:
+            self.resize_combo.addItem(m.capitalize(), m)
+        self.resize_combo.setCurrentIndex(RESIZE_MODES.index(task.resize_mode if task else 'stretch'))
+        self.resample_combo = QtWidgets.QComboBox()
+        for f in RESAMPLE_FILTERS:
+            self.resample_combo.addItem(f.capitalize(), f)
+        self.resample_combo.setCurrentIndex(RESAMPLE_FILTERS.index(task.resample if task else 'auto'))
+
+        # Subfolder watching and glob filters (comma separated)
+        self.recursive_checkbox = QtWidgets.QCheckBox("Watch subfolders")
+        self.recursive_checkbox.setChecked(task.recursive if task else False)
+        self.mirror_checkbox = QtWidgets.QCheckBox("Mirror subfolders")
+        self.mirror_checkbox.setChecked(task.mirror_paths if task else False)
+        self.include_edit = QtWidgets.QLineEdit(", ".join(task.include) if task else "")
+        self.include_edit.setPlaceholderText("all images")
+        self.exclude_edit = QtWidgets.QLineEdit(", ".join(task.exclude) if task else "")
+        self.exclude_edit.setPlaceholderText("none")
+
+        # Image engine, libvips only when pyvips is installed
+        self.backend_combo = QtWidgets.QComboBox()
+        for b in IMAGE_BACKENDS:
+            self.backend_combo.addItem("libvips" if b == 'vips' else b.capitalize(), b)
+        self.backend_combo.setCurrentIndex(IMAGE_BACKENDS.index(task.backend if task else 'pillow'))
+
         # Form layout for better organization
         form_layout = QtWidgets.QGridLayout()
         form_layout.setVerticalSpacing(12)
@@ -302,8 +190,25 @@ class TaskDialog(QtWidgets.QDialog):
         
         form_layout.addWidget(QtWidgets.QLabel("Output Format:"), 4, 0)
         form_layout.addWidget(self.format_combo, 4, 1)
+        form_layout.addWidget(QtWidgets.QLabel("Downscale:"), 4, 2)
+        form_layout.addWidget(self.downscale_combo, 4, 3)
+
+        form_layout.addWidget(QtWidgets.QLabel("Resize:"), 5, 0)
+        form_layout.addWidget(self.resize_combo, 5, 1)
+        form_layout.addWidget(QtWidgets.QLabel("Filter:"), 5, 2)
+        form_layout.addWidget(self.resample_combo, 5, 3)
         
-        form_layout.addWidget(self.enable_checkbox, 5, 0, 1, 2)
+        form_layout.addWidget(self.recursive_checkbox, 6, 0, 1, 2)
+        form_layout.addWidget(self.mirror_checkbox, 6, 2, 1, 2)
+
+        form_layout.addWidget(QtWidgets.QLabel("Include:"), 7, 0)
+        form_layout.addWidget(self.include_edit, 7, 1)
+        form_layout.addWidget(QtWidgets.QLabel("Exclude:"), 7, 2)
+        form_layout.addWidget(self.exclude_edit, 7, 3)
+
+        form_layout.addWidget(self.enable_checkbox, 8, 0, 1, 2)
+        form_layout.addWidget(QtWidgets.QLabel("Engine:"), 8, 2)
+        form_layout.addWidget(self.backend_combo, 8, 3)
         
         layout.addLayout(form_layout)
         layout.addSpacing(10)
@@ -391,7 +296,31 @@ class TaskDialog(QtWidgets.QDialog):
             width=int(self.width_edit.text()),
             height=int(self.height_edit.text()),
             fmt=self.format_combo.currentData(),
-            enabled=self.enable_checkbox.isChecked()
+            enabled=self.enable_checkbox.isChecked(),
+            watch_backend=self.task.watch_backend if self.task else 'auto',
+            max_workers=self.task.max_workers if self.task else 0,
+            downscale=self.downscale_combo.currentData(),
+            log_level=self.task.log_level if self.task else 'info',
+            settle_time=self.task.settle_time if self.task else 1.0,
+            max_attempts=self.task.max_attempts if self.task else 5,
+            retry_delay=self.task.retry_delay if self.task else 2.0,
+            extra_outputs=self.task.extra_outputs if self.task else [],
+            encoder=self.task.encoder if self.task else 'balanced',
+            encoder_options=self.task.encoder_options if self.task else {},
+            resize_mode=self.resize_combo.currentData(),
+            resample=self.resample_combo.currentData(),
+            reducing_gap=self.task.reducing_gap if self.task else 0.0,
+            priority=self.task.priority if self.task else 0,
+            weight=self.task.weight if self.task else 1,
+            queue_limit=self.task.queue_limit if self.task else 1000,
+            overflow=self.task.overflow if self.task else 'block',
+            recursive=self.recursive_checkbox.isChecked(),
+            include=[p.strip() for p in self.include_edit.text().split(',')],
+            exclude=[p.strip() for p in self.exclude_edit.text().split(',')],
+            mirror_paths=self.mirror_checkbox.isChecked(),
+            shared=self.task.shared if self.task else False,
+            backend=self.backend_combo.currentData(),
+            background=self.task.background if self.task else '#ffffff'
         )
 
 # Custom widget for task list items
@@ -463,6 +392,8 @@ class GlowButton(QPushButton):
 
 # Main window
 class FetchXWindow(QtWidgets.QWidget):
+    LOG_LINES = 1000
+
     def __init__(self, tray_app):
         super().__init__()
         self.tray_app = tray_app
@@ -473,10 +404,40 @@ class FetchXWindow(QtWidgets.QWidget):
         self.setAttribute(Qt.WidgetAttribute.WA_TranslucentBackground)
         self.drag_position = None
 
-        self.tasks = load_config()
+        # Saves are batched and written atomically, outside edits are applied as they happen
+        self.store = ConfigStore(log_callback=self.log)
+        self.tasks = self.store.tasks
+        settings = self.store.settings
+        self.engine = ImageEngine(settings.get("engine_workers", 0))
+        self.log_pipeline = LogPipeline(
+            max_pending=self.LOG_LINES,
+            log_file=settings.get("log_file") or None,
+            max_kb=settings.get("log_file_max_kb", 1024),
+            backups=settings.get("log_file_backups", 3)
+        )
+        # Checking whether a file is still being written must not be able to kill the app (see watch.is_held_open)
+        ignore_lease_breaks()
+        # One thread watches every task's folder and feeds the engine
+        self.scheduler = Scheduler(self.log, self.engine)
+        self.scheduler.start()
+        self.metrics_server = None
+        if settings.get("metrics_port"):
+            self.metrics_server = MetricsServer(port=settings["metrics_port"])
+            try:
+                self.metrics_server.start()
+            except OSError as e:
+                self.log(f"Could not start metrics endpoint on port {settings['metrics_port']}: {e}")
+                self.metrics_server = None
         self.last_enabled_states = {}
         self.paused = False
         self.init_ui()
+        # Watcher threads only queue log lines, the GUI thread picks them up in batches
+        self.log_timer = QtCore.QTimer(self)
+        self.log_timer.timeout.connect(self.flush_log)
+        self.log_timer.start(200)
+        self.config_timer = QtCore.QTimer(self)
+        self.config_timer.timeout.connect(self.poll_config)
+        self.config_timer.start(int(ConfigStore.POLL_INTERVAL * 1000))
         QtCore.QTimer.singleShot(100, self.auto_start_watchers)
 
     def init_ui(self):
@@ -679,11 +640,12 @@ class FetchXWindow(QtWidgets.QWidget):
         main_layout.addWidget(log_header)
 
         # Log box
-        self.log_box = QtWidgets.QTextEdit()
+        self.log_box = QtWidgets.QPlainTextEdit()
         self.log_box.setReadOnly(True)
+        self.log_box.setMaximumBlockCount(self.LOG_LINES)
         self.log_box.setMaximumHeight(150)
         self.log_box.setStyleSheet("""
-            QTextEdit {
+            QPlainTextEdit {
                 background: #252525;
                 border: 1px solid #444;
                 border-radius: 8px;
@@ -727,12 +689,30 @@ class FetchXWindow(QtWidgets.QWidget):
             event.accept()
 
     def log(self, msg):
-        self.log_box.append(msg)
-        # Auto-scroll to bottom and ensure cursor is at end
-        cursor = self.log_box.textCursor()
-        cursor.movePosition(QtGui.QTextCursor.MoveOperation.End)
-        self.log_box.setTextCursor(cursor)
-        self.log_box.ensureCursorVisible()
+        # Safe from any thread
+        self.log_pipeline.write(msg)
+
+    def flush_log(self):
+        # Nothing to draw while hidden in the tray, the pipeline keeps the latest lines
+        if not self.isVisible():
+            return
+        lines = self.log_pipeline.drain()
+        if not lines:
+            return
+        self.log_box.appendPlainText("\n".join(lines))
+        # Auto-scroll to bottom once per batch
+        scrollbar = self.log_box.verticalScrollBar()
+        scrollbar.setValue(scrollbar.maximum())
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.flush_log()
+
+    def poll_config(self):
+        changes = self.store.poll()
+        if changes:
+            apply_task_changes(self.scheduler, *changes)
+            self.refresh_task_list()
 
     def refresh_task_list(self):
         self.task_list.clear()
@@ -752,7 +732,7 @@ class FetchXWindow(QtWidgets.QWidget):
         if dlg.exec():
             new_task = dlg.get_task_data()
             self.tasks.append(new_task)
-            save_config(self.tasks)
+            self.store.save()
             self.refresh_task_list()
             if new_task.enabled:
                 self.start_task(new_task, len(self.tasks))
@@ -767,15 +747,15 @@ class FetchXWindow(QtWidgets.QWidget):
             if dlg.task_to_delete:
                 self.tasks.remove(dlg.task_to_delete)
                 self.stop_task(dlg.task_to_delete)
-                save_config(self.tasks)
+                self.store.save()
                 self.refresh_task_list()
             else:
-                self.stop_task(task)
-                self.tasks[idx] = dlg.get_task_data()
-                save_config(self.tasks)
+                # Only what changed is handed to the running task, no stop/restart
+                fields = update_task(task, dlg.get_task_data())
+                if fields:
+                    self.store.save()
+                    apply_task_changes(self.scheduler, self.tasks, [], [], [(task, fields)])
                 self.refresh_task_list()
-                if self.tasks[idx].enabled:
-                    self.start_task(self.tasks[idx], idx+1)
 
     def start_task(self, task, index):
         if not os.path.exists(task.output_folder):
@@ -784,18 +764,14 @@ class FetchXWindow(QtWidgets.QWidget):
             except Exception as e:
                 self.log(f"[Task {index}] Could not create output folder: {e}")
                 return
-        if task.thread and task.running:
+        if task.running:
             return
-        task.running = True
         task.enabled = bool(task.enabled)
-        task.thread = threading.Thread(target=watcher, args=(task, self.log, index), daemon=True)
-        task.thread.start()
+        self.scheduler.add_task(task, index)
 
     def stop_task(self, task):
         try:
-            task.running = False
-            if task.thread:
-                task.thread.join(timeout=1)
+            self.scheduler.remove_task(task)
         except Exception:
             pass
 
@@ -819,7 +795,7 @@ class FetchXWindow(QtWidgets.QWidget):
             return
         task = self.tasks[index]
         task.enabled = enabled
-        save_config(self.tasks)
+        self.store.save()
         if enabled:
             if not task.running:
                 self.start_task(task, index+1)
@@ -835,15 +811,7 @@ class FetchXWindow(QtWidgets.QWidget):
         if not path:
             return
         try:
-            data = {"tasks": [{
-                "name": t.name,
-                "watch_folder": t.watch_folder,
-                "output_folder": t.output_folder,
-                "width": t.width,
-                "height": t.height,
-                "enabled": t.enabled,
-                "format": t.format
-            } for t in self.tasks]}
+            data = {"tasks": [task_to_dict(t) for t in self.tasks]}
             with open(path, 'w') as f:
                 json.dump(data, f, indent=4)
             self.tray_app.tray_icon.showMessage("FetchX", "Config exported successfully", QtWidgets.QSystemTrayIcon.MessageIcon.Information)
@@ -857,22 +825,11 @@ class FetchXWindow(QtWidgets.QWidget):
         try:
             with open(path, 'r') as f:
                 data = json.load(f)
-            new_tasks = []
-            for t in data.get('tasks', []):
-                fmt = t.get('format', 'png')
-                new_tasks.append(Task(
-                    name=t.get('name', ''),
-                    watch_folder=t.get('watch_folder', ''),
-                    output_folder=t.get('output_folder', ''),
-                    width=int(t.get('width', 1366)),
-                    height=int(t.get('height', 768)),
-                    fmt=fmt,
-                    enabled=bool(t.get('enabled', True))
-                ))
+            new_tasks = [task_from_dict(t) for t in data.get('tasks', [])]
             for t in self.tasks:
                 self.stop_task(t)
-            self.tasks = new_tasks
-            save_config(self.tasks)
+            self.tasks[:] = new_tasks
+            self.store.save()
             self.refresh_task_list()
             self.auto_start_watchers()
             self.tray_app.tray_icon.showMessage("FetchX", "Config imported", QtWidgets.QSystemTrayIcon.MessageIcon.Information)
@@ -906,6 +863,9 @@ class FetchXApp(QtWidgets.QApplication):
     def __init__(self, sys_argv):
         super().__init__(sys_argv)
         self.settings_window = FetchXWindow(self)
+        self.aboutToQuit.connect(self.settings_window.store.flush)
+        self.aboutToQuit.connect(self.settings_window.scheduler.stop)
+        self.aboutToQuit.connect(self.settings_window.engine.shutdown)
         
         # Create tray icon with proper icon
         self.tray_icon = QtWidgets.QSystemTrayIcon(self.get_icon())
@@ -992,6 +952,8 @@ class FetchXApp(QtWidgets.QApplication):
         self.settings_window.activateWindow()
 
 if __name__ == "__main__":
+    # Needed for the engine's worker processes in the frozen .exe
+    multiprocessing.freeze_support()
     if os.name == 'nt':
         import ctypes
         ctypes.windll.kernel32.FreeConsole()
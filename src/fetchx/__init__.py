@@ -0,0 +1,31 @@
+# FetchX processing core.
+#
+# Nothing in this package imports PyQt6, so the watchers can run headless
+# (python -m fetchx run) as well as behind the tray app in FetchX_1.0.py.
+
+APP_VERSION = "Release 1.0"
+
+from .config import (
+    CONFIG_FILE, SUPPORTED_FORMATS, IMAGE_EXTENSIONS, WATCH_BACKENDS, DOWNSCALE_MODES, RESIZE_MODES,
+    RESAMPLE_FILTERS, ENCODER_PROFILES, OVERFLOW_POLICIES, IMAGE_BACKENDS, LOG_LEVEL_NAMES, DEFAULT_SETTINGS, Task,
+    output_from_dict, task_from_dict, task_to_dict, load_config, load_settings, save_config
+)
+from .imaging import (
+    SAVE_FORMATS, ENCODER_SETTINGS, random_name, short_path, job_options, save_format, encoder_settings,
+    scaled_size, resize_plan, draft_image, resize_image, prepare_for_format, convert_image,
+    render_image, finish_image, FORMAT_MODES, background_color, PillowBackend, get_backend, backend_available
+)
+from .watch import (
+    Inotify, ReadinessGate, is_held_open, ignore_lease_breaks, match_path
+)
+from .retry import QUARANTINE_DIR, RetryQueue
+from .journal import JOURNAL_DIR, Journal
+from .claims import CLAIMS_DIR, Claims
+from .engine import ImageEngine
+from .pipeline import MMAP_THRESHOLD, Pipeline, read_source
+from .metrics import METRICS, MetricsRegistry, MetricsServer
+from .logs import LOG_LEVELS, LogPipeline, open_log_file, task_logger
+from .scheduler import Scheduler
+from .store import ConfigStore, update_task, diff_tasks, apply_task_changes
+from .core import watcher
+from .batch import BatchStats, iter_images, run_batch
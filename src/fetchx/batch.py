@@ -0,0 +1,151 @@
+import os
+import time
+import threading
+
+from .imaging import job_options
+from .pipeline import Pipeline
+from .watch import INTERNAL_DIR_PREFIX, is_image_name, match_path
+
+# One-shot batch / backfill
+#
+# Walks an existing folder tree once and converts everything in it with the
+# task's settings. The tree is streamed twice (once to size it for the ETA,
+# once to submit work) so nothing grows with the number of files.
+
+def iter_images(folder, recursive=True, exclude=(), include_globs=(), exclude_globs=()):
+    stack = [folder]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if (recursive and os.path.abspath(entry.path) not in exclude
+                                    and not entry.name.startswith(INTERNAL_DIR_PREFIX)
+                                    and match_path(os.path.relpath(entry.path, folder), exclude=exclude_globs)):
+                                stack.append(entry.path)
+                        elif entry.is_file() and is_image_name(entry.name):
+                            if ((include_globs or exclude_globs)
+                                    and not match_path(os.path.relpath(entry.path, folder), include_globs, exclude_globs)):
+                                continue
+                            yield entry.path, entry.stat().st_size
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds}s"
+
+
+class BatchStats:
+    def __init__(self, total_files, total_bytes):
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.done = 0
+        self.failed = 0
+        self.done_bytes = 0
+        self.errors = []
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+
+    def record(self, src_path, size, error=None):
+        with self.lock:
+            self.done_bytes += size
+            if error is None:
+                self.done += 1
+            else:
+                self.failed += 1
+                # Keep a handful for the summary, the count says the rest
+                if len(self.errors) < 20:
+                    self.errors.append((src_path, error))
+            self.changed.notify_all()
+
+    def wait_for(self, count, timeout):
+        with self.changed:
+            return self.changed.wait_for(lambda: self.done + self.failed >= count, timeout)
+
+    def progress_line(self):
+        with self.lock:
+            finished = self.done + self.failed
+            elapsed = max(time.monotonic() - self.started, 1e-6)
+            files_rate = finished / elapsed
+            mb_rate = self.done_bytes / elapsed / (1024 * 1024)
+            remaining = max(self.total_files - finished, 0)
+            eta = format_duration(remaining / files_rate) if files_rate > 0 else "?"
+            percent = finished * 100 / self.total_files if self.total_files else 100
+            return (f"{finished}/{self.total_files} ({percent:.1f}%)  {files_rate:.1f} files/s  "
+                    f"{mb_rate:.1f} MB/s  ETA {eta}  failed {self.failed}")
+
+    def summary(self):
+        elapsed = time.monotonic() - self.started
+        lines = [f"Processed {self.done} files, {self.failed} failed, "
+                 f"{self.done_bytes / (1024 * 1024):.1f} MB in {format_duration(elapsed)} "
+                 f"({(self.done + self.failed) / max(elapsed, 1e-6):.1f} files/s)"]
+        for src_path, error in self.errors:
+            lines.append(f"  ✘ {src_path}: {error}")
+        if self.failed > len(self.errors):
+            lines.append(f"  ... and {self.failed - len(self.errors)} more")
+        return "\n".join(lines)
+
+
+def run_batch(task, engine=None, folder=None, recursive=True, keep_source=False,
+              progress_callback=None, progress_interval=0.5):
+    folder = folder or task.watch_folder
+    os.makedirs(task.output_folder, exist_ok=True)
+    # Never walk into our own output when it lives inside the source tree,
+    # or into files the watcher already gave up on (the .fetchx_ folders)
+    exclude = {os.path.abspath(task.output_folder)} | {os.path.abspath(o["output_folder"])
+                                                       for o in task.extra_outputs if o["output_folder"]}
+    walk = (folder, recursive, exclude, task.include, task.exclude)
+
+    total_files = total_bytes = 0
+    for _, size in iter_images(*walk):
+        total_files += 1
+        total_bytes += size
+    stats = BatchStats(total_files, total_bytes)
+
+    options = job_options(task)
+    options["keep_source"] = keep_source
+    last_report = [0.0]
+
+    def report(force=False):
+        now = time.monotonic()
+        if progress_callback and (force or now - last_report[0] >= progress_interval):
+            last_report[0] = now
+            progress_callback(stats.progress_line())
+
+    def on_done(src_path, size, result, error):
+        if error is not None:
+            error = str(error) or type(error).__name__
+        elif not result["output"]:
+            error = "output was not written"
+        stats.record(src_path, size, error)
+
+    # Reading the next files and writing the last ones overlaps with the
+    # conversions, which matters on slow disks and network shares
+    pipeline = Pipeline(engine)
+    submitted = 0
+    for src_path, size in iter_images(*walk):
+        job = options
+        if task.mirror_paths:
+            job = dict(options, subdir=os.path.dirname(os.path.relpath(src_path, folder)))
+        # submit() blocks once the pipeline is full, so only a bounded
+        # number of files is ever read ahead or waiting to be written
+        pipeline.submit(task, src_path, job, lambda r, e, p=src_path, s=size: on_done(p, s, r, e))
+        submitted += 1
+        report()
+
+    while not stats.wait_for(submitted, progress_interval):
+        report()
+    pipeline.shutdown()
+    report(force=True)
+    return stats
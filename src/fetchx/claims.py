@@ -0,0 +1,195 @@
+import os
+import json
+import time
+import shutil
+import socket
+import secrets
+
+from .config import IMAGE_EXTENSIONS
+from .journal import Journal, JOURNAL_DIR
+from .watch import INTERNAL_DIR_PREFIX
+
+# Shared watch folders
+#
+# Several FetchX instances (processes, or machines on one NFS/SMB share)
+# can drain the same watch folder. An instance claims a file by renaming
+# it into its own folder under .fetchx_claims/<instance>/; rename is atomic
+# on the file server, so exactly one instance gets each file and the
+# others see it vanish. The claimed file is converted from there and its
+# journal lives in the same folder.
+#
+# Every instance rewrites a lease file in its folder with a beat counter.
+# An instance whose counter hasn't moved for LEASE_TIMEOUT (timed with the
+# observer's own clock, so clock skew between machines doesn't matter), or
+# whose process is known to be dead on this host, is stale. Whoever first
+# renames a stale folder into its own .fetchx_adopted/ recovers it: the
+# stale journal is replayed and every claimed file still there goes back
+# into the watch folder for anyone to pick up.
+
+CLAIMS_DIR = '.fetchx_claims'
+ADOPTED_DIR = '.fetchx_adopted'
+LEASE_FILE = 'lease.json'
+LEASE_INTERVAL = 5.0
+LEASE_TIMEOUT = 30.0
+
+
+def instance_id():
+    return f"{socket.gethostname()}-{os.getpid()}-{secrets.token_hex(3)}"
+
+
+def pid_alive(pid):
+    if os.name == 'nt':
+        # No cheap check, stale instances are found by their lease instead
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+def claimed_files(folder):
+    # Relative names of the images in a claim folder, skipping its own bookkeeping
+    stack = ['']
+    while stack:
+        rel_dir = stack.pop()
+        try:
+            with os.scandir(os.path.join(folder, rel_dir)) as it:
+                for entry in it:
+                    rel_name = os.path.join(rel_dir, entry.name) if rel_dir else entry.name
+                    if entry.is_dir(follow_symlinks=False):
+                        if not entry.name.startswith(INTERNAL_DIR_PREFIX):
+                            stack.append(rel_name)
+                    elif entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                        yield rel_name
+        except OSError:
+            continue
+
+
+class Claims:
+    def __init__(self, folder, task_name, instance=None):
+        self.folder = folder
+        self.task_name = task_name
+        self.instance = instance or instance_id()
+        self.root = os.path.join(folder, CLAIMS_DIR)
+        self.dir = os.path.join(self.root, self.instance)
+        self.beat = 0
+        # other instance -> (last beat seen, monotonic time it was first seen)
+        self._beats = {}
+
+    def start(self):
+        os.makedirs(self.dir, exist_ok=True)
+        self.heartbeat()
+
+    def heartbeat(self):
+        self.beat += 1
+        lease = {"instance": self.instance, "task": self.task_name, "host": socket.gethostname(),
+                 "pid": os.getpid(), "beat": self.beat, "time": time.time()}
+        path = os.path.join(self.dir, LEASE_FILE)
+        try:
+            with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(lease, f)
+            os.replace(path + '.tmp', path)
+        except OSError:
+            pass
+
+    def claim(self, name):
+        # Path of the claimed file, None when another instance was faster
+        dest_path = os.path.join(self.dir, name)
+        for attempt in range(2):
+            try:
+                if os.path.dirname(name):
+                    os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+                os.rename(os.path.join(self.folder, name), dest_path)
+                return dest_path
+            except FileNotFoundError:
+                if attempt or os.path.isdir(self.dir):
+                    return None
+                # Our folder was adopted after we stalled past the lease, start over
+                self.start()
+        return None
+
+    def release(self, name):
+        # Put a claimed file back, e.g. to be retried or quarantined
+        return move_back(os.path.join(self.dir, name), self.folder, name)
+
+    def stale(self):
+        try:
+            others = [e.name for e in os.scandir(self.root) if e.is_dir() and e.name != self.instance]
+        except OSError:
+            return []
+        now = time.monotonic()
+        stale = []
+        for other in others:
+            try:
+                with open(os.path.join(self.root, other, LEASE_FILE), 'r', encoding='utf-8') as f:
+                    lease = json.load(f)
+            except (OSError, ValueError):
+                lease = {}
+            if lease.get("host") == socket.gethostname() and lease.get("pid") and not pid_alive(lease["pid"]):
+                stale.append(other)
+                continue
+            beat = lease.get("beat")
+            seen = self._beats.get(other)
+            if seen is None or seen[0] != beat:
+                self._beats[other] = (beat, now)
+            elif now - seen[1] >= LEASE_TIMEOUT:
+                stale.append(other)
+        for other in set(self._beats).difference(others):
+            del self._beats[other]
+        return stale
+
+    def adopt(self, other):
+        # Returns how many files went back into the watch folder, None if
+        # another instance got to the stale folder first
+        adopted = os.path.join(self.dir, ADOPTED_DIR, other)
+        try:
+            os.makedirs(os.path.dirname(adopted), exist_ok=True)
+            os.rename(os.path.join(self.root, other), adopted)
+        except OSError:
+            return None
+        self._beats.pop(other, None)
+        return self.recover(adopted)
+
+    def recover(self, folder):
+        moved = 0
+        # A folder adopted by an instance that died while recovering it
+        nested = os.path.join(folder, ADOPTED_DIR)
+        if os.path.isdir(nested):
+            for other in os.listdir(nested):
+                moved += self.recover(os.path.join(nested, other))
+        try:
+            with open(os.path.join(folder, LEASE_FILE), 'r', encoding='utf-8') as f:
+                task_name = json.load(f).get("task", self.task_name)
+        except (OSError, ValueError):
+            task_name = self.task_name
+        if os.path.exists(os.path.join(folder, JOURNAL_DIR)):
+            journal = Journal(folder, task_name, exclusive=True)
+            journal.recover()
+            journal.close()
+        for name in list(claimed_files(folder)):
+            if move_back(os.path.join(folder, name), self.folder, name):
+                moved += 1
+        shutil.rmtree(folder, ignore_errors=True)
+        return moved
+
+    def close(self):
+        # Leave the folder behind if files are still in it, it gets recovered like a crash
+        if not any(True for _ in claimed_files(self.dir)):
+            shutil.rmtree(self.dir, ignore_errors=True)
+
+
+def move_back(path, folder, name):
+    dest_path = os.path.join(folder, name)
+    if os.path.exists(dest_path):
+        # A new file took the name meanwhile
+        base, ext = os.path.splitext(dest_path)
+        dest_path = f"{base}_{time.strftime('%Y%m%d%H%M%S')}{ext}"
+    try:
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        os.rename(path, dest_path)
+    except OSError:
+        return False
+    return True
@@ -0,0 +1,172 @@
+import os
+import sys
+import time
+import signal
+import argparse
+import threading
+
+from . import APP_VERSION
+from .config import CONFIG_FILE, IMAGE_BACKENDS, load_config, load_settings
+from .engine import ImageEngine
+from .scheduler import Scheduler
+from .watch import ignore_lease_breaks
+from .store import ConfigStore, apply_task_changes
+from .batch import run_batch
+from .imaging import backend_available
+from .metrics import MetricsServer
+from .logs import open_log_file
+
+# Headless entry point: python -m fetchx run --config fetchx_config.json
+
+log_file = None
+
+
+def print_log(msg):
+    print(f"{time.strftime('%H:%M:%S')} {msg}", flush=True)
+    if log_file:
+        log_file.info(msg)
+
+
+def run(args):
+    global log_file
+    if not os.path.exists(args.config):
+        print_log(f"Config file not found: {args.config}")
+        return 1
+    store = ConfigStore(args.config, print_log)
+    settings = store.settings
+    log_path = args.log_file or settings.get("log_file")
+    if log_path:
+        log_file = open_log_file(log_path, settings.get("log_file_max_kb", 1024), settings.get("log_file_backups", 3))
+    def selected(task):
+        return not args.task or task.name in args.task
+
+    # Keep the same task numbers as the tray app shows
+    tasks = [(i, t) for i, t in enumerate(store.tasks, 1) if t.enabled and selected(t)]
+    if not tasks:
+        print_log("No enabled tasks to run")
+        return 1
+
+    engine = None
+    if not args.no_pool:
+        workers = args.workers if args.workers is not None else settings.get("engine_workers", 0)
+        engine = ImageEngine(workers)
+
+    metrics_server = None
+    metrics_port = args.metrics_port if args.metrics_port is not None else settings.get("metrics_port", 0)
+    if metrics_port:
+        metrics_server = MetricsServer(port=metrics_port)
+        try:
+            metrics_server.start()
+            print_log(f"Metrics on http://127.0.0.1:{metrics_port}/metrics")
+        except OSError as e:
+            print_log(f"Could not start metrics endpoint on port {metrics_port}: {e}")
+            metrics_server = None
+
+    stop = threading.Event()
+
+    def handle_signal(signum, frame):
+        print_log(f"Received {signal.Signals(signum).name}, shutting down")
+        stop.set()
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+    # See watch.is_held_open
+    ignore_lease_breaks()
+
+    scheduler = Scheduler(print_log, engine)
+    scheduler.start()
+    for index, task in tasks:
+        scheduler.add_task(task, index)
+
+    # Edits to the config file are applied to the running tasks as they happen
+    while not stop.wait(store.POLL_INTERVAL):
+        changes = store.poll()
+        if changes:
+            apply_task_changes(scheduler, *changes, selected=selected)
+
+    scheduler.stop()
+    if engine:
+        # Let conversions that already started finish writing
+        engine.shutdown(wait=True)
+    if metrics_server:
+        metrics_server.stop()
+    return 0
+
+
+def batch(args):
+    if not os.path.exists(args.config):
+        print_log(f"Config file not found: {args.config}")
+        return 1
+    matches = [t for t in load_config(args.config) if t.name == args.task]
+    if not matches:
+        print_log(f"No task named '{args.task}' in {args.config}")
+        return 1
+    task = matches[0]
+    if args.backend:
+        task.backend = args.backend
+    if not backend_available(task.backend):
+        print_log(f"The {task.backend} image backend is not installed, converting with Pillow")
+    folder = args.folder or task.watch_folder
+    if not os.path.isdir(folder):
+        print_log(f"Folder does not exist: {folder}")
+        return 1
+
+    engine = None
+    if not args.no_pool:
+        workers = args.workers if args.workers is not None else load_settings(args.config).get("engine_workers", 0)
+        engine = ImageEngine(workers)
+        # The batch should be able to use the whole pool
+        task.max_workers = 0
+
+    interactive = sys.stderr.isatty()
+
+    def show_progress(line):
+        if interactive:
+            sys.stderr.write(f"\r\033[K{line}")
+        else:
+            sys.stderr.write(f"{line}\n")
+        sys.stderr.flush()
+
+    print_log(f"Batch converting {folder} → {task.output_folder} ({task.width}×{task.height} .{task.format})")
+    try:
+        stats = run_batch(task, engine, folder=folder, recursive=not args.no_recursive,
+                          keep_source=args.keep_source, progress_callback=show_progress)
+    finally:
+        if engine:
+            engine.shutdown(wait=True)
+    if interactive:
+        sys.stderr.write("\n")
+    print(stats.summary(), flush=True)
+    return 1 if stats.failed else 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="fetchx", description="FetchX auto image processing, without the GUI")
+    parser.add_argument("--version", action="version", version=f"FetchX {APP_VERSION}")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_cmd = commands.add_parser("run", help="watch folders and process images until stopped")
+    run_cmd.add_argument("--config", default=CONFIG_FILE, help=f"config file (default: {CONFIG_FILE})")
+    run_cmd.add_argument("--task", action="append", metavar="NAME", help="only run this task, can be repeated")
+    run_cmd.add_argument("--workers", type=int, help="worker processes (default: settings.engine_workers)")
+    run_cmd.add_argument("--no-pool", action="store_true", help="convert on a single render thread in this process, no worker processes")
+    run_cmd.add_argument("--log-file", help="also write the log to this rotating file (default: settings.log_file)")
+    run_cmd.add_argument("--metrics-port", type=int, help="serve metrics on localhost:PORT (default: settings.metrics_port)")
+    run_cmd.set_defaults(func=run)
+
+    batch_cmd = commands.add_parser("batch", help="convert everything already in a folder tree once, then exit")
+    batch_cmd.add_argument("task", metavar="TASK", help="task whose size and format to use")
+    batch_cmd.add_argument("--config", default=CONFIG_FILE, help=f"config file (default: {CONFIG_FILE})")
+    batch_cmd.add_argument("--folder", help="folder to convert (default: the task's watch folder)")
+    batch_cmd.add_argument("--workers", type=int, help="worker processes (default: settings.engine_workers)")
+    batch_cmd.add_argument("--no-pool", action="store_true", help="convert on a single render thread in this process, no worker processes")
+    batch_cmd.add_argument("--no-recursive", action="store_true", help="skip subfolders")
+    batch_cmd.add_argument("--backend", choices=IMAGE_BACKENDS, help="image engine (default: the task's backend)")
+    batch_cmd.add_argument("--keep-source", action="store_true", help="leave the original files in place")
+    batch_cmd.set_defaults(func=batch)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
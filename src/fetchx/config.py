@@ -0,0 +1,234 @@
+import os
+import json
+
+CONFIG_FILE = "fetchx_config.json"
+
+SUPPORTED_FORMATS = ['png', 'jpg', 'jpeg', 'webp', 'bmp', 'tiff']
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.bmp', '.tiff')
+
+# 'auto' picks inotify on Linux and falls back to polling everywhere else
+WATCH_BACKENDS = ['auto', 'inotify', 'polling']
+
+# How big-to-small conversions trade quality for speed:
+# quality  - full decode, then one resample (old behaviour)
+# balanced - JPEG draft decode and reduce() down to ~3x the target, then bicubic
+# fast     - JPEG draft decode and reduce() as close to the target as possible, then bilinear
+DOWNSCALE_MODES = ['quality', 'balanced', 'fast']
+
+# How the source is fitted into width x height:
+# stretch - exactly width x height, aspect ratio ignored (old behaviour)
+# fit     - as large as possible inside width x height, aspect kept
+# fill    - covers width x height, aspect kept, the overflow is cropped evenly
+# shrink  - like fit, but never enlarges smaller sources
+RESIZE_MODES = ['stretch', 'fit', 'fill', 'shrink']
+
+# Resampling filter, 'auto' lets the downscale mode pick (bicubic, bilinear for fast)
+RESAMPLE_FILTERS = ['auto', 'nearest', 'bilinear', 'box', 'bicubic', 'lanczos']
+
+# Encoder settings per output format, see ENCODER_SETTINGS in imaging.py:
+# speed    - cheapest encode, bigger files (PNG zlib level 1, WebP method 0)
+# balanced - Pillow's defaults (old behaviour)
+# size     - smallest files, slowest encode (PNG level 9, optimized/progressive JPEG, WebP method 6, deflate TIFF)
+ENCODER_PROFILES = ['speed', 'balanced', 'size']
+
+# What a task does with new files once queue_limit files are already waiting:
+# block        - take no more until there is room again, then rescan the folder for the rest
+# defer        - leave the rest for the task's next regular rescan
+# drop-oldest  - make room by dropping the oldest waiting file (left in the folder, counted as dropped)
+# newest-first - serve the newest files first, the oldest ones are pushed out and rescanned later
+OVERFLOW_POLICIES = ['block', 'defer', 'drop-oldest', 'newest-first']
+
+# Engine doing the pixel work: Pillow, or libvips through the optional pyvips
+# package (streams big images instead of holding them decoded, uses every core)
+IMAGE_BACKENDS = ['pillow', 'vips']
+
+# Per-task log verbosity, lines below the level are not logged at all
+LOG_LEVEL_NAMES = ['error', 'warning', 'info', 'debug']
+
+# Global (non per-task) settings, stored under "settings" in the config file.
+# engine_workers = 0 means one worker process per CPU core.
+# metrics_port = 0 keeps the localhost metrics endpoint off.
+# log_file = "" keeps the rotating log file off.
+DEFAULT_SETTINGS = {
+    "engine_workers": 0,
+    "metrics_port": 0,
+    "log_file": "",
+    "log_file_max_kb": 1024,
+    "log_file_backups": 3
+}
+
+class Task:
+    def __init__(self, name, watch_folder, output_folder, width, height, fmt='png', enabled=True,
+                 watch_backend='auto', max_workers=0, downscale='quality', log_level='info',
+                 settle_time=1.0, max_attempts=5, retry_delay=2.0, extra_outputs=None,
+                 encoder='balanced', encoder_options=None, resize_mode='stretch', resample='auto',
+                 reducing_gap=0.0, priority=0, weight=1, queue_limit=1000, overflow='block',
+                 recursive=False, include=None, exclude=None, mirror_paths=False, shared=False, backend='pillow',
+                 background='#ffffff'):
+        self.name = name
+        self.watch_folder = watch_folder
+        self.output_folder = output_folder
+        self.width = width
+        self.height = height
+        self.format = fmt if fmt else 'png'
+        self.enabled = enabled
+        self.watch_backend = watch_backend if watch_backend in WATCH_BACKENDS else 'auto'
+        # Max images of this task converted at once, 0 = no cap besides the pool size
+        self.max_workers = max(0, int(max_workers or 0))
+        self.downscale = downscale if downscale in DOWNSCALE_MODES else 'quality'
+        self.log_level = log_level if log_level in LOG_LEVEL_NAMES else 'info'
+        # Seconds a file's size and mtime must stay put before it counts as fully written
+        self.settle_time = max(0.0, float(settle_time if settle_time is not None else 1.0))
+        # Failed files are retried with doubling delays, then quarantined, 0 = retry forever
+        self.max_attempts = max(0, int(max_attempts if max_attempts is not None else 5))
+        self.retry_delay = max(0.1, float(retry_delay or 2.0))
+        # More sizes/formats made from the same decode, e.g. a thumbnail next to the main image
+        self.extra_outputs = [output_from_dict(o) for o in extra_outputs or []]
+        self.encoder = encoder if encoder in ENCODER_PROFILES else 'balanced'
+        # Per-format Pillow save() options on top of the profile, e.g. {"webp": {"lossless": true}}
+        self.encoder_options = dict(encoder_options or {})
+        self.resize_mode = resize_mode if resize_mode in RESIZE_MODES else 'stretch'
+        self.resample = resample if resample in RESAMPLE_FILTERS else 'auto'
+        # Pillow's reducing_gap, 0 = whatever the downscale mode uses
+        self.reducing_gap = max(0.0, float(reducing_gap or 0.0))
+        # Higher priority tasks are always served first, equal ones share the pool by weight
+        self.priority = int(priority or 0)
+        self.weight = max(1, int(weight or 1))
+        # Files waiting for a worker, 0 = unbounded
+        self.queue_limit = max(0, int(queue_limit if queue_limit is not None else 1000))
+        self.overflow = overflow if overflow in OVERFLOW_POLICIES else 'block'
+        # Watch subfolders too, optionally recreating their layout under the output folder
+        self.recursive = bool(recursive)
+        # Glob patterns on the path relative to the watch folder, e.g. "*.png" or "raw/*",
+        # no include patterns means every image
+        self.include = [str(p) for p in include or [] if p]
+        self.exclude = [str(p) for p in exclude or [] if p]
+        self.mirror_paths = bool(mirror_paths)
+        # Other FetchX instances drain the same watch folder, files are claimed before converting
+        self.shared = bool(shared)
+        self.backend = backend if backend in IMAGE_BACKENDS else 'pillow'
+        # Transparency is flattened onto this colour for formats without alpha (JPEG)
+        self.background = str(background or '#ffffff')
+        self.running = False
+
+# Config handling
+
+def output_from_dict(o):
+    fmt = o.get('format', o.get('fmt', 'png'))
+    downscale = o.get('downscale', 'quality')
+    return {
+        "width": int(o.get('width', 320)),
+        "height": int(o.get('height', 180)),
+        "format": fmt if fmt in SUPPORTED_FORMATS else 'png',
+        "downscale": downscale if downscale in DOWNSCALE_MODES else 'quality',
+        # Empty means the task's output folder / encoder profile / resize mode / filter
+        "output_folder": o.get('output_folder', ''),
+        "encoder": o.get('encoder', '') if o.get('encoder', '') in ENCODER_PROFILES else '',
+        "resize_mode": o.get('resize_mode', '') if o.get('resize_mode', '') in RESIZE_MODES else '',
+        "resample": o.get('resample', '') if o.get('resample', '') in RESAMPLE_FILTERS else ''
+    }
+
+
+def task_from_dict(t):
+    return Task(
+        name=t.get('name', ''),
+        watch_folder=t.get('watch_folder', ''),
+        output_folder=t.get('output_folder', ''),
+        width=int(t.get('width', 1366)),
+        height=int(t.get('height', 768)),
+        fmt=t.get('format', t.get('fmt', 'png')),
+        enabled=bool(t.get('enabled', True)),
+        watch_backend=t.get('watch_backend', 'auto'),
+        max_workers=t.get('max_workers', 0),
+        downscale=t.get('downscale', 'quality'),
+        log_level=t.get('log_level', 'info'),
+        settle_time=t.get('settle_time', 1.0),
+        max_attempts=t.get('max_attempts', 5),
+        retry_delay=t.get('retry_delay', 2.0),
+        extra_outputs=t.get('extra_outputs', []),
+        encoder=t.get('encoder', 'balanced'),
+        encoder_options=t.get('encoder_options', {}),
+        resize_mode=t.get('resize_mode', 'stretch'),
+        resample=t.get('resample', 'auto'),
+        reducing_gap=t.get('reducing_gap', 0.0),
+        priority=t.get('priority', 0),
+        weight=t.get('weight', 1),
+        queue_limit=t.get('queue_limit', 1000),
+        overflow=t.get('overflow', 'block'),
+        recursive=t.get('recursive', False),
+        include=t.get('include', []),
+        exclude=t.get('exclude', []),
+        mirror_paths=t.get('mirror_paths', False),
+        shared=t.get('shared', False),
+        backend=t.get('backend', 'pillow'),
+        background=t.get('background', '#ffffff')
+    )
+
+
+def task_to_dict(t):
+    return {
+        "name": t.name,
+        "watch_folder": t.watch_folder,
+        "output_folder": t.output_folder,
+        "width": t.width,
+        "height": t.height,
+        "enabled": t.enabled,
+        "format": t.format,
+        "watch_backend": t.watch_backend,
+        "max_workers": t.max_workers,
+        "downscale": t.downscale,
+        "log_level": t.log_level,
+        "settle_time": t.settle_time,
+        "max_attempts": t.max_attempts,
+        "retry_delay": t.retry_delay,
+        "extra_outputs": [dict(o) for o in t.extra_outputs],
+        "encoder": t.encoder,
+        "encoder_options": t.encoder_options,
+        "resize_mode": t.resize_mode,
+        "resample": t.resample,
+        "reducing_gap": t.reducing_gap,
+        "priority": t.priority,
+        "weight": t.weight,
+        "queue_limit": t.queue_limit,
+        "overflow": t.overflow,
+        "recursive": t.recursive,
+        "include": list(t.include),
+        "exclude": list(t.exclude),
+        "mirror_paths": t.mirror_paths,
+        "shared": t.shared,
+        "backend": t.backend,
+        "background": t.background
+    }
+
+
+def load_config(path=None):
+    path = path or CONFIG_FILE
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            data = json.load(f)
+            return [task_from_dict(t) for t in data.get("tasks", [])]
+    return []
+
+
+def load_settings(path=None):
+    path = path or CONFIG_FILE
+    settings = dict(DEFAULT_SETTINGS)
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            settings.update(json.load(f).get("settings", {}))
+    return settings
+
+
+def save_config(tasks, settings=None, path=None):
+    path = path or CONFIG_FILE
+    if settings is None:
+        settings = load_settings(path)
+    data = {"settings": settings, "tasks": [task_to_dict(t) for t in tasks]}
+    # Write next to the real file and swap it in, so a crash mid-write
+    # leaves the previous config instead of half a JSON document
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=4)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
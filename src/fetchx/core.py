@@ -0,0 +1,20 @@
+import time
+
+from .scheduler import Scheduler
+
+# Watcher function
+#
+# Kept for callers that still run one thread per task: the task gets a
+# scheduler of its own and this thread just waits until task.running is
+# cleared. The app and the CLI put all their tasks on one shared Scheduler.
+
+def watcher(task, log_callback, task_index, engine=None):
+    scheduler = Scheduler(log_callback, engine)
+    scheduler.start()
+    scheduler.add_task(task, task_index)
+    try:
+        while task.running:
+            time.sleep(0.2)
+    finally:
+        scheduler.remove_task(task)
+        scheduler.stop()
@@ -0,0 +1,84 @@
+import os
+import signal
+import threading
+import weakref
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Image engine
+#
+# One process pool shared by every task, so decode/resize/encode of a burst
+# isn't stuck on a single core behind the GIL. Jobs only carry plain data
+# (paths and an options dict) so they can be sent to the worker processes.
+#
+# Workers are never forked from this process: a forked worker would inherit
+# every descriptor open at that moment, including files the writer threads
+# or a producer in the same process are still writing, and the readiness
+# gate would then see those files as held open for as long as the worker
+# lives. forkserver (spawn where there is none) starts them clean; like on
+# Windows, a script using the engine then needs the __main__ guard.
+#
+# Workers don't keep the parent's signal handlers either. Ctrl+C reaches the
+# whole process group, so workers ignore SIGINT and the parent decides what
+# happens to the jobs in flight; SIGTERM kills a worker like any process.
+
+
+def pool_context():
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+def init_worker():
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+
+class ImageEngine:
+    def __init__(self, workers=0):
+        self.workers = workers if workers and workers > 0 else (os.cpu_count() or 1)
+        self._executor = None
+        self._lock = threading.Lock()
+        self._task_slots = weakref.WeakKeyDictionary()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=pool_context(),
+                                                     initializer=init_worker)
+            return self._executor
+
+    def _slots_for(self, task):
+        with self._lock:
+            limit = task.max_workers or self.workers
+            slots = self._task_slots.get(task)
+            if slots is None or slots[0] != limit:
+                slots = (limit, threading.BoundedSemaphore(limit))
+                self._task_slots[task] = slots
+            return slots[1]
+
+    def submit(self, task, fn, *args, block=True):
+        # Blocks while the task already has max_workers jobs in flight, or
+        # returns None right away when block is False
+        slots = self._slots_for(task)
+        if not slots.acquire(blocking=block):
+            return None
+        try:
+            try:
+                future = self._get_executor().submit(fn, *args)
+            except BrokenProcessPool:
+                # A worker died (e.g. a decoder crash), start over with a fresh pool
+                with self._lock:
+                    self._executor = None
+                future = self._get_executor().submit(fn, *args)
+        except Exception:
+            slots.release()
+            raise
+        future.add_done_callback(lambda f: slots.release())
+        return future
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=wait, cancel_futures=not wait)
@@ -0,0 +1,466 @@
+import io
+import os
+import time
+import errno
+import shutil
+import random
+import string
+from PIL import Image as PILImage, ImageColor
+
+# Utilities
+
+def random_name(ext='png'):
+    return ''.join(random.choices(string.ascii_letters + string.digits, k=8)) + f".{ext}"
+
+
+def short_path(path):
+    parts = os.path.normpath(path).split(os.sep)
+    return "/".join(parts[-2:]) + "/" if len(parts) >= 2 else path
+
+# Conversion
+
+def job_options(task):
+    primary = {
+        "output_folder": task.output_folder,
+        "width": task.width,
+        "height": task.height,
+        "format": task.format,
+        "downscale": task.downscale,
+        "encoder": task.encoder,
+        "encoder_options": task.encoder_options,
+        "resize_mode": task.resize_mode,
+        "resample": task.resample,
+        "reducing_gap": task.reducing_gap,
+        "background": task.background
+    }
+    outputs = [primary] + [dict(o, output_folder=o["output_folder"] or task.output_folder,
+                                encoder=o["encoder"] or task.encoder, encoder_options=task.encoder_options,
+                                resize_mode=o["resize_mode"] or task.resize_mode,
+                                resample=o["resample"] or task.resample, reducing_gap=task.reducing_gap,
+                                background=task.background)
+                           for o in task.extra_outputs]
+    return dict(primary, outputs=outputs, keep_source=False, backend=task.backend)
+
+
+RESAMPLE = {
+    'nearest': PILImage.Resampling.NEAREST,
+    'bilinear': PILImage.Resampling.BILINEAR,
+    'box': PILImage.Resampling.BOX,
+    'bicubic': PILImage.Resampling.BICUBIC,
+    'lanczos': PILImage.Resampling.LANCZOS
+}
+
+
+def scaled_size(src_size, size, resize_mode='stretch'):
+    # Size of the whole source once scaled for this mode (bigger than size for fill)
+    width, height = src_size
+    if resize_mode == 'stretch':
+        return tuple(size)
+    if resize_mode == 'fill':
+        scale = max(size[0] / width, size[1] / height)
+    else:
+        scale = min(size[0] / width, size[1] / height)
+        if resize_mode == 'shrink':
+            scale = min(scale, 1.0)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def resize_plan(src_size, size, resize_mode='stretch'):
+    # Output size, and the part of the source that ends up in it
+    width, height = src_size
+    if resize_mode != 'fill':
+        return scaled_size(src_size, size, resize_mode), (0, 0, width, height)
+    scale = max(size[0] / width, size[1] / height)
+    box_width, box_height = size[0] / scale, size[1] / scale
+    left, top = (width - box_width) / 2, (height - box_height) / 2
+    return tuple(size), (left, top, left + box_width, top + box_height)
+
+
+# Modes Pillow can't resize() or reduce()
+UNRESAMPLED_MODES = ('I;16', 'I;16L', 'I;16B', 'I;16N')
+
+
+def draft_image(img, size, downscale='quality'):
+    # Let the JPEG decoder scale in the DCT domain (never below the target)
+    if downscale != 'quality' and img.format == 'JPEG' and img.width > size[0] and img.height > size[1]:
+        img.draft(img.mode, size)
+
+
+def resize_image(img, size, downscale='quality', resize_mode='stretch', resample='auto', reducing_gap=0.0):
+    out_size, box = resize_plan(img.size, size, resize_mode)
+    if out_size == img.size and box == (0, 0, img.width, img.height):
+        # Already the right size, nothing to resample
+        return img
+    if img.mode in UNRESAMPLED_MODES:
+        # 16 bit TIFFs and PNGs, resampled as 32 bit; prepare_for_format() narrows them again
+        img = img.convert('I')
+    box_width, box_height = box[2] - box[0], box[3] - box[1]
+    shrinking = box_width > out_size[0] and box_height > out_size[1]
+    if resample != 'auto':
+        resample_filter = RESAMPLE[resample]
+    elif downscale == 'fast' and shrinking:
+        resample_filter = PILImage.Resampling.BILINEAR
+    else:
+        resample_filter = PILImage.Resampling.BICUBIC
+    if resample_filter != PILImage.Resampling.NEAREST and img.mode in ('P', 'PA', '1'):
+        # Pillow resizes palette and bilevel images with nearest whatever the
+        # filter, resample the colours instead; prepare_for_format() narrows them again
+        if img.mode == '1':
+            img = img.convert('L')
+        else:
+            img = img.convert('RGBA' if img.has_transparency_data else 'RGB')
+    gap = reducing_gap or None
+    if shrinking and downscale == 'balanced' and gap is None:
+        # Have Pillow reduce() anything past 3x before the final resample
+        gap = 3.0
+    if shrinking and downscale == 'fast':
+        factor = (max(1, int(box_width // out_size[0])), max(1, int(box_height // out_size[1])))
+        # reduce() has no palette/bilevel support, only left here with the nearest filter
+        if factor != (1, 1) and img.mode not in ('P', '1'):
+            img = img.reduce(factor, box=tuple(round(v) for v in box))
+            box = None
+    return img.resize(out_size, resample_filter, box=box, reducing_gap=gap)
+
+
+SAVE_FORMATS = {'jpg': 'JPEG', 'jpeg': 'JPEG', 'png': 'PNG', 'webp': 'WEBP', 'bmp': 'BMP', 'tiff': 'TIFF'}
+
+
+def save_format(ext):
+    return SAVE_FORMATS.get(ext.lower(), 'JPEG')
+
+
+# Pillow save() options per format and encoder profile. 'balanced' is what
+# Pillow does when given no options at all.
+ENCODER_SETTINGS = {
+    'PNG': {
+        'speed': {'compress_level': 1},
+        'balanced': {'compress_level': 6},
+        'size': {'compress_level': 9}
+    },
+    'JPEG': {
+        'speed': {'quality': 75, 'subsampling': 2},
+        'balanced': {'quality': 75},
+        'size': {'quality': 75, 'optimize': True, 'progressive': True}
+    },
+    'WEBP': {
+        'speed': {'quality': 80, 'method': 0},
+        'balanced': {'quality': 80, 'method': 4},
+        'size': {'quality': 80, 'method': 6}
+    },
+    'TIFF': {
+        'speed': {},
+        'balanced': {},
+        'size': {'compression': 'tiff_adobe_deflate'}
+    },
+    'BMP': {
+        'speed': {},
+        'balanced': {},
+        'size': {}
+    }
+}
+
+
+def encoder_settings(save_ext, profile='balanced', overrides=None):
+    settings = dict(ENCODER_SETTINGS.get(save_ext, {}).get(profile, {}))
+    if overrides:
+        # Overrides are keyed by extension, so both "jpg" and "jpeg" work
+        for ext, fmt in SAVE_FORMATS.items():
+            if fmt == save_ext:
+                settings.update(overrides.get(ext, {}))
+    return settings
+
+
+# Modes each format stores as they are, everything else is converted first.
+# CMYK is only kept for TIFF, JPEG outputs are meant for screens. BMP alpha
+# is ignored by most readers (Pillow included), so BMP is flattened too.
+FORMAT_MODES = {
+    'JPEG': ('L', 'RGB'),
+    'PNG': ('1', 'L', 'LA', 'I;16', 'P', 'RGB', 'RGBA'),
+    'WEBP': ('RGB', 'RGBA'),
+    'BMP': ('1', 'L', 'P', 'RGB'),
+    'TIFF': ('1', 'L', 'LA', 'I;16', 'P', 'RGB', 'RGBA', 'CMYK')
+}
+GREY_MODES = ('1', 'L', 'LA', 'La', 'I', 'I;16', 'I;16L', 'I;16B', 'I;16N', 'F')
+WHITE = (255, 255, 255)
+
+
+def background_color(value):
+    # Config colour ("#rrggbb", "white", ...) as an RGB tuple, white when it doesn't parse
+    try:
+        return ImageColor.getrgb(value)[:3]
+    except (ValueError, TypeError, AttributeError):
+        return WHITE
+
+
+def prepare_for_format(img, save_ext, background=WHITE):
+    # Colour normalization: turn any decoded mode into one the format can
+    # store. Transparency is kept where the format has it and flattened onto
+    # background where it doesn't, with one paste that reads the alpha
+    # straight from the image (no band split, no extra copies).
+    modes = FORMAT_MODES.get(save_ext, ('RGB',))
+    # Colour-keyed transparency (tRNS) only survives in PNG
+    keyed = 'transparency' in img.info and save_ext != 'PNG'
+    if img.mode in modes and not keyed:
+        return img
+    grey = img.mode in GREY_MODES
+    if img.mode in ('La', 'RGBa'):
+        # Premultiplied, Pillow only converts these to their straight-alpha twins
+        img = img.convert(img.mode.upper())
+    if img.mode.startswith('I') and 'I;16' in modes and not img.has_transparency_data:
+        # 16 bit grey PNGs decode as I, keep all 16 bits where the format can
+        return img.convert('I;16')
+    if img.mode.startswith('I'):
+        # Otherwise scale to 8 bit instead of clipping everything above 255
+        img = img.convert('I').point(lambda v: v / 256, 'L')
+    if not img.has_transparency_data:
+        return img if img.mode in modes else img.convert('L' if grey and 'L' in modes else 'RGB')
+    if 'RGBA' in modes:
+        return img.convert('LA' if grey and 'LA' in modes else 'RGBA')
+    img = img.convert('LA' if grey else 'RGBA')
+    if grey and 'L' in modes:
+        r, g, b = background
+        flat = PILImage.new('L', img.size, (r * 299 + g * 587 + b * 114) // 1000)
+    else:
+        flat = PILImage.new('RGB', img.size, tuple(background))
+    flat.paste(img, mask=img)
+    return flat
+
+
+def is_passthrough(src_size, src_format, src_mode, spec):
+    # The header already says the file is exactly what this output would be:
+    # same size and format, a mode the format stores as it is, and no
+    # encoder options that would have changed it
+    save_ext = save_format(spec["format"])
+    out_size, box = resize_plan(src_size, (spec["width"], spec["height"]), spec.get("resize_mode", 'stretch'))
+    return (out_size == tuple(src_size) and box == (0, 0, src_size[0], src_size[1])
+            and src_format == save_ext and src_mode in FORMAT_MODES.get(save_ext, ())
+            and spec.get("encoder", 'balanced') != 'size'
+            and not any((spec.get("encoder_options") or {}).get(ext)
+                        for ext, fmt in SAVE_FORMATS.items() if fmt == save_ext))
+
+
+def move_file(src_path, dest_path, keep_source=False):
+    # A rename (or hard link when the source stays) on the same filesystem, a copy across filesystems
+    try:
+        if keep_source:
+            os.link(src_path, dest_path)
+        else:
+            os.replace(src_path, dest_path)
+        return
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EACCES, errno.ENOTSUP, errno.EMLINK) and not keep_source:
+            raise
+    shutil.copyfile(src_path, dest_path)
+    if not keep_source:
+        try:
+            os.remove(src_path)
+        except OSError:
+            pass
+
+
+# Backends
+#
+# render_image() only orchestrates: open, decode once, resize largest
+# first, normalize the colour mode for the format, encode; finish_image()
+# writes. The pixel work goes through a backend object with the methods
+# below, picked per task ("backend" in the config). Images are whatever the
+# backend uses internally and never leave it.
+
+class PillowBackend:
+    name = 'pillow'
+
+    @staticmethod
+    def available():
+        return True
+
+    def open(self, src_path, stream=None):
+        if stream is None:
+            return PILImage.open(src_path)
+        try:
+            return PILImage.open(stream)
+        except PILImage.UnidentifiedImageError:
+            # Name the file, not the in-memory copy of it (this ends up in failures.json)
+            raise PILImage.UnidentifiedImageError(f"cannot identify image file {src_path!r}") from None
+
+    def probe(self, img):
+        # (width, height), the format as in SAVE_FORMATS and the mode, read from the header only
+        return img.size, img.format, img.mode
+
+    def decode(self, img, size, downscale='quality', reuse=False):
+        draft_image(img, size, downscale)
+        img.load()
+        return img
+
+    def size(self, img):
+        return img.size
+
+    def resize(self, img, spec):
+        return resize_image(img, (spec["width"], spec["height"]), spec.get("downscale", 'quality'),
+                            spec.get("resize_mode", 'stretch'), spec.get("resample", 'auto'),
+                            spec.get("reducing_gap", 0.0))
+
+    def normalize(self, img, spec):
+        return prepare_for_format(img, save_format(spec["format"]), background_color(spec.get("background")))
+
+    def encode(self, img, spec):
+        save_ext = save_format(spec["format"])
+        buf = io.BytesIO()
+        img.save(
+            buf, save_ext, **encoder_settings(save_ext, spec.get("encoder", 'balanced'), spec.get("encoder_options")))
+        # Bytes, not a view of buf: the result may have to be pickled back from a worker process
+        return buf.getvalue()
+
+    def close(self, img):
+        img.close()
+
+
+def get_backend(name='pillow'):
+    # Falls back to Pillow when the requested engine isn't installed
+    if name == 'vips':
+        from .vips import VipsBackend
+        if VipsBackend.available():
+            return VipsBackend()
+    return PillowBackend()
+
+
+def backend_available(name):
+    if name == 'vips':
+        from .vips import VipsBackend
+        return VipsBackend.available()
+    return True
+
+
+def decodes_source(src_path, options):
+    # Whether render_image() will decode the file with Pillow, the only case
+    # where reading it into memory ahead pays off: libvips always loads from
+    # the path, and a file that passes through is only renamed
+    if options.get("backend") == 'vips' and backend_available('vips'):
+        return False
+    outputs = options.get("outputs") or [options]
+    if len(outputs) > 1:
+        return True
+    try:
+        with PILImage.open(src_path) as img:
+            return not is_passthrough(img.size, img.format, img.mode, outputs[0])
+    except Exception:
+        # Not readable or not an image, render_image() reports it
+        return True
+
+
+def render_image(src_path, options, stream=None):
+    # The CPU half of a conversion: decode once, derive every output from the
+    # source (or from a bigger output) and encode it. Nothing is written yet,
+    # the encoded outputs come back in result["files"] for finish_image().
+    # stream is the source already read into memory (see pipeline.py).
+    outputs = options.get("outputs") or [options]
+    # Relative folder recreated under every output folder (mirrored recursive watches)
+    subdir = options.get("subdir", "")
+    # Output names picked by the caller (so it can journal them), random otherwise
+    planned = options.get("names") or [random_name(o["format"].lower()) for o in outputs]
+    timings = {"decode": 0.0, "resize": 0.0, "normalize": 0.0, "encode": 0.0}
+    started = time.perf_counter()
+    bytes_in = os.path.getsize(src_path)
+    backend = get_backend(options.get("backend", 'pillow'))
+    img = backend.open(src_path, stream)
+    src_size, src_format, src_mode = backend.probe(img)
+    if len(outputs) == 1 and is_passthrough(src_size, src_format, src_mode, outputs[0]):
+        backend.close(img)
+        timings = {"probe": time.perf_counter() - started}
+        started = time.perf_counter()
+        spec = outputs[0]
+        folder = spec["output_folder"]
+        if subdir:
+            folder = os.path.join(folder, subdir)
+            os.makedirs(folder, exist_ok=True)
+        rand_name = planned[0]
+        move_file(src_path, os.path.join(folder, rand_name), options.get("keep_source"))
+        timings["move"] = time.perf_counter() - started
+        name = os.path.join(subdir, rand_name) if subdir else rand_name
+        return {"output": name, "outputs": [name], "bytes_in": bytes_in, "bytes_out": bytes_in,
+                "timings": timings, "passthrough": True}
+    scaled = [scaled_size(src_size, (o["width"], o["height"]), o.get("resize_mode", 'stretch')) for o in outputs]
+    # Draft decoding is only safe when no output asked for full quality
+    downscales = {o.get("downscale", 'quality') for o in outputs}
+    img = backend.decode(img, (max(w for w, _ in scaled), max(h for _, h in scaled)),
+                         'quality' if 'quality' in downscales else 'balanced', reuse=len(outputs) > 1)
+    timings["decode"], started = time.perf_counter() - started, time.perf_counter()
+
+    names = [None] * len(outputs)
+    files = [None] * len(outputs)
+    # Largest first, so smaller outputs can be made from an already shrunk
+    # image, as long as it still has the source's aspect ratio and enough pixels
+    order = sorted(range(len(outputs)), key=lambda i: scaled[i][0] * scaled[i][1], reverse=True)
+    width, height = backend.size(img)
+    base = img
+    for i in order:
+        spec = outputs[i]
+        if base is not img:
+            base_width, base_height = backend.size(base)
+            if (base_width < scaled[i][0] or base_height < scaled[i][1] or
+                    abs(base_width / base_height - width / height) > 0.01):
+                base = img
+        resized = backend.resize(base, spec)
+        base = resized
+        timings["resize"] += time.perf_counter() - started
+        started = time.perf_counter()
+
+        normalized = backend.normalize(resized, spec)
+        timings["normalize"] += time.perf_counter() - started
+        started = time.perf_counter()
+
+        encoded = backend.encode(normalized, spec)
+        timings["encode"] += time.perf_counter() - started
+        started = time.perf_counter()
+
+        folder = os.path.join(spec["output_folder"], subdir) if subdir else spec["output_folder"]
+        # (path, encoded bytes, whether the folder may still have to be made)
+        files[i] = (os.path.join(folder, planned[i]), encoded, folder != options["output_folder"])
+        names[i] = os.path.join(subdir, planned[i]) if subdir else planned[i]
+    return {"output": None, "outputs": names, "bytes_in": bytes_in, "bytes_out": 0, "timings": timings,
+            "files": files}
+
+
+def finish_image(src_path, options, result):
+    # The I/O half: write what render_image() encoded, then remove the source
+    # unless the caller keeps it. Returns result with "output" set once every
+    # output is on disk.
+    if result.get("passthrough"):
+        return result
+    timings = result["timings"]
+    started = time.perf_counter()
+    written = []
+    try:
+        for save_path, encoded, make_dir in result.pop("files"):
+            if make_dir:
+                os.makedirs(os.path.dirname(save_path), exist_ok=True)
+            written.append(save_path)
+            with open(save_path, "wb") as f:
+                f.write(encoded)
+            result["bytes_out"] += len(encoded)
+    except Exception:
+        # Don't leave half a set of outputs behind, the retry makes all of them again
+        for path in written:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        raise
+    timings["write"] = time.perf_counter() - started
+    started = time.perf_counter()
+    if not all(os.path.exists(path) for path in written):
+        return result
+    result["output"] = result["outputs"][0]
+    if options.get("keep_source"):
+        return result
+    try:
+        os.remove(src_path)
+    except Exception:
+        pass
+    timings["delete"] = time.perf_counter() - started
+    return result
+
+
+def convert_image(src_path, options, stream=None):
+    # Returns what happened plus per-stage timings, the caller turns those into metrics.
+    # The source is decoded once, every output is written, and only then is the source removed.
+    return finish_image(src_path, options, render_image(src_path, options, stream))
@@ -0,0 +1,161 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+# Processing journal
+#
+# Every file a task converts goes through three states, each committed to
+# a small SQLite database (WAL mode) in the watch folder before the next
+# step starts:
+#
+#   claimed  - about to be converted, with the output paths it will get
+#   written  - every output is on disk, the source still has to go
+#   removed  - the source is gone, the file is done
+#
+# Output names are picked before the conversion starts, so a crash in any
+# state can be cleaned up on the next start: claimed files have their
+# possibly partial outputs removed and are converted again, written files
+# only have their source removed. Without the journal a source that
+# couldn't be deleted would be converted again after a restart.
+#
+# synchronous=NORMAL keeps a commit at a few dozen microseconds. A crash of
+# the process loses nothing; a power cut can lose the last few commits,
+# which recovery treats like work that never started.
+
+JOURNAL_DIR = '.fetchx_journal'
+JOURNAL_FILE = 'journal.db'
+# Finished rows are kept this long for inspection, then pruned
+KEEP_REMOVED = 24 * 3600
+PRUNE_EVERY = 1000
+
+
+class Journal:
+    def __init__(self, folder, task_name, exclusive=False):
+        self.folder = folder
+        self.task_name = task_name
+        self.path = os.path.join(folder, JOURNAL_DIR, JOURNAL_FILE)
+        self.error = None
+        self._db = None
+        self._writes = 0
+        self._lock = threading.Lock()
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            # Used from the scheduler thread and the engine's callback threads, always under _lock
+            self._db = sqlite3.connect(self.path, timeout=5, check_same_thread=False, isolation_level=None)
+            if exclusive:
+                # Only this process ever opens it: WAL then needs no shared memory
+                # file, which keeps it safe on network filesystems
+                self._db.execute("PRAGMA locking_mode=EXCLUSIVE")
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute("""CREATE TABLE IF NOT EXISTS files (
+                task TEXT NOT NULL, name TEXT NOT NULL, state TEXT NOT NULL,
+                ino INTEGER, size INTEGER, mtime_ns INTEGER, outputs TEXT, updated REAL,
+                PRIMARY KEY (task, name))""")
+        except (OSError, sqlite3.Error) as e:
+            self.error = e
+            self.close()
+
+    @property
+    def enabled(self):
+        return self._db is not None
+
+    def _execute(self, sql, params=()):
+        if self._db is None:
+            return []
+        with self._lock:
+            try:
+                return self._db.execute(sql, params).fetchall()
+            except sqlite3.Error as e:
+                self.error = e
+                return []
+
+    def claimed(self, name, key, outputs):
+        self._execute("INSERT OR REPLACE INTO files VALUES (?, ?, 'claimed', ?, ?, ?, ?, ?)",
+                      (self.task_name, name, key[1], key[2], key[3], json.dumps(outputs), time.time()))
+
+    def written(self, name):
+        self._set_state(name, 'written')
+
+    def removed(self, name):
+        self._set_state(name, 'removed')
+        with self._lock:
+            self._writes += 1
+            due = self._writes % PRUNE_EVERY == 0
+        if due:
+            self.prune()
+
+    def _set_state(self, name, state):
+        self._execute("UPDATE files SET state = ?, updated = ? WHERE task = ? AND name = ?",
+                      (state, time.time(), self.task_name, name))
+
+    def outputs(self, name):
+        rows = self._execute("SELECT outputs FROM files WHERE task = ? AND name = ?", (self.task_name, name))
+        return json.loads(rows[0][0]) if rows else []
+
+    def rollback(self, name):
+        # The conversion failed: remove whatever part of its output made it to disk
+        for path in self.outputs(name):
+            remove_quietly(path)
+        self._execute("DELETE FROM files WHERE task = ? AND name = ?", (self.task_name, name))
+
+    def prune(self):
+        self._execute("DELETE FROM files WHERE task = ? AND state = 'removed' AND updated < ?",
+                      (self.task_name, time.time() - KEEP_REMOVED))
+
+    def recover(self, skip=()):
+        # Finish or undo what the last run left open, except the names in skip
+        # (still being converted). Returns (finished, rolled_back, stuck), stuck
+        # being file keys of sources that can't be deleted and must not be
+        # converted again.
+        finished = rolled_back = 0
+        stuck = []
+        rows = self._execute("SELECT name, state, ino, size, mtime_ns, outputs FROM files "
+                             "WHERE task = ? AND state != 'removed'", (self.task_name,))
+        for name, state, ino, size, mtime_ns, outputs in rows:
+            if name in skip:
+                continue
+            src_path = os.path.join(self.folder, name)
+            outputs = json.loads(outputs)
+            try:
+                st = os.stat(src_path)
+                same = (st.st_ino, st.st_size, st.st_mtime_ns) == (ino, size, mtime_ns)
+            except OSError:
+                same = False
+            if state == 'claimed':
+                # Interrupted mid-conversion: outputs may be partial, start over
+                # (a source that is gone or was replaced gets picked up as a new file)
+                for path in outputs:
+                    remove_quietly(path)
+                self._execute("DELETE FROM files WHERE task = ? AND name = ?", (self.task_name, name))
+                rolled_back += 1
+                continue
+            if same:
+                try:
+                    os.remove(src_path)
+                except OSError:
+                    stuck.append((name, ino, size, mtime_ns))
+                    continue
+            # Outputs are complete, and the source is gone now
+            self.removed(name)
+            finished += 1
+        self.prune()
+        return finished, rolled_back, stuck
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                try:
+                    self._db.close()
+                except sqlite3.Error:
+                    pass
+                self._db = None
+
+
+def remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,72 @@
+import logging
+import threading
+from collections import deque
+from logging.handlers import RotatingFileHandler
+
+# Log pipeline
+#
+# Watchers log from their own threads, so lines go into a bounded queue that
+# the UI drains in batches on a timer instead of touching widgets directly.
+# When the UI falls behind, the oldest lines are dropped and counted.
+# Lines can also be mirrored to a rotating log file.
+
+LOG_LEVELS = {
+    'error': logging.ERROR,
+    'warning': logging.WARNING,
+    'info': logging.INFO,
+    'debug': logging.DEBUG
+}
+
+
+def open_log_file(path, max_kb=1024, backups=3):
+    logger = logging.getLogger(f"fetchx.file.{path}")
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    if not logger.handlers:
+        handler = RotatingFileHandler(path, maxBytes=max_kb * 1024, backupCount=backups, encoding='utf-8')
+        handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        logger.addHandler(handler)
+    return logger
+
+
+def task_logger(task, log_callback):
+    # Per-task verbosity: lines below the task's log_level never leave the watcher
+    def log(msg, level=logging.INFO):
+        if level >= LOG_LEVELS.get(task.log_level, logging.INFO):
+            log_callback(msg)
+    return log
+
+
+class LogPipeline:
+    def __init__(self, max_pending=1000, log_file=None, max_kb=1024, backups=3):
+        self._pending = deque()
+        self._max_pending = max_pending
+        self._dropped = 0
+        self._lock = threading.Lock()
+        self._file = open_log_file(log_file, max_kb, backups) if log_file else None
+
+    def write(self, msg):
+        # Safe to call from any thread
+        with self._lock:
+            if len(self._pending) >= self._max_pending:
+                self._pending.popleft()
+                self._dropped += 1
+            self._pending.append(msg)
+        if self._file:
+            self._file.info(msg)
+
+    def drain(self, max_lines=None):
+        with self._lock:
+            count = len(self._pending) if max_lines is None else min(max_lines, len(self._pending))
+            lines = [self._pending.popleft() for _ in range(count)]
+            dropped, self._dropped = self._dropped, 0
+        if dropped:
+            lines.insert(0, f"... {dropped} older log lines skipped")
+        return lines
+
+    def close(self):
+        if self._file:
+            for handler in list(self._file.handlers):
+                handler.close()
+                self._file.removeHandler(handler)
+            self._file = None
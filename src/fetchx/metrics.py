@@ -0,0 +1,214 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Metrics
+#
+# Small in-process registry of per-task counters, gauges and histograms,
+# served on an optional localhost endpoint as Prometheus text (/metrics)
+# or JSON (/metrics.json). Everything is labelled at least by task name;
+# stage latencies cover decode, resize, encode, write and delete, or probe
+# and move for files passed through untouched.
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names, values, extra=None):
+    pairs = [f'{n}="{escape_label(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labels=('task',)):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def remove(self, *label_values):
+        with self._lock:
+            self._values.pop(tuple(label_values), None)
+
+    def samples(self):
+        with self._lock:
+            return sorted(self._values.items())
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def prometheus(self):
+        return [f"{self.name}{format_labels(self.labels, k)} {v}" for k, v in self.samples()]
+
+    def json(self):
+        return [{"labels": dict(zip(self.labels, k)), "value": v} for k, v in self.samples()]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, *label_values, value):
+        with self._lock:
+            self._values[label_values] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=('task',), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, *label_values, value):
+        with self._lock:
+            state = self._values.get(label_values)
+            if state is None:
+                state = self._values[label_values] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["counts"][i] += 1
+                    break
+            state["sum"] += value
+            state["count"] += 1
+
+    def samples(self):
+        with self._lock:
+            return sorted((k, {"counts": list(v["counts"]), "sum": v["sum"], "count": v["count"]})
+                          for k, v in self._values.items())
+
+    def prometheus(self):
+        lines = []
+        for key, state in self.samples():
+            cumulative = 0
+            for bound, count in zip(self.buckets, state["counts"]):
+                cumulative += count
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{format_labels(self.labels, key, le)} {cumulative}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{format_labels(self.labels, key, le)} {state['count']}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, key)} {state['sum']}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, key)} {state['count']}")
+        return lines
+
+    def json(self):
+        out = []
+        for key, state in self.samples():
+            cumulative, buckets = 0, {}
+            for bound, count in zip(self.buckets, state["counts"]):
+                cumulative += count
+                buckets[str(bound)] = cumulative
+            buckets["+Inf"] = state["count"]
+            out.append({"labels": dict(zip(self.labels, key)), "count": state["count"],
+                        "sum": state["sum"], "buckets": buckets})
+        return out
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+        self.processed = self.add(Counter("fetchx_files_processed_total", "Images converted and written"))
+        self.failed = self.add(Counter("fetchx_files_failed_total", "Images that failed to convert"))
+        self.passthrough = self.add(Counter("fetchx_files_passthrough_total",
+                                            "Images moved as-is because they already matched the output"))
+        self.retried = self.add(Counter("fetchx_files_retried_total", "Conversions of a file that failed before"))
+        self.quarantined = self.add(Counter("fetchx_files_quarantined_total", "Files moved to quarantine after too many failures"))
+        self.bytes_in = self.add(Counter("fetchx_bytes_in_total", "Bytes of source images read"))
+        self.bytes_out = self.add(Counter("fetchx_bytes_out_total", "Bytes of output images written"))
+        self.queue_depth = self.add(Gauge("fetchx_queue_depth", "Files waiting in the task's queue"))
+        self.queue_high_water = self.add(Gauge("fetchx_queue_high_water", "Most files ever waiting in the task's queue"))
+        self.deferred = self.add(Counter("fetchx_files_deferred_total", "Files left for a later scan because the queue was full"))
+        self.dropped = self.add(Counter("fetchx_files_dropped_total", "Files dropped because the queue was full"))
+        self.running_workers = self.add(Gauge("fetchx_running_workers", "Conversions of the task in flight"))
+        self.stage_seconds = self.add(Histogram("fetchx_stage_seconds", "Time spent per pipeline stage",
+                                                labels=('task', 'stage')))
+
+    def add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def record_conversion(self, task_name, result):
+        if result.get("output"):
+            self.processed.inc(task_name)
+            if result.get("passthrough"):
+                self.passthrough.inc(task_name)
+        else:
+            self.failed.inc(task_name)
+        self.bytes_in.inc(task_name, amount=result.get("bytes_in", 0))
+        self.bytes_out.inc(task_name, amount=result.get("bytes_out", 0))
+        for stage, seconds in result.get("timings", {}).items():
+            self.stage_seconds.observe(task_name, stage, value=seconds)
+
+    def forget_task(self, task_name):
+        # Drop the gauges of a stopped task, counters keep their totals
+        self.queue_depth.remove(task_name)
+        self.queue_high_water.remove(task_name)
+        self.running_workers.remove(task_name)
+
+    def render_prometheus(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.prometheus())
+        return "\n".join(lines) + "\n"
+
+    def render_json(self):
+        return json.dumps({m.name: {"type": m.kind, "help": m.help, "values": m.json()} for m in self._metrics},
+                          indent=2)
+
+
+METRICS = MetricsRegistry()
+
+
+class MetricsServer:
+    def __init__(self, registry=METRICS, port=9464, host='127.0.0.1'):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._server = None
+
+    def start(self):
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split('?', 1)[0]
+                if path == '/metrics':
+                    body, content_type = registry.render_prometheus(), 'text/plain; version=0.0.4; charset=utf-8'
+                elif path == '/metrics.json':
+                    body, content_type = registry.render_json(), 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                data = body.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
@@ -0,0 +1,223 @@
+import io
+import os
+import mmap
+import time
+import queue
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from .imaging import render_image, finish_image, decodes_source
+
+# Conversion pipeline
+#
+# A file goes through three stages, each with its own threads and a queue
+# in front of it:
+#
+#   read    - reader threads pull the source into memory ahead of the decoder
+#   render  - decode/resize/encode on the engine's processes (or one thread)
+#   write   - writer threads write the outputs and remove the source
+#
+# So on a slow USB or network drive the next files are already being read,
+# and the last ones written, while the CPU works on the current one. How
+# many files are in the pipeline at once is bounded (capacity), which also
+# bounds the queues and the memory held by prefetched sources and encoded
+# outputs waiting for the writers.
+#
+# Files read wait in a queue per task until that task has a render slot
+# (its max_workers), so a capped task never holds up the readers.
+#
+# Sources up to MMAP_THRESHOLD are read into a buffer that goes with the
+# job. Bigger ones are mapped and every page touched instead: the decoder
+# then reads the file from the page cache without a second copy of it
+# being pickled to a worker process, and the mapping is closed again
+# before the source can be moved or removed (Windows won't while mapped).
+# Sources that won't be decoded by Pillow aren't read ahead at all: vips
+# tasks load from the path, and a file whose header says it passes through
+# is only renamed.
+
+MMAP_THRESHOLD = 16 * 1024 * 1024
+READERS = 2
+WRITERS = 2
+
+
+def read_source(path):
+    # An in-memory stream of the source, or None once a big file is in the page cache
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < MMAP_THRESHOLD:
+            return io.BytesIO(f.read())
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapping:
+            if hasattr(mapping, 'madvise'):
+                mapping.madvise(mmap.MADV_WILLNEED)
+            for offset in range(0, size, mmap.PAGESIZE):
+                mapping[offset]
+    return None
+
+
+class Pipeline:
+    def __init__(self, engine=None, readers=READERS, writers=WRITERS):
+        self.engine = engine
+        self.readers = readers
+        self.writers = writers
+        self.workers = engine.workers if engine else 1
+        self._read_q = queue.Queue()
+        self._write_q = queue.Queue()
+        # Taken when a file enters the pipeline, given back once it is written:
+        # this is what bounds both queues
+        self._slots = threading.BoundedSemaphore(self.capacity)
+        self._render_slots = threading.BoundedSemaphore(self.workers)
+        self._executor = None
+        self._threads = []
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._pending = 0
+        # task -> files read and waiting for one of its render slots, in order
+        self._parked = OrderedDict()
+
+    @property
+    def depth(self):
+        # Files being read or written on top of the ones being rendered
+        return self.readers + self.writers
+
+    @property
+    def capacity(self):
+        return self.workers + self.depth
+
+    def _start(self):
+        with self._lock:
+            if self._threads:
+                return
+            if self.engine is None:
+                # Pillow's codecs release the GIL, so one render thread still overlaps with the I/O threads
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fetchx-render")
+            for n in range(self.readers):
+                self._threads.append(threading.Thread(target=self._read_loop, name=f"fetchx-read-{n}", daemon=True))
+            for n in range(self.writers):
+                self._threads.append(threading.Thread(target=self._write_loop, name=f"fetchx-write-{n}", daemon=True))
+            for thread in self._threads:
+                thread.start()
+
+    def submit(self, task, src_path, options, callback):
+        # callback(result, error) runs on a writer thread (or a reader's, for a
+        # source that couldn't be read). Blocks while the pipeline is full.
+        self._start()
+        self._slots.acquire()
+        with self._lock:
+            self._pending += 1
+        self._read_q.put((task, src_path, options, callback))
+
+    def _complete(self, callback, result, error):
+        try:
+            callback(result, error)
+        except Exception:
+            # A failing callback must not take the stage thread down with it
+            pass
+        finally:
+            with self._lock:
+                self._pending -= 1
+                self._idle.notify_all()
+            self._slots.release()
+
+    def _read_loop(self):
+        while True:
+            item = self._read_q.get()
+            if item is None:
+                return
+            task, src_path, options, callback = item
+            started = time.perf_counter()
+            try:
+                stream = read_source(src_path) if decodes_source(src_path, options) else None
+            except Exception as e:
+                self._complete(callback, None, e)
+                continue
+            # Parked rather than waiting for a render slot here, so a task
+            # capped at max_workers never holds up reads for the others
+            with self._lock:
+                self._parked.setdefault(task, deque()).append((item, stream, time.perf_counter() - started))
+            self._render_parked()
+
+    def _render_parked(self):
+        # Hands every parked file that has a free render slot to the renderer.
+        # Runs after every read and every finished render.
+        while True:
+            started = None
+            with self._lock:
+                for task, parked in self._parked.items():
+                    item, stream, read_time = parked[0]
+                    try:
+                        future = self._try_render(task, item, stream)
+                    except Exception as e:
+                        future = e
+                    if future is None:
+                        continue
+                    parked.popleft()
+                    if parked:
+                        # Round robin, when slots are shared the next task goes first
+                        self._parked.move_to_end(task)
+                    else:
+                        del self._parked[task]
+                    started = (item, read_time, future)
+                    break
+            if started is None:
+                return
+            item, read_time, future = started
+            if isinstance(future, Exception):
+                self._complete(item[3], None, future)
+                continue
+            future.add_done_callback(lambda f, item=item, t=read_time: self._rendered(item, t, f))
+
+    def _try_render(self, task, item, stream):
+        # A future, or None when the task (or the render thread) has no slot free
+        src_path, options = item[1], item[2]
+        if self.engine is not None:
+            return self.engine.submit(task, render_image, src_path, options, stream, block=False)
+        if not self._render_slots.acquire(blocking=False):
+            return None
+        try:
+            future = self._executor.submit(render_image, src_path, options, stream)
+        except Exception:
+            self._render_slots.release()
+            raise
+        future.add_done_callback(lambda f: self._render_slots.release())
+        return future
+
+    def _rendered(self, item, read_time, future):
+        # On the engine's result thread, so this only hands the outputs over.
+        # The render slot was given back by an earlier callback of the same future.
+        try:
+            result = future.result()
+            result["timings"]["read"] = read_time
+        except Exception as e:
+            self._write_q.put((item, None, e))
+        else:
+            self._write_q.put((item, result, None))
+        self._render_parked()
+
+    def _write_loop(self):
+        while True:
+            item = self._write_q.get()
+            if item is None:
+                return
+            (task, src_path, options, callback), result, error = item
+            if error is None:
+                try:
+                    result = finish_image(src_path, options, result)
+                except Exception as e:
+                    result, error = None, e
+            self._complete(callback, result, error)
+
+    def shutdown(self, wait=True):
+        # wait: let every submitted file go through first
+        with self._lock:
+            if wait:
+                self._idle.wait_for(lambda: not self._pending)
+            threads, self._threads = self._threads, []
+            executor, self._executor = self._executor, None
+        for thread in threads:
+            (self._read_q if thread.name.startswith("fetchx-read") else self._write_q).put(None)
+        if wait:
+            for thread in threads:
+                thread.join()
+        if executor:
+            executor.shutdown(wait=wait, cancel_futures=not wait)
@@ -0,0 +1,135 @@
+import os
+import json
+import time
+import threading
+
+# Retry queue and quarantine
+#
+# A file that fails to convert is tried again after an exponentially growing
+# delay instead of on every scan. Once it has failed max_attempts times it is
+# moved into a quarantine subfolder of the watch folder, so a corrupt image
+# stops costing a core. Attempts and failure reasons are kept in
+# failures.json inside the quarantine folder, so they survive restarts.
+
+QUARANTINE_DIR = '.fetchx_quarantine'
+FAILURES_FILE = 'failures.json'
+# How many quarantined files the failures file keeps reasons for
+MAX_QUARANTINE_RECORDS = 1000
+
+
+class RetryQueue:
+    def __init__(self, folder, max_attempts=5, base_delay=2.0, max_delay=300.0):
+        self.folder = folder
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.quarantine_folder = os.path.join(folder, QUARANTINE_DIR)
+        self.failures_path = os.path.join(self.quarantine_folder, FAILURES_FILE)
+        # name -> {"key": [ino, size, mtime_ns], "attempts", "error", "due"}
+        self._pending = {}
+        self._quarantined = []
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.failures_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        self._pending = {name: entry for name, entry in data.get("pending", {}).items()
+                         if isinstance(entry, dict) and "key" in entry}
+        self._quarantined = list(data.get("quarantined", []))[-MAX_QUARANTINE_RECORDS:]
+
+    def _save(self):
+        data = {"pending": self._pending, "quarantined": self._quarantined}
+        try:
+            os.makedirs(self.quarantine_folder, exist_ok=True)
+            tmp_path = self.failures_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=4)
+            os.replace(tmp_path, self.failures_path)
+        except OSError:
+            pass
+
+    def __contains__(self, name):
+        with self._lock:
+            return name in self._pending
+
+    def delay(self, attempts):
+        return min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+
+    def blocked(self, name, key):
+        # True while a failed file waits out its backoff. A rewritten file
+        # (different inode, size or mtime) gets a fresh set of attempts.
+        with self._lock:
+            entry = self._pending.get(name)
+            if entry is None:
+                return False
+            if entry["key"] != list(key[1:]):
+                del self._pending[name]
+                self._save()
+                return False
+            return entry["due"] > time.time()
+
+    def failed(self, name, key, error):
+        # Returns ('retry', delay) or ('quarantine', path or None)
+        with self._lock:
+            entry = self._pending.get(name)
+            if entry is None or entry["key"] != list(key[1:]):
+                entry = self._pending[name] = {"key": list(key[1:]), "attempts": 0}
+            entry["attempts"] += 1
+            entry["error"] = str(error) or type(error).__name__
+            if not self.max_attempts or entry["attempts"] < self.max_attempts:
+                delay = self.delay(entry["attempts"])
+                entry["due"] = time.time() + delay
+                self._save()
+                return 'retry', delay
+            del self._pending[name]
+            path = self._quarantine(name)
+            self._quarantined.append({"name": name, "path": path, "attempts": entry["attempts"],
+                                      "error": entry["error"], "time": time.strftime("%Y-%m-%d %H:%M:%S")})
+            del self._quarantined[:-MAX_QUARANTINE_RECORDS]
+            self._save()
+            return 'quarantine', path
+
+    def _quarantine(self, name):
+        src_path = os.path.join(self.folder, name)
+        dest_path = os.path.join(self.quarantine_folder, name)
+        if os.path.exists(dest_path):
+            base, ext = os.path.splitext(name)
+            dest_path = os.path.join(self.quarantine_folder, f"{base}_{time.strftime('%Y%m%d%H%M%S')}{ext}")
+        try:
+            # Files from subfolders of a recursive watch keep their relative path
+            os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+            os.replace(src_path, dest_path)
+        except OSError:
+            return None
+        return dest_path
+
+    def attempting(self, name):
+        # Keep a retry that is in flight out of due() until it finishes
+        with self._lock:
+            entry = self._pending.get(name)
+            if entry is not None:
+                entry["due"] = time.time() + self.max_delay
+
+    def succeeded(self, name):
+        with self._lock:
+            if self._pending.pop(name, None) is not None:
+                self._save()
+
+    def forget(self, name):
+        self.succeeded(name)
+
+    def wait_time(self, limit):
+        with self._lock:
+            if not self._pending:
+                return limit
+            next_due = min(entry["due"] for entry in self._pending.values())
+        return max(0.0, min(limit, next_due - time.time()))
+
+    def due(self):
+        now = time.time()
+        with self._lock:
+            return [name for name, entry in self._pending.items() if entry["due"] <= now]
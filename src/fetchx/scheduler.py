@@ -0,0 +1,660 @@
+import os
+import time
+import select
+import socket
+import logging
+import threading
+import functools
+from collections import OrderedDict, deque
+
+from .imaging import job_options, random_name, backend_available
+from .watch import (
+    DirectorySnapshot, SeenIndex, ReadinessGate, Inotify, file_key, is_image_name, match_path, ignore_lease_breaks
+)
+from .retry import RetryQueue
+from .journal import Journal
+from .claims import Claims, LEASE_INTERVAL
+from .pipeline import Pipeline
+from .metrics import METRICS
+from .logs import task_logger
+
+# Scheduler
+#
+# One thread watches the folders of every task: a single inotify fd (or
+# directory snapshots for polling tasks), the readiness gate and the retry
+# queue all feed per-task pending lists, and files are handed to the
+# conversion pipeline (see pipeline.py) from there. Tasks with a higher
+# priority always go first; tasks with the same priority share the pool in
+# proportion to their weight (stride scheduling). The thread sleeps in
+# select() until an event, a timer or a finished conversion wakes it, so
+# idle tasks cost nothing.
+#
+# Recursive inotify tasks get one watch per directory. New directories are
+# found by the rescan their IN_CREATE triggers; if the kernel's watch limit
+# runs out the task falls back to polling, where the directory snapshot's
+# mtime cache keeps a deep tree down to one stat() per folder per scan.
+#
+# Shared tasks claim each file (see claims.py) right before handing it to
+# the pipeline, so several instances can drain one folder; the claim lease
+# is renewed and stale instances are recovered from the same loop.
+#
+# Pending lists are bounded by the task's queue_limit. What happens past
+# that is the task's overflow policy; files that don't fit stay in the
+# folder and are forgotten by the directory snapshot, so a later scan
+# reports them again. A flood in one folder therefore costs a bounded
+# amount of memory, and stride scheduling keeps other tasks moving.
+
+# How many handled files each task remembers, oldest are forgotten first
+SEEN_INDEX_SIZE = 10000
+# Task fields that need the folder watch rebuilt when they change, the
+# rest (size, format, priority, ...) are read fresh for every file
+WATCH_FIELDS = {'watch_folder', 'output_folder', 'extra_outputs', 'watch_backend', 'recursive', 'include',
+                'exclude', 'settle_time', 'max_attempts', 'retry_delay', 'shared'}
+
+
+def quietly(fn, *args):
+    try:
+        fn(*args)
+    except Exception:
+        pass
+
+
+class Job:
+    # One file handed to the pipeline, with the journal and claim folder it was started under
+    def __init__(self, name, key, src_path, journal, claims):
+        self.name = name
+        self.key = key
+        self.src_path = src_path
+        self.journal = journal
+        self.claims = claims
+
+
+class TaskState:
+    def __init__(self, task, index, log_callback):
+        self.task = task
+        self.index = index
+        self.log = task_logger(task, log_callback)
+        self.seen = SeenIndex(SEEN_INDEX_SIZE)
+        # Files shed by drop-oldest, skipped until they change
+        self.dropped = SeenIndex(SEEN_INDEX_SIZE)
+        # name -> file key it was found ready with, in arrival order
+        self.pending = OrderedDict()
+        self.journal = None
+        self.claims = None
+        # Taken off the scheduler, journal and claims close once in_flight drains
+        self.removed = False
+        self.high_water = 0
+        # Files were turned away since the queue last had room
+        self.overflowed = False
+        self.in_flight = set()
+        self.backend = None
+        # relative dir ('' is the watch folder) -> inotify watch descriptor
+        self.wds = {}
+        self.next_check = 0.0
+        self.next_scan = None
+        self.next_lease = None
+        self.warnings = set()
+        self.pass_value = 0.0
+        self.reset_watch()
+
+    def reset_watch(self):
+        task = self.task
+        self.gate = ReadinessGate(task.settle_time)
+        self.retries = RetryQueue(task.watch_folder, task.max_attempts, task.retry_delay)
+        # A recursive watch must not pick up its own output when that lives inside the tree
+        self.snapshot = DirectorySnapshot(task.watch_folder, task.recursive, task.include, task.exclude,
+                                          skip=[task.output_folder] + [o["output_folder"] for o in task.extra_outputs])
+        self.pending.clear()
+
+    def open_journal(self):
+        # Checked with every (re)watch, the folder may have been replaced meanwhile.
+        # Shared tasks keep their journal in their own claim folder.
+        task = self.task
+        if task.shared:
+            if self.claims is None or self.claims.folder != task.watch_folder:
+                self.close_claims()
+                claims = Claims(task.watch_folder, task.name)
+                try:
+                    claims.start()
+                except OSError as e:
+                    self.warn_once("claims", f"Cannot create a claim folder in {task.watch_folder} ({e})")
+                    return False
+                self.warnings.discard("claims")
+                self.claims = claims
+            folder = self.claims.dir
+        else:
+            self.close_claims()
+            folder = task.watch_folder
+        journal = self.journal
+        if (journal and journal.enabled and (journal.folder, journal.task_name) == (folder, task.name)
+                and os.path.exists(journal.path)):
+            return True
+        # Jobs in flight hold on to the old one
+        if journal and not self.in_flight:
+            journal.close()
+        self.journal = Journal(folder, task.name, exclusive=task.shared)
+        if not self.journal.enabled:
+            self.warn_once("journal", f"Processing journal unavailable ({self.journal.error}), "
+                                      f"an interrupted run may convert files twice")
+            return True
+        self.warnings.discard("journal")
+        finished, rolled_back, stuck = self.journal.recover(skip=set(self.in_flight))
+        for key in stuck:
+            self.seen.add(key)
+        if finished or rolled_back or stuck:
+            self.log(f"[Task {self.index}] Journal: finished {finished} and rolled back {rolled_back} "
+                     f"interrupted files, {len(stuck)} sources still can't be removed", logging.WARNING)
+        return True
+
+    def close_claims(self):
+        if self.claims and not self.in_flight:
+            self.claims.close()
+        self.claims = None
+
+    def close(self):
+        if self.journal:
+            self.journal.close()
+        self.close_claims()
+
+    @property
+    def watching(self):
+        return self.backend is not None
+
+    def warn_once(self, key, msg):
+        if key not in self.warnings:
+            self.warnings.add(key)
+            self.log(f"[Task {self.index}] {msg}", logging.WARNING)
+
+
+class Scheduler:
+    POLL_INTERVAL = 1.0
+    # Safety net for missed inotify events
+    RESCAN_INTERVAL = 30.0
+    # How often missing watch/output folders are looked for again
+    CHECK_INTERVAL = 1.0
+
+    def __init__(self, log_callback, engine=None):
+        self.log_callback = log_callback
+        self.engine = engine
+        self.pipeline = Pipeline(engine)
+        self._states = {}
+        self._commands = deque()
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._virtual_time = 0.0
+        self._inotify = None
+        self._by_wd = {}
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self._stopping = False
+        self._thread = None
+
+    @property
+    def capacity(self):
+        return self.pipeline.capacity
+
+    def start(self):
+        if threading.current_thread() is threading.main_thread():
+            ignore_lease_breaks()
+        self._thread = threading.Thread(target=self._run, name="fetchx-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=2):
+        self._stopping = True
+        self.wake()
+        if self._thread:
+            self._thread.join(timeout=timeout)
+        # Files already being read, converted or written are finished first
+        self.pipeline.shutdown(wait=True)
+
+    def add_task(self, task, index):
+        task.running = True
+        self._commands.append(('add', task, index))
+        self.wake()
+
+    def remove_task(self, task):
+        task.running = False
+        self._commands.append(('remove', task, None))
+        self.wake()
+
+    def update_task(self, task, fields):
+        # The new values are already set on task, fields names what changed
+        self._commands.append(('update', task, set(fields)))
+        self.wake()
+
+    def wake(self):
+        try:
+            self._wake_w.send(b'x')
+        except OSError:
+            pass
+
+    # Scheduler thread
+
+    def _run(self):
+        try:
+            while not self._stopping:
+                self._apply_commands()
+                self._tick(time.time())
+                self._dispatch()
+                fds = [self._wake_r] + ([self._inotify] if self._inotify else [])
+                ready, _, _ = select.select(fds, [], [], self._next_timeout())
+                if self._wake_r in ready:
+                    try:
+                        while self._wake_r.recv(4096):
+                            pass
+                    except OSError:
+                        pass
+                if self._inotify and self._inotify in ready:
+                    self._read_inotify()
+        finally:
+            for task in list(self._states):
+                self._remove(task)
+            if self._inotify:
+                self._inotify.close()
+                self._inotify = None
+            self._wake_r.close()
+            self._wake_w.close()
+
+    def _apply_commands(self):
+        while self._commands:
+            op, task, arg = self._commands.popleft()
+            if op == 'add' and task not in self._states:
+                state = self._states[task] = TaskState(task, arg, self.log_callback)
+                state.log(f"[Task {arg}] Watcher started (enabled={task.enabled})")
+            elif op == 'remove' and task in self._states:
+                self._remove(task)
+            elif op == 'update' and task in self._states:
+                self._update(self._states[task], arg)
+
+    def _remove(self, task):
+        state = self._states.pop(task)
+        self._unwatch(state)
+        with self._lock:
+            state.removed = True
+            drained = not state.in_flight
+        if drained:
+            state.close()
+        METRICS.forget_task(task.name)
+        task.running = False
+        state.log(f"[Task {state.index}] Stopped watching")
+
+    def _update(self, state, fields):
+        state.log(f"[Task {state.index}] Settings changed: {', '.join(sorted(fields))}")
+        if fields & WATCH_FIELDS:
+            # Queued names belong to the old watch, a fresh scan finds whatever is still there.
+            # Conversions in flight finish with the settings they started with.
+            self._unwatch(state)
+            state.reset_watch()
+            state.next_check = 0.0
+            METRICS.queue_depth.set(state.task.name, value=0)
+
+    def _watch(self, state):
+        task = state.task
+        if not os.path.isdir(task.watch_folder):
+            state.warn_once("watch_folder_missing", f"Watch folder is missing: {task.watch_folder}")
+            return False
+        state.warnings.discard("watch_folder_missing")
+        if not os.path.exists(task.output_folder):
+            try:
+                os.makedirs(task.output_folder, exist_ok=True)
+            except Exception as e:
+                state.warn_once("output_folder_missing",
+                                f"Output folder is missing and cannot be created: {task.output_folder} ({e})")
+                return False
+        state.warnings.discard("output_folder_missing")
+        if not backend_available(task.backend):
+            state.warn_once("backend", f"The {task.backend} image backend is not installed, converting with Pillow")
+        if not state.open_journal():
+            return False
+        state.next_lease = time.time() + LEASE_INTERVAL
+
+        state.backend = 'polling'
+        if task.watch_backend in ('auto', 'inotify') and Inotify.available():
+            try:
+                if self._inotify is None:
+                    self._inotify = Inotify()
+                self._add_watch(state, '')
+                state.backend = 'inotify'
+            except OSError as e:
+                state.log(f"[Task {state.index}] inotify backend unavailable ({e}), falling back to polling",
+                          logging.WARNING)
+        state.snapshot.invalidate()
+        # First scan picks up files that were there before we started watching
+        state.next_scan = 0.0
+        state.log(f"[Task {state.index}] Watching {task.watch_folder} with the {state.backend} backend", logging.DEBUG)
+        return True
+
+    def _add_watch(self, state, rel_dir):
+        path = os.path.join(state.task.watch_folder, rel_dir) if rel_dir else state.task.watch_folder
+        wd = self._inotify.add_watch(path, subdirs=state.task.recursive)
+        state.wds[rel_dir] = wd
+        self._by_wd.setdefault(wd, []).append((state, rel_dir))
+
+    def _remove_watch(self, state, rel_dir):
+        wd = state.wds.pop(rel_dir)
+        sharing = self._by_wd.get(wd, [])
+        if (state, rel_dir) in sharing:
+            sharing.remove((state, rel_dir))
+        # Two tasks on the same folder share one watch descriptor
+        if not sharing:
+            self._by_wd.pop(wd, None)
+            if self._inotify:
+                self._inotify.remove_watch(wd)
+
+    def _sync_watches(self, state):
+        # Follow the directories the last scan found
+        dirs = set(state.snapshot.dirs())
+        for rel_dir in [d for d in state.wds if d and d not in dirs]:
+            self._remove_watch(state, rel_dir)
+        try:
+            for rel_dir in dirs.difference(state.wds):
+                self._add_watch(state, rel_dir)
+        except OSError as e:
+            # Usually ENOSPC, fs.inotify.max_user_watches is used up
+            for rel_dir in list(state.wds):
+                self._remove_watch(state, rel_dir)
+            state.backend = 'polling'
+            state.log(f"[Task {state.index}] Cannot watch every subfolder with inotify ({e}), "
+                      f"falling back to polling", logging.WARNING)
+
+    def _unwatch(self, state):
+        for rel_dir in list(state.wds):
+            self._remove_watch(state, rel_dir)
+        state.backend = None
+        state.next_scan = None
+        state.next_check = time.time() + self.CHECK_INTERVAL
+
+    def _read_inotify(self):
+        for wd, mask, name in self._inotify.read():
+            if mask & Inotify.IN_Q_OVERFLOW:
+                # Events were lost, have every inotify task rescan from scratch
+                for state in self._states.values():
+                    if state.backend == 'inotify':
+                        state.snapshot.invalidate()
+                        state.next_scan = 0.0
+                continue
+            watchers = list(self._by_wd.get(wd, []))
+            if mask & Inotify.IN_IGNORED:
+                # The folder is gone (or was unmounted), the kernel already dropped the watch
+                self._by_wd.pop(wd, None)
+                for state, rel_dir in watchers:
+                    state.wds.pop(rel_dir, None)
+                    if not rel_dir:
+                        # Look for the watch folder itself again later
+                        self._unwatch(state)
+                continue
+            if not name:
+                continue
+            if mask & Inotify.IN_ISDIR:
+                # A new subfolder, the rescan lists it and adds its watch
+                for state, _ in watchers:
+                    if state.task.recursive:
+                        state.next_scan = 0.0
+                continue
+            # A created file is still being written, its IN_CLOSE_WRITE follows
+            if mask & Inotify.IN_CREATE or not is_image_name(name):
+                continue
+            for state, rel_dir in watchers:
+                filename = os.path.join(rel_dir, name) if rel_dir else name
+                if match_path(filename, state.task.include, state.task.exclude):
+                    self._handle(state, filename, True)
+
+    def _tick(self, now):
+        for state in list(self._states.values()):
+            # Paused shared tasks keep their lease, or others would adopt their claim folder
+            if state.claims and now >= state.next_lease:
+                self._renew_lease(state, now)
+            if not state.task.enabled:
+                continue
+            if not state.watching:
+                if now < state.next_check or not self._watch(state):
+                    state.next_check = max(state.next_check, now + self.CHECK_INTERVAL)
+                    continue
+            if now >= state.next_scan:
+                if state.backend == 'polling' and not os.path.isdir(state.task.watch_folder):
+                    self._unwatch(state)
+                    continue
+                for name in state.snapshot.scan():
+                    self._handle(state, name, False)
+                if state.backend == 'inotify' and state.task.recursive:
+                    self._sync_watches(state)
+                state.next_scan = now + (self.POLL_INTERVAL if state.backend == 'polling' else self.RESCAN_INTERVAL)
+            # Files still being written and failed files waiting out their
+            # backoff come back once they are due
+            for name in state.gate.due() + state.retries.due():
+                self._handle(state, name, False)
+
+    def _renew_lease(self, state, now):
+        state.claims.heartbeat()
+        for other in state.claims.stale():
+            moved = state.claims.adopt(other)
+            if moved is not None:
+                state.log(f"[Task {state.index}] Instance {other} stopped renewing its lease, "
+                          f"put {moved} claimed files back", logging.WARNING)
+                if moved:
+                    state.next_scan = 0.0
+        state.next_lease = now + LEASE_INTERVAL
+
+    def _next_timeout(self):
+        if not self._states:
+            return None
+        now = time.time()
+        timeout = self.RESCAN_INTERVAL
+        for state in self._states.values():
+            if state.claims:
+                timeout = min(timeout, state.next_lease - now)
+            if not state.task.enabled:
+                continue
+            if not state.watching:
+                timeout = min(timeout, state.next_check - now)
+                continue
+            timeout = min(timeout, state.next_scan - now, state.gate.wait_time(timeout),
+                          state.retries.wait_time(timeout))
+        return max(0.0, timeout)
+
+    def _handle(self, state, filename, closed):
+        task = state.task
+        key = file_key(task.watch_folder, filename)
+        if key is None:
+            state.gate.forget(filename)
+            state.retries.forget(filename)
+            state.pending.pop(filename, None)
+            return
+        with self._lock:
+            if key in state.seen or filename in state.in_flight:
+                return
+        if key in state.dropped or state.retries.blocked(filename, key):
+            return
+        waiting = filename in state.gate
+        if not state.gate.check(task.watch_folder, key, closed):
+            if not waiting:
+                state.log(f"[Task {state.index}] Waiting for {filename} to finish writing", logging.DEBUG)
+            return
+        if filename in state.retries:
+            state.retries.attempting(filename)
+        self._enqueue(state, filename, key)
+
+    def _enqueue(self, state, filename, key):
+        # key: what the file looked like when the readiness gate let it through
+        task = state.task
+        if filename in state.pending:
+            state.pending[filename] = key
+            return
+        if task.queue_limit and len(state.pending) >= task.queue_limit:
+            if not state.overflowed:
+                state.log(f"[Task {state.index}] Queue full ({task.queue_limit} files), "
+                          f"overflow policy is {task.overflow}", logging.WARNING)
+            state.overflowed = True
+            if task.overflow in ('block', 'defer'):
+                # Reported again by a later scan
+                state.snapshot.invalidate(filename)
+                METRICS.deferred.inc(task.name)
+                return
+            oldest, _ = state.pending.popitem(last=False)
+            if task.overflow == 'drop-oldest':
+                dropped_key = file_key(task.watch_folder, oldest)
+                if dropped_key:
+                    state.dropped.add(dropped_key)
+                METRICS.dropped.inc(task.name)
+                state.log(f"[Task {state.index}] Dropped {oldest}, the queue is full", logging.DEBUG)
+            else:
+                state.snapshot.invalidate(oldest)
+                METRICS.deferred.inc(task.name)
+        if not state.pending:
+            # A task that was idle starts level with the others instead of catching up
+            state.pass_value = max(state.pass_value, self._virtual_time)
+        state.pending[filename] = key
+        METRICS.queue_depth.set(task.name, value=len(state.pending))
+        if len(state.pending) > state.high_water:
+            state.high_water = len(state.pending)
+            METRICS.queue_high_water.set(task.name, value=state.high_water)
+
+    def _pick(self):
+        best = None
+        for state in self._states.values():
+            task = state.task
+            if not state.pending or not task.enabled:
+                continue
+            # One file more than max_workers, so the next one is read while those convert
+            if len(state.in_flight) >= (task.max_workers + 1 if task.max_workers else self.capacity):
+                continue
+            if best is None or (task.priority, -state.pass_value) > (best.task.priority, -best.pass_value):
+                best = state
+        return best
+
+    def _dispatch(self):
+        while self._in_flight < self.capacity:
+            state = self._pick()
+            if state is None:
+                return
+            task = state.task
+            self._virtual_time = state.pass_value
+            state.pass_value += 1.0 / task.weight
+            filename, ready_key = state.pending.popitem(last=task.overflow == 'newest-first')
+            METRICS.queue_depth.set(task.name, value=len(state.pending))
+            if state.overflowed and len(state.pending) <= task.queue_limit // 2:
+                state.overflowed = False
+                state.log(f"[Task {state.index}] Queue has room again "
+                          f"(high-water mark {state.high_water} files)", logging.INFO)
+                if task.overflow != 'defer' and state.watching:
+                    # Pick up whatever was turned away right now instead of at the next rescan
+                    state.next_scan = 0.0
+            self._submit(state, filename, ready_key)
+
+    def _submit(self, state, filename, ready_key):
+        task = state.task
+        # Looked at again right before it is claimed: the file may have been
+        # renamed away or rewritten while it waited in the queue
+        key = file_key(task.watch_folder, filename)
+        if key is None:
+            state.gate.forget(filename)
+            state.retries.forget(filename)
+            return
+        if key != ready_key:
+            self._handle(state, filename, False)
+            return
+        with self._lock:
+            if key in state.seen:
+                return
+        src_path = os.path.join(task.watch_folder, filename)
+        if state.claims:
+            src_path = state.claims.claim(filename)
+            if src_path is None:
+                state.log(f"[Task {state.index}] {filename} was claimed by another instance", logging.DEBUG)
+                return
+        if filename in state.retries:
+            METRICS.retried.inc(task.name)
+            state.log(f"[Task {state.index}] Retrying {filename}", logging.DEBUG)
+        job = Job(filename, key, src_path, state.journal, state.claims)
+        options = job_options(task)
+        subdir = os.path.dirname(filename) if task.mirror_paths else ""
+        options["subdir"] = subdir
+        options["names"] = [random_name(o["format"].lower()) for o in options["outputs"]]
+        # The source is removed here after the outputs are journaled, not by the worker
+        options["keep_source"] = True
+        job.journal.claimed(filename, key, [os.path.join(o["output_folder"], subdir, name)
+                                            for o, name in zip(options["outputs"], options["names"])])
+        with self._lock:
+            state.in_flight.add(filename)
+            self._in_flight += 1
+            METRICS.running_workers.set(task.name, value=len(state.in_flight))
+        # Never blocks: _dispatch keeps _in_flight within the pipeline's capacity
+        self.pipeline.submit(task, src_path, options, functools.partial(self._on_done, state, job))
+
+    # Called from the pipeline's threads as well
+
+    def _done(self, state, job):
+        with self._lock:
+            state.in_flight.discard(job.name)
+            self._in_flight -= 1
+            METRICS.running_workers.set(state.task.name, value=len(state.in_flight))
+            drained = state.removed and not state.in_flight
+        if drained:
+            state.close()
+
+    def _on_done(self, state, job, result, error):
+        try:
+            if isinstance(error, FileNotFoundError) and not os.path.exists(job.src_path):
+                self._gone(state, job)
+            elif error is not None:
+                self._fail(state, job, error)
+            elif not result["output"]:
+                quietly(METRICS.record_conversion, state.task.name, result)
+                self._fail(state, job, "output was not written, original not deleted", count=False)
+            else:
+                self._finish(state, job, result)
+        finally:
+            self._done(state, job)
+            self.wake()
+
+    def _finish(self, state, job, result):
+        # Every output is on disk: from "written" on the journal only ever
+        # moves forward, nothing below may lead to a rollback
+        job.journal.written(job.name)
+        started = time.perf_counter()
+        try:
+            os.remove(job.src_path)
+            job.journal.removed(job.name)
+        except FileNotFoundError:
+            job.journal.removed(job.name)
+        except OSError as e:
+            # Stays "written" in the journal, the next start tries again instead of converting it twice
+            quietly(state.log, f"[Task {state.index}] Could not remove {job.name} after converting it: {e}",
+                    logging.WARNING)
+        result["timings"]["delete"] = time.perf_counter() - started
+        # Bookkeeping and logging, each on its own so one failing (a closed
+        # stdout, say) doesn't skip the others
+        quietly(METRICS.record_conversion, state.task.name, result)
+        with self._lock:
+            state.seen.add(job.key)
+        quietly(state.retries.succeeded, job.name)
+        quietly(state.log, f"[Task {state.index}] ✔ {job.name} → "
+                           f"{', '.join(result.get('outputs') or [result['output']])}")
+
+    def _gone(self, state, job):
+        # The source went away mid-job (its writer renamed it, say): nothing
+        # failed and there is nothing to retry, a new name gets its own event
+        job.journal.rollback(job.name)
+        state.retries.forget(job.name)
+        state.log(f"[Task {state.index}] {job.name} was gone before it could be converted", logging.DEBUG)
+
+    def _fail(self, state, job, e, count=True):
+        task = state.task
+        # Don't leave outputs of a worker that died halfway
+        job.journal.rollback(job.name)
+        if job.claims:
+            # Back into the shared folder, so the retry (here or on another instance) can find it
+            job.claims.release(job.name)
+        if count:
+            METRICS.failed.inc(task.name)
+        outcome, detail = state.retries.failed(job.name, job.key, e)
+        if outcome == 'retry':
+            state.log(f"[Task {state.index}] Error processing {job.name}: {e} (retrying in {detail:.1f}s)",
+                      logging.ERROR)
+        else:
+            METRICS.quarantined.inc(task.name)
+            state.log(f"[Task {state.index}] Error processing {job.name}: {e}, giving up after {task.max_attempts} "
+                      f"attempts and moving it to {detail or 'quarantine (move failed)'}", logging.ERROR)
+        # The retry timer lives in the scheduler thread
+        self.wake()
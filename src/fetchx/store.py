@@ -0,0 +1,144 @@
+import os
+import time
+
+from .config import CONFIG_FILE, load_config, load_settings, save_config, task_to_dict
+
+# Config store
+#
+# Holds the tasks and settings of one config file. save() only marks the
+# store dirty; poll() writes once the changes have been quiet for
+# SAVE_DELAY seconds, so toggling ten tasks costs one write, and
+# save_config() swaps the file in atomically. poll() also notices when
+# someone else edited the file and reloads it. Tasks are matched by name
+# and changed fields are copied onto the existing Task objects, so running
+# tasks pick them up in place instead of being stopped and restarted.
+#
+# An outside edit wins over local changes that weren't written yet.
+# Settings are reloaded too, but most of them only apply on restart.
+
+
+def update_task(task, new):
+    # Copy every config field that differs from new onto task, returns their names
+    before, after = task_to_dict(task), task_to_dict(new)
+    fields = [k for k in after if before.get(k) != after[k]]
+    for k in fields:
+        setattr(task, k, getattr(new, k))
+    return fields
+
+
+def diff_tasks(old, new):
+    # Returns (tasks, added, removed, changed): the merged task list in the
+    # new order, with (task, fields) pairs for the ones updated in place
+    by_name = {}
+    for t in old:
+        by_name.setdefault(t.name, []).append(t)
+    tasks, added, changed = [], [], []
+    for t in new:
+        same = by_name.get(t.name)
+        if not same:
+            added.append(t)
+            tasks.append(t)
+            continue
+        current = same.pop(0)
+        fields = update_task(current, t)
+        if fields:
+            changed.append((current, fields))
+        tasks.append(current)
+    removed = [t for same in by_name.values() for t in same]
+    return tasks, added, removed, changed
+
+
+def apply_task_changes(scheduler, tasks, added, removed, changed, selected=None):
+    # Bring the scheduler in line with a reloaded task list. Task numbers
+    # in the log follow the position in the list, like everywhere else.
+    def wanted(task):
+        return task.enabled and (selected is None or selected(task))
+
+    for task in removed:
+        if task.running:
+            scheduler.remove_task(task)
+    for task, fields in changed:
+        if task.running and not wanted(task):
+            scheduler.remove_task(task)
+        elif task.running:
+            scheduler.update_task(task, fields)
+        elif wanted(task):
+            scheduler.add_task(task, tasks.index(task) + 1)
+    for task in added:
+        if wanted(task):
+            scheduler.add_task(task, tasks.index(task) + 1)
+
+
+class ConfigStore:
+    # Seconds without further changes before they are written
+    SAVE_DELAY = 0.5
+    # How often callers are expected to call poll()
+    POLL_INTERVAL = 1.0
+
+    def __init__(self, path=None, log_callback=None, save_delay=SAVE_DELAY):
+        self.path = path or CONFIG_FILE
+        self.log_callback = log_callback
+        self.save_delay = save_delay
+        self.tasks = load_config(self.path)
+        self.settings = load_settings(self.path)
+        self._save_due = None
+        self._stamp = self._file_stamp()
+
+    def _file_stamp(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _log(self, msg):
+        if self.log_callback:
+            self.log_callback(msg)
+
+    @property
+    def dirty(self):
+        return self._save_due is not None
+
+    def save(self):
+        # Every call pushes the write back, a burst of changes ends in one write
+        self._save_due = time.monotonic() + self.save_delay
+
+    def flush(self):
+        if self._save_due is None:
+            return
+        self._save_due = None
+        try:
+            save_config(self.tasks, self.settings, self.path)
+        except OSError as e:
+            self._log(f"Could not save {self.path}: {e}")
+            return
+        self._stamp = self._file_stamp()
+
+    def poll(self):
+        # Returns (tasks, added, removed, changed) after an outside edit, else None
+        stamp = self._file_stamp()
+        if stamp is not None and stamp != self._stamp:
+            self._stamp = stamp
+            return self.reload()
+        if self._save_due is not None and time.monotonic() >= self._save_due:
+            self.flush()
+        return None
+
+    def reload(self):
+        try:
+            new_tasks = load_config(self.path)
+            settings = load_settings(self.path)
+        except (OSError, ValueError, TypeError) as e:
+            # Most likely caught mid-save by an editor, the next change retries
+            self._log(f"Ignoring unreadable {self.path}: {e}")
+            return None
+        if self._save_due is not None:
+            self._log(f"{self.path} was changed outside FetchX, unsaved changes were dropped")
+            self._save_due = None
+        tasks, added, removed, changed = diff_tasks(self.tasks, new_tasks)
+        # Same list object, holders of store.tasks see the new contents
+        self.tasks[:] = tasks
+        self.settings = settings
+        if added or removed or changed:
+            self._log(f"Reloaded {self.path}: {len(added)} added, {len(removed)} removed, {len(changed)} changed")
+        return self.tasks, added, removed, changed
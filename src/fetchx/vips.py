@@ -0,0 +1,176 @@
+from PIL import Image as PILImage
+
+from .imaging import PillowBackend, resize_plan, save_format, encoder_settings, background_color
+
+try:
+    import pyvips
+except (ImportError, OSError):
+    # Not installed, or the libvips shared library is missing
+    pyvips = None
+else:
+    # Every file is converted once, cached operations would only keep
+    # sources open (and undeletable on Windows) after they are done
+    pyvips.cache_set_max(0)
+
+# libvips backend
+#
+# libvips evaluates lazily and streams: a single-output conversion is one
+# pipeline from the decoder through resize to the encoder, run on all
+# cores a strip at a time, so a big TIFF or PNG never sits in memory
+# decoded. With several outputs the decoded source is copied into memory
+# once instead of decoding it again for each.
+#
+# Optional: pip install pyvips (needs libvips, or the pyvips-binary wheel).
+
+# vips loader -> format as in SAVE_FORMATS
+LOADER_FORMATS = {'jpegload': 'JPEG', 'pngload': 'PNG', 'webpload': 'WEBP', 'tiffload': 'TIFF'}
+
+# libvips has no box filter; its integer shrink before the kernel is a box filter already
+KERNELS = {'nearest': 'nearest', 'bilinear': 'linear', 'box': 'linear', 'bicubic': 'cubic', 'lanczos': 'lanczos3'}
+
+# Pillow save() option -> vips saver option
+SAVE_OPTIONS = {'quality': 'Q', 'compress_level': 'compression', 'method': 'effort',
+                'optimize': 'optimize_coding', 'progressive': 'interlace', 'lossless': 'lossless'}
+TIFF_COMPRESSION = {'tiff_adobe_deflate': 'deflate', 'tiff_lzw': 'lzw', 'jpeg': 'jpeg', 'raw': 'none'}
+
+
+def save_options(save_ext, settings):
+    # Options the saver doesn't have (Pillow-only ones from encoder_options) are dropped
+    known = set(pyvips.Introspect.get(f"{save_ext.lower()}save_buffer").optional_input)
+    options = {}
+    if save_ext == 'PNG':
+        # libpng's adaptive row filters, like Pillow; libvips leaves them off by default
+        options['filter'] = 'all'
+    for key, value in settings.items():
+        if key == 'subsampling':
+            # Pillow: 0 = 4:4:4, 2 = 4:2:0
+            options['subsample_mode'] = 'off' if value in (0, '4:4:4') else 'on'
+        elif key == 'compression' and save_ext == 'TIFF':
+            options['compression'] = TIFF_COMPRESSION.get(value, 'none')
+        elif key in SAVE_OPTIONS:
+            options[SAVE_OPTIONS[key]] = value
+    return {k: v for k, v in options.items() if k in known}
+
+
+def pillow_mode(img):
+    # The mode Pillow would decode the file as, None when there's no match
+    if img.interpretation == 'cmyk':
+        return 'CMYK'
+    if img.format == 'uchar':
+        return {1: 'L', 2: 'LA', 3: 'RGB', 4: 'RGBA'}.get(img.bands)
+    if img.format == 'ushort' and img.bands == 1:
+        return 'I;16'
+    return None
+
+
+class VipsBackend:
+    name = 'vips'
+
+    @staticmethod
+    def available():
+        return pyvips is not None
+
+    def open(self, src_path, stream=None):
+        # Always from the file: prefetching it pulled it into the page cache,
+        # and an image over a Python buffer would have to outlive every vips
+        # pipeline built on it
+        try:
+            return pyvips.Image.new_from_file(src_path, access='sequential')
+        except pyvips.Error:
+            # A file libvips can't load (BMP without ImageMagick, say): let Pillow
+            # decode it and carry on in vips
+            with PILImage.open(src_path) as pil:
+                fmt, mode = pil.format, pil.mode
+                pil = pil.convert('RGBA' if pil.mode in ('RGBA', 'LA', 'PA') or 'transparency' in pil.info else 'RGB')
+                data = pil.tobytes()
+                # Rendered into memory libvips owns: an image made straight from data
+                # would point into a bytes object that dies with this call
+                img = pyvips.Image.new_from_memory(data, pil.width, pil.height, len(pil.getbands()),
+                                                   'uchar').copy().copy_memory()
+            img.set_type(pyvips.GValue.gstr_type, 'fetchx-format', fmt)
+            img.set_type(pyvips.GValue.gstr_type, 'fetchx-mode', mode)
+            return img
+
+    def probe(self, img):
+        fields = img.get_fields()
+        if 'fetchx-format' in fields:
+            return (img.width, img.height), img.get('fetchx-format'), img.get('fetchx-mode')
+        loader = img.get('vips-loader') if 'vips-loader' in fields else ''
+        fmt = next((f for prefix, f in LOADER_FORMATS.items() if loader.startswith(prefix)), None)
+        return (img.width, img.height), fmt, pillow_mode(img)
+
+    def decode(self, img, size, downscale='quality', reuse=False):
+        loader = img.get('vips-loader') if 'vips-loader' in img.get_fields() else ''
+        if downscale != 'quality' and loader.startswith('jpegload'):
+            # Shrink-on-load, the DCT-domain scaling Pillow's draft() does (never below the target)
+            shrink = max([f for f in (2, 4, 8) if img.width // f >= size[0] and img.height // f >= size[1]],
+                         default=1)
+            if shrink > 1:
+                img = pyvips.Image.new_from_file(img.filename, access='sequential', shrink=shrink)
+        if img.interpretation not in ('srgb', 'b-w'):
+            # CMYK, 16 bit, Lab...: everything below works on 8 bit sRGB or grey
+            img = img.colourspace('b-w' if img.interpretation in ('b-w', 'grey16') else 'srgb')
+        if reuse:
+            # Several outputs read the source, decode it once instead of once per output
+            img = img.copy_memory()
+        return img
+
+    def size(self, img):
+        return img.width, img.height
+
+    def resize(self, img, spec):
+        out_size, box = resize_plan((img.width, img.height), (spec["width"], spec["height"]),
+                                    spec.get("resize_mode", 'stretch'))
+        if out_size == (img.width, img.height) and box == (0, 0, img.width, img.height):
+            return img
+        if box != (0, 0, img.width, img.height):
+            left, top = round(box[0]), round(box[1])
+            img = img.crop(left, top, min(img.width - left, max(1, round(box[2] - box[0]))),
+                           min(img.height - top, max(1, round(box[3] - box[1]))))
+        shrinking = img.width > out_size[0] and img.height > out_size[1]
+        downscale = spec.get("downscale", 'quality')
+        resample = spec.get("resample", 'auto')
+        if resample != 'auto':
+            kernel = KERNELS[resample]
+        elif downscale == 'fast' and shrinking:
+            kernel = 'linear'
+        else:
+            kernel = 'cubic'
+        options = {'kernel': kernel, 'vscale': out_size[1] / img.height}
+        # Same meaning as Pillow's reducing_gap; 0 turns the box pre-shrink off
+        gap = spec.get("reducing_gap", 0.0)
+        if not gap and shrinking:
+            gap = {'balanced': 3.0, 'fast': 1.0}.get(downscale, 0.0)
+        options['gap'] = gap if shrinking else 0.0
+        if img.hasalpha():
+            # Resample premultiplied, or transparent pixels bleed dark fringes
+            return img.premultiply().resize(out_size[0] / img.width, **options).unpremultiply().cast(img.format)
+        return img.resize(out_size[0] / img.width, **options)
+
+    def normalize(self, img, spec):
+        # decode() left 8 bit sRGB or grey, with or without alpha; BMP is done by Pillow in encode()
+        save_ext = save_format(spec["format"])
+        if save_ext == 'JPEG' and img.hasalpha():
+            # jpegsave would just drop the alpha band
+            r, g, b = background_color(spec.get("background"))
+            background = [(r * 299 + g * 587 + b * 114) // 1000] if img.bands == 2 else [r, g, b]
+            img = img.flatten(background=background).cast('uchar')
+        elif save_ext == 'WEBP' and img.bands < 3:
+            # webpsave drops the alpha of grey images, WebP is always RGB(A) anyway
+            img = img.colourspace('srgb')
+        return img
+
+    def encode(self, img, spec):
+        save_ext = save_format(spec["format"])
+        settings = encoder_settings(save_ext, spec.get("encoder", 'balanced'), spec.get("encoder_options"))
+        if save_ext == 'BMP':
+            # No BMP saver in libvips, hand the pixels to Pillow
+            pil = PILImage.frombytes({1: 'L', 2: 'LA', 3: 'RGB', 4: 'RGBA'}[img.bands], (img.width, img.height),
+                                     img.write_to_memory())
+            pillow = PillowBackend()
+            return pillow.encode(pillow.normalize(pil, spec), spec)
+        return img.write_to_buffer('.' + save_ext.lower(), **save_options(save_ext, settings))
+
+    def close(self, img):
+        # Reference counted, dropping the last reference frees it
+        pass
@@ -0,0 +1,379 @@
+import os
+import sys
+import stat
+import errno
+import time
+import signal
+import struct
+import threading
+import ctypes
+import ctypes.util
+import fnmatch
+from collections import OrderedDict
+
+from .config import IMAGE_EXTENSIONS
+
+# Watch backends
+#
+# The scheduler reads a single Inotify fd for every inotify task and scans
+# directory snapshots for polling tasks (and as the inotify safety net).
+# An inotify event means the writer is done with the file (close-write /
+# moved-in); the scheduler decides what to do with it, so duplicates are
+# harmless.
+
+# Directory snapshots
+#
+# A snapshot remembers (inode, size, mtime) per image in a folder and only
+# reports names that are new or changed since the previous scan. When the
+# folder's own mtime hasn't moved and nothing in it was touched recently,
+# the scan is skipped altogether, so an idle folder costs one stat().
+#
+# Recursive snapshots keep that state per directory. A directory's mtime
+# only changes when its own entries do, so every directory still gets one
+# stat() per scan, but only the changed ones are listed again. Names are
+# paths relative to the watched folder.
+
+# Folders FetchX keeps inside watch folders (quarantine, claims), never watched
+INTERNAL_DIR_PREFIX = '.fetchx_'
+
+
+def is_image_name(name):
+    # Dot-prefixed names are the temp files of write-then-rename producers
+    # (".tmp123.png") or hidden files, never converted: the real name follows
+    return name.lower().endswith(IMAGE_EXTENSIONS) and not name.startswith('.')
+
+
+def match_path(rel_path, include=(), exclude=()):
+    # Globs are matched against the relative path with forward slashes,
+    # a pattern without a slash also matches the bare file name
+    rel_path = rel_path.replace(os.sep, '/')
+    name = rel_path.rsplit('/', 1)[-1]
+
+    def hit(pattern):
+        return fnmatch.fnmatch(rel_path, pattern) or ('/' not in pattern and fnmatch.fnmatch(name, pattern))
+
+    if any(hit(p) for p in exclude):
+        return False
+    return not include or any(hit(p) for p in include)
+
+
+class DirRecord:
+    def __init__(self, mtime):
+        self.mtime = mtime
+        self.hot = True
+        self.entries = {}
+        self.subdirs = []
+
+
+class DirectorySnapshot:
+    # Files modified this recently may still be growing (and coarse directory
+    # mtimes can hide a change), so they keep the folder "hot" and rescanned
+    HOT_WINDOW = 3.0
+
+    def __init__(self, folder, recursive=False, include=(), exclude=(), skip=()):
+        self.folder = folder
+        self.recursive = recursive
+        self.include = tuple(include)
+        self.exclude = tuple(exclude)
+        # Folders inside the tree that are never descended into, e.g. an output folder
+        self.skip = {os.path.normcase(os.path.abspath(p)) for p in skip if p}
+        # relative dir ('' is the folder itself) -> DirRecord
+        self._dirs = {}
+        self._lock = threading.Lock()
+
+    def invalidate(self, name=None):
+        # Report name (or everything) again on the next scan
+        with self._lock:
+            if name is None:
+                self._dirs = {}
+                return
+            record = self._dirs.get(os.path.dirname(name))
+            if record:
+                record.entries.pop(os.path.basename(name), None)
+                record.hot = True
+
+    def dirs(self):
+        with self._lock:
+            return list(self._dirs)
+
+    def scan(self):
+        with self._lock:
+            now = time.time()
+            dirs = {}
+            changed = []
+            stack = ['']
+            while stack:
+                rel_dir = stack.pop()
+                path = os.path.join(self.folder, rel_dir) if rel_dir else self.folder
+                try:
+                    dir_mtime = os.stat(path).st_mtime_ns
+                except OSError:
+                    continue
+                record = self._dirs.get(rel_dir)
+                if record is None or record.mtime != dir_mtime or record.hot:
+                    record = self._scan_dir(rel_dir, path, dir_mtime, record, now, changed)
+                    if record is None:
+                        continue
+                dirs[rel_dir] = record
+                stack.extend(record.subdirs)
+            self._dirs = dirs
+            return changed
+
+    def _scan_dir(self, rel_dir, path, dir_mtime, previous, now, changed):
+        old_entries = previous.entries if previous else {}
+        record = DirRecord(dir_mtime)
+        hot = now - dir_mtime / 1e9 < self.HOT_WINDOW
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    rel_name = os.path.join(rel_dir, entry.name) if rel_dir else entry.name
+                    try:
+                        if self.recursive and entry.is_dir(follow_symlinks=False):
+                            if (not entry.name.startswith(INTERNAL_DIR_PREFIX)
+                                    and os.path.normcase(os.path.abspath(entry.path)) not in self.skip
+                                    and match_path(rel_name, exclude=self.exclude)):
+                                record.subdirs.append(rel_name)
+                            continue
+                        if not is_image_name(entry.name):
+                            continue
+                        if (self.include or self.exclude) and not match_path(rel_name, self.include, self.exclude):
+                            continue
+                        old = old_entries.get(entry.name)
+                        # On POSIX inode() comes free with the listing, so a cold entry with
+                        # the same inode doesn't need a stat(). On Windows stat() is the free one.
+                        if os.name != 'nt' and old and old[0] == entry.inode() and now - old[2] / 1e9 >= self.HOT_WINDOW:
+                            record.entries[entry.name] = old
+                            continue
+                        if not entry.is_file():
+                            continue
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    key = (st.st_ino, st.st_size, st.st_mtime_ns)
+                    record.entries[entry.name] = key
+                    if now - st.st_mtime < self.HOT_WINDOW:
+                        hot = True
+                    if old != key:
+                        changed.append(rel_name)
+        except OSError:
+            return None
+        record.hot = hot
+        return record
+
+
+class SeenIndex:
+    # Bounded record of files already handled, keyed on (name, inode, size, mtime)
+    # so a new file reusing an old name is not mistaken for the old one.
+    # The least recently added keys are evicted first.
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._keys = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, key):
+        self._keys[key] = None
+        self._keys.move_to_end(key)
+        while len(self._keys) > self.max_entries:
+            self._keys.popitem(last=False)
+
+    def discard(self, key):
+        self._keys.pop(key, None)
+
+
+def file_key(folder, name):
+    # None when the name is gone or isn't a regular file
+    try:
+        st = os.stat(os.path.join(folder, name))
+    except OSError:
+        return None
+    if not stat.S_ISREG(st.st_mode):
+        return None
+    return (name, st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+class Inotify:
+    # One inotify instance; a single fd can watch any number of folders
+
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_MASK_ADD = 0x20000000
+    IN_ISDIR = 0x40000000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+    EVENT_HEADER = struct.Struct('iIII')
+
+    _libc = None
+
+    @classmethod
+    def available(cls):
+        if not sys.platform.startswith('linux'):
+            return False
+        if cls._libc is None:
+            try:
+                libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+                libc.inotify_init1
+                libc.inotify_add_watch
+                libc.inotify_rm_watch
+            except (OSError, AttributeError):
+                return False
+            cls._libc = libc
+        return True
+
+    def __init__(self):
+        fd = self._libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.fd = fd
+
+    def fileno(self):
+        return self.fd
+
+    def add_watch(self, folder, subdirs=False):
+        # IN_MASK_ADD so two tasks on one folder don't overwrite each other's mask
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_MASK_ADD
+        if subdirs:
+            mask |= self.IN_CREATE
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(folder), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f"inotify_add_watch failed for {folder}: {os.strerror(err)}")
+        return wd
+
+    def remove_watch(self, wd):
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self):
+        # [(wd, mask, name)] for whatever is queued, name is '' for events on the folder itself
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = self.EVENT_HEADER.unpack_from(data, offset)
+            offset += self.EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            events.append((wd, mask, name))
+        return events
+
+    def close(self):
+        if self.fd is not None:
+            try:
+                os.close(self.fd)
+            except OSError:
+                pass
+            self.fd = None
+
+
+# Write completion
+#
+# A file is only handed to the pipeline once its writer is done with it:
+# either the OS reported close-write, or its size and mtime stayed the same
+# for settle_time seconds. On top of that, files another process still has
+# open for writing are held back.
+#
+# On Linux that check takes a read lease for an instant. A writer opening
+# the file meanwhile breaks the lease, and the kernel tells the holder with
+# SIGIO, which kills a process by default. The check is therefore only made
+# once SIGIO is ignored (or handled); only the main thread can set that, so
+# the entry points call ignore_lease_breaks() before starting the scheduler.
+
+F_SETLEASE = 1024
+F_RDLCK, F_UNLCK = 0, 2
+
+
+def ignore_lease_breaks():
+    if hasattr(signal, 'SIGIO'):
+        signal.signal(signal.SIGIO, signal.SIG_IGN)
+
+
+def is_held_open(path):
+    if sys.platform.startswith('linux'):
+        if signal.getsignal(signal.SIGIO) == signal.SIG_DFL:
+            return False
+        # A read lease can't be taken while anyone has the file open for writing
+        import fcntl
+        try:
+            fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+        except OSError:
+            return False
+        try:
+            fcntl.fcntl(fd, F_SETLEASE, F_RDLCK)
+            fcntl.fcntl(fd, F_SETLEASE, F_UNLCK)
+            return False
+        except OSError as e:
+            # EACCES/EINVAL: not our file or a filesystem without leases, can't tell
+            return e.errno == errno.EAGAIN
+        finally:
+            os.close(fd)
+    if os.name == 'nt':
+        # Writers rarely share write access, so opening for writing fails while they hold it
+        if not os.access(path, os.W_OK):
+            return False
+        try:
+            os.close(os.open(path, os.O_RDWR | os.O_BINARY))
+            return False
+        except PermissionError:
+            return True
+        except OSError:
+            return False
+    return False
+
+
+class ReadinessGate:
+    # How often a file that is still held open is looked at again
+    HELD_OPEN_RECHECK = 0.25
+    # A file that hasn't changed for this long goes ahead even if something
+    # still holds it open (e.g. a writer that never closes)
+    HELD_OPEN_LIMIT = 30.0
+
+    def __init__(self, settle_time=1.0):
+        self.settle_time = settle_time
+        # name -> (last file key seen, when to look again, since when the key is unchanged)
+        self._pending = {}
+
+    def __contains__(self, name):
+        return name in self._pending
+
+    def forget(self, name):
+        self._pending.pop(name, None)
+
+    def check(self, folder, key, closed=False):
+        name, size, mtime_ns = key[0], key[2], key[3]
+        now = time.time()
+        previous = self._pending.get(name)
+        since = previous[2] if previous and previous[0] == key else now
+        if closed:
+            settled = True
+        else:
+            settled = now - mtime_ns / 1e9 >= self.settle_time and (previous is None or previous[0] == key)
+        if settled and (now - since >= self.HELD_OPEN_LIMIT or not is_held_open(os.path.join(folder, name))):
+            self._pending.pop(name, None)
+            return True
+        if settled:
+            due = now + max(self.settle_time, self.HELD_OPEN_RECHECK)
+        else:
+            due = max(mtime_ns / 1e9 + self.settle_time, now + 0.05)
+        self._pending[name] = (key, due, since)
+        return False
+
+    def wait_time(self, limit):
+        if not self._pending:
+            return limit
+        next_due = min(entry[1] for entry in self._pending.values())
+        return max(0.0, min(limit, next_due - time.time()))
+
+    def due(self):
+        now = time.time()
+        return [name for name, entry in self._pending.items() if entry[1] <= now]
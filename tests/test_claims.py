@@ -0,0 +1,122 @@
+import os
+import json
+import subprocess
+import sys
+
+import fetchx.claims
+from fetchx.claims import Claims, CLAIMS_DIR, LEASE_FILE
+from fetchx.journal import Journal
+from fetchx.watch import file_key
+
+
+def dead_pid():
+    proc = subprocess.Popen([sys.executable, "-c", "pass"])
+    proc.wait()
+    return proc.pid
+
+
+def test_each_file_goes_to_one_instance(tmp_path):
+    (tmp_path / "a.png").write_bytes(b"image")
+    first, second = Claims(str(tmp_path), "t"), Claims(str(tmp_path), "t")
+    first.start()
+    second.start()
+    assert first.claim("a.png") == os.path.join(first.dir, "a.png")
+    assert second.claim("a.png") is None
+    assert (tmp_path / CLAIMS_DIR / first.instance / "a.png").read_bytes() == b"image"
+
+
+def test_release_puts_the_file_back(tmp_path):
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / "a.png").write_bytes(b"image")
+    claims = Claims(str(tmp_path), "t")
+    claims.start()
+    name = os.path.join("sub", "a.png")
+    assert claims.claim(name)
+    assert claims.release(name)
+    assert (tmp_path / "sub" / "a.png").read_bytes() == b"image"
+    claims.close()
+    assert not os.path.exists(claims.dir)
+
+
+def test_dead_instance_is_adopted(tmp_path):
+    for name in ("a.png", "b.png", "c.png"):
+        (tmp_path / name).write_bytes(b"image")
+    crashed = Claims(str(tmp_path), "t")
+    crashed.start()
+    for name in ("a.png", "b.png", "c.png"):
+        crashed.claim(name)
+    journal = Journal(crashed.dir, "t", exclusive=True)
+    # a.png was converted but not yet deleted, b.png was cut off mid-conversion
+    output = tmp_path / "a_out.jpg"
+    output.write_bytes(b"done")
+    journal.claimed("a.png", file_key(crashed.dir, "a.png"), [str(output)])
+    journal.written("a.png")
+    partial = tmp_path / "b_out.jpg"
+    partial.write_bytes(b"half")
+    journal.claimed("b.png", file_key(crashed.dir, "b.png"), [str(partial)])
+    journal.close()
+    lease_path = os.path.join(crashed.dir, LEASE_FILE)
+    with open(lease_path, encoding='utf-8') as f:
+        lease = json.load(f)
+    lease["pid"] = dead_pid()
+    with open(lease_path, 'w', encoding='utf-8') as f:
+        json.dump(lease, f)
+
+    survivor = Claims(str(tmp_path), "t")
+    survivor.start()
+    assert survivor.stale() == [crashed.instance]
+    assert survivor.adopt(crashed.instance) == 2
+    # Another instance that noticed it too gets nothing
+    assert Claims(str(tmp_path), "t").adopt(crashed.instance) is None
+    assert not (tmp_path / "a.png").exists()
+    assert output.exists()
+    assert (tmp_path / "b.png").exists()
+    assert not partial.exists()
+    assert (tmp_path / "c.png").exists()
+    assert crashed.instance not in os.listdir(tmp_path / CLAIMS_DIR)
+
+
+def test_silent_instance_is_stale_after_the_lease_timeout(tmp_path, monkeypatch):
+    monkeypatch.setattr(fetchx.claims, "LEASE_TIMEOUT", 0.0)
+    (tmp_path / "a.png").write_bytes(b"image")
+    silent = Claims(str(tmp_path), "t", instance="other-host-1-abc")
+    silent.start()
+    silent.claim("a.png")
+    lease_path = os.path.join(silent.dir, LEASE_FILE)
+    with open(lease_path, encoding='utf-8') as f:
+        lease = json.load(f)
+    lease["host"] = "other-host"
+    with open(lease_path, 'w', encoding='utf-8') as f:
+        json.dump(lease, f)
+
+    observer = Claims(str(tmp_path), "t")
+    observer.start()
+    # The first look only records the beat
+    assert observer.stale() == []
+    assert observer.stale() == [silent.instance]
+    silent.heartbeat()
+    assert observer.stale() == []
+    assert observer.stale() == [silent.instance]
+    assert observer.adopt(silent.instance) == 1
+    assert (tmp_path / "a.png").exists()
+
+
+def test_folder_adopted_by_a_dead_adopter_is_recovered_too(tmp_path):
+    for name in ("a.png", "b.png"):
+        (tmp_path / name).write_bytes(b"image")
+    first = Claims(str(tmp_path), "t")
+    first.start()
+    first.claim("a.png")
+    second = Claims(str(tmp_path), "t")
+    second.start()
+    second.claim("b.png")
+    # second adopted first, then died before putting a.png back
+    nested = os.path.join(second.dir, fetchx.claims.ADOPTED_DIR, first.instance)
+    os.makedirs(os.path.dirname(nested))
+    os.rename(first.dir, nested)
+
+    third = Claims(str(tmp_path), "t")
+    third.start()
+    assert third.adopt(second.instance) == 2
+    assert (tmp_path / "a.png").exists()
+    assert (tmp_path / "b.png").exists()
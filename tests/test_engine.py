@@ -0,0 +1,38 @@
+import os
+import signal
+import sys
+
+import pytest
+
+from fetchx import ImageEngine, Task
+from fetchx.watch import is_held_open, ignore_lease_breaks
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason="needs file leases")
+def test_workers_do_not_inherit_files_being_written(tmp_path):
+    path = tmp_path / "shot.png"
+    task = Task("t", str(tmp_path), str(tmp_path), 32, 32)
+    engine = ImageEngine(2)
+    ignore_lease_breaks()
+    try:
+        with open(path, "wb") as f:
+            f.write(b"partial")
+            # The pool starts while the file is open for writing
+            pids = {engine.submit(task, os.getpid).result() for _ in range(4)}
+            assert is_held_open(str(path))
+        assert os.getpid() not in pids
+        assert not is_held_open(str(path))
+    finally:
+        engine.shutdown(wait=True)
+
+
+def test_workers_do_not_run_the_parents_signal_handlers(tmp_path):
+    task = Task("t", str(tmp_path), str(tmp_path), 32, 32)
+    previous = signal.signal(signal.SIGTERM, lambda signum, frame: None)
+    engine = ImageEngine(1)
+    try:
+        assert engine.submit(task, signal.getsignal, signal.SIGTERM).result() == signal.SIG_DFL
+        assert engine.submit(task, signal.getsignal, signal.SIGINT).result() == signal.SIG_IGN
+    finally:
+        engine.shutdown(wait=True)
+        signal.signal(signal.SIGTERM, previous)
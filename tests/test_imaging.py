@@ -0,0 +1,155 @@
+import os
+import struct
+
+import pytest
+from PIL import Image as PILImage
+
+from fetchx.imaging import FORMAT_MODES, prepare_for_format, resize_image, convert_image, backend_available
+
+FORMATS = ['JPEG', 'PNG', 'WEBP', 'BMP', 'TIFF']
+EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp', 'BMP': 'bmp', 'TIFF': 'tiff'}
+BACKENDS = ['pillow'] + (['vips'] if backend_available('vips') else [])
+
+
+def half_transparent(mode):
+    img = PILImage.new(mode, (8, 4), 'black' if mode in ('RGBA', 'LA') else 0)
+    alpha = PILImage.new('L', img.size, 255)
+    alpha.paste(0, (0, 0, 4, 4))
+    img.putalpha(alpha)
+    return img
+
+
+def grey16(size=(400, 300)):
+    return PILImage.linear_gradient('L').resize(size).convert('I').point(lambda v: v * 257).convert('I;16')
+
+
+@pytest.mark.parametrize('save_ext', FORMATS)
+@pytest.mark.parametrize('mode', ['1', 'L', 'LA', 'La', 'P', 'PA', 'RGB', 'RGBA', 'RGBa', 'CMYK', 'I', 'I;16', 'F',
+                                  'YCbCr', 'LAB', 'HSV'])
+def test_prepare_for_format_gives_a_mode_the_format_stores(mode, save_ext):
+    img = prepare_for_format(PILImage.new(mode, (4, 4)), save_ext)
+    assert img.mode in FORMAT_MODES[save_ext]
+
+
+@pytest.mark.parametrize('save_ext', ['JPEG', 'BMP'])
+def test_prepare_for_format_flattens_onto_the_background(save_ext):
+    img = prepare_for_format(half_transparent('RGBA'), save_ext, (255, 0, 0))
+    assert img.mode == 'RGB'
+    assert img.getpixel((0, 0)) == (255, 0, 0)
+    assert img.getpixel((7, 0)) == (0, 0, 0)
+
+
+def test_prepare_for_format_flattens_grey_onto_a_grey_background():
+    img = prepare_for_format(half_transparent('LA'), 'JPEG', (255, 255, 255))
+    assert img.mode == 'L'
+    assert img.getpixel((0, 0)) == 255
+    assert img.getpixel((7, 0)) == 0
+
+
+@pytest.mark.parametrize('save_ext', ['PNG', 'WEBP', 'TIFF'])
+def test_prepare_for_format_keeps_alpha(save_ext):
+    assert prepare_for_format(half_transparent('RGBA'), save_ext).mode == 'RGBA'
+
+
+def test_prepare_for_format_keeps_16_bits_where_the_format_can():
+    img = grey16()
+    assert prepare_for_format(img, 'PNG').mode == 'I;16'
+    assert prepare_for_format(img, 'TIFF').mode == 'I;16'
+    # Scaled, not clipped at 255
+    assert prepare_for_format(img, 'JPEG').getextrema() == (0, 255)
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+@pytest.mark.parametrize('downscale', ['quality', 'balanced', 'fast'])
+@pytest.mark.parametrize('save_ext', FORMATS)
+@pytest.mark.parametrize('src_ext', ['tiff', 'png'])
+def test_16_bit_sources_convert_to_every_format(tmp_path, src_ext, save_ext, downscale, backend):
+    src_path = tmp_path / f"grey16.{src_ext}"
+    grey16().save(src_path)
+    output_folder = tmp_path / "out"
+    output_folder.mkdir()
+    result = convert_image(str(src_path), {"output_folder": str(output_folder), "width": 100, "height": 75,
+                                           "format": EXTENSIONS[save_ext], "downscale": downscale,
+                                           "backend": backend})
+    with PILImage.open(output_folder / result["output"]) as out:
+        assert out.size == (100, 75)
+        assert out.mode in FORMAT_MODES[save_ext] + ('I',)
+        low, high = out.getextrema()[0] if out.mode == 'RGB' else out.getextrema()
+        if out.mode.startswith('I'):
+            # Kept at 16 bit
+            low, high = low // 257, high // 257
+        assert high - low > 200
+    assert not os.path.exists(src_path)
+
+
+def convert_same_size(tmp_path, img, name, backend, **spec):
+    src_path = tmp_path / name
+    img.save(src_path)
+    output_folder = tmp_path / "out"
+    output_folder.mkdir(exist_ok=True)
+    options = dict({"output_folder": str(output_folder), "width": img.width, "height": img.height,
+                    "format": name.rsplit('.', 1)[1], "backend": backend}, **spec)
+    result = convert_image(str(src_path), options)
+    return result, PILImage.open(output_folder / result["output"])
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_matching_file_passes_through(tmp_path, backend):
+    result, out = convert_same_size(tmp_path, PILImage.new('RGB', (64, 48), 'red'), 'same.png', backend)
+    assert result.get("passthrough")
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+@pytest.mark.parametrize('name, options', [('same.png', {"png": {"compress_level": 9}}),
+                                           ('same.webp', {"webp": {"lossless": True}}),
+                                           ('same.jpg', {"jpeg": {"quality": 50}})])
+def test_encoder_options_disable_passthrough(tmp_path, backend, name, options):
+    result, out = convert_same_size(tmp_path, PILImage.new('RGB', (64, 48), 'red'), name, backend,
+                                    encoder_options=options)
+    assert not result.get("passthrough")
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_cmyk_jpeg_is_normalized(tmp_path, backend):
+    result, out = convert_same_size(tmp_path, PILImage.new('CMYK', (64, 48)), 'cmyk.jpg', backend)
+    assert not result.get("passthrough")
+    assert out.mode == 'RGB'
+
+
+def write_rgba_bmp(path, width, height):
+    # BITMAPV4HEADER with an alpha mask, which Pillow reads as RGBA (it only writes BMPs without alpha)
+    pixels = struct.pack('<BBBB', 0, 0, 255, 128) * (width * height)
+    header = struct.pack('<IiiHHIIiiII', 108, width, height, 1, 32, 3, len(pixels), 2835, 2835, 0, 0)
+    header += struct.pack('<IIII', 0x00ff0000, 0x0000ff00, 0x000000ff, 0xff000000) + b'BGRs' + bytes(48)
+    with open(path, 'wb') as f:
+        f.write(b'BM' + struct.pack('<IHHI', 14 + len(header) + len(pixels), 0, 0, 14 + len(header)))
+        f.write(header + pixels)
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_rgba_bmp_is_flattened(tmp_path, backend):
+    src_path = tmp_path / "rgba.bmp"
+    write_rgba_bmp(src_path, 64, 48)
+    output_folder = tmp_path / "out"
+    output_folder.mkdir()
+    result = convert_image(str(src_path), {"output_folder": str(output_folder), "width": 64, "height": 48,
+                                           "format": "bmp", "backend": backend, "background": "#0000ff"})
+    assert not result.get("passthrough")
+    with PILImage.open(output_folder / result["output"]) as out:
+        assert out.mode == 'RGB'
+        # Half transparent red on blue
+        assert out.getpixel((0, 0)) in ((128, 0, 127), (128, 0, 128), (127, 0, 128))
+
+
+@pytest.mark.parametrize('mode', ['P', 'PA', '1'])
+def test_palette_and_bilevel_sources_use_the_resample_filter(mode):
+    stripes = PILImage.new('L', (400, 300))
+    stripes.putdata([255 * (x // 3 % 2) for y in range(300) for x in range(400)])
+    img = stripes.convert(mode)
+    smooth = resize_image(img, (100, 75), resample='lanczos')
+    jagged = resize_image(img, (100, 75), resample='nearest')
+    assert smooth.mode != img.mode
+    assert jagged.mode == img.mode
+    assert smooth.convert('L').tobytes() != jagged.convert('L').tobytes()
+    # Averaged stripes end up grey instead of black or white
+    assert 0 < smooth.convert('L').getpixel((50, 37)) < 255
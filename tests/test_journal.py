@@ -0,0 +1,106 @@
+import os
+import logging
+
+from fetchx.journal import Journal
+from fetchx.watch import file_key
+
+from test_scheduler import Run, png_bytes, wait_for
+
+
+def claim(journal, folder, name, outputs):
+    journal.claimed(name, file_key(str(folder), name), [str(p) for p in outputs])
+
+
+def test_interrupted_conversion_is_rolled_back(tmp_path):
+    (tmp_path / "a.png").write_bytes(b"source")
+    partial = tmp_path / "a_out.jpg"
+    partial.write_bytes(b"half")
+    journal = Journal(str(tmp_path), "t")
+    claim(journal, tmp_path, "a.png", [partial])
+    journal.close()
+
+    journal = Journal(str(tmp_path), "t")
+    assert journal.recover() == (0, 1, [])
+    assert not partial.exists()
+    # The source is converted again from scratch
+    assert (tmp_path / "a.png").exists()
+    assert journal.outputs("a.png") == []
+    journal.close()
+
+
+def test_written_conversion_is_finished(tmp_path):
+    (tmp_path / "a.png").write_bytes(b"source")
+    output = tmp_path / "a_out.jpg"
+    output.write_bytes(b"done")
+    journal = Journal(str(tmp_path), "t")
+    claim(journal, tmp_path, "a.png", [output])
+    journal.written("a.png")
+    journal.close()
+
+    journal = Journal(str(tmp_path), "t")
+    assert journal.recover() == (1, 0, [])
+    assert not (tmp_path / "a.png").exists()
+    assert output.exists()
+    # Nothing left to do on the next start
+    assert journal.recover() == (0, 0, [])
+    journal.close()
+
+
+def test_replaced_source_is_not_deleted(tmp_path):
+    (tmp_path / "a.png").write_bytes(b"source")
+    journal = Journal(str(tmp_path), "t")
+    claim(journal, tmp_path, "a.png", [])
+    journal.written("a.png")
+    (tmp_path / "a.png").write_bytes(b"a new file under the same name")
+    assert journal.recover() == (1, 0, [])
+    assert (tmp_path / "a.png").exists()
+    journal.close()
+
+
+def test_skip_leaves_files_in_flight_alone(tmp_path):
+    (tmp_path / "a.png").write_bytes(b"source")
+    partial = tmp_path / "a_out.jpg"
+    partial.write_bytes(b"half")
+    journal = Journal(str(tmp_path), "t")
+    claim(journal, tmp_path, "a.png", [partial])
+    assert journal.recover(skip={"a.png"}) == (0, 0, [])
+    assert partial.exists()
+    journal.close()
+
+
+def test_rollback_removes_outputs(tmp_path):
+    (tmp_path / "a.png").write_bytes(b"source")
+    outputs = [tmp_path / "a_1.jpg", tmp_path / "a_2.jpg"]
+    outputs[0].write_bytes(b"half")
+    journal = Journal(str(tmp_path), "t")
+    claim(journal, tmp_path, "a.png", outputs)
+    journal.rollback("a.png")
+    assert not outputs[0].exists()
+    assert (tmp_path / "a.png").exists()
+    assert journal.outputs("a.png") == []
+    journal.close()
+
+
+def test_unwritable_journal_is_disabled(tmp_path):
+    (tmp_path / ".fetchx_journal").write_bytes(b"not a folder")
+    journal = Journal(str(tmp_path), "t")
+    assert not journal.enabled
+    assert journal.error is not None
+    assert journal.recover() == (0, 0, [])
+
+
+def test_no_rollback_after_the_source_is_removed(tmp_path):
+    class Failing(Run):
+        def log(self, msg, level=logging.INFO):
+            super().log(msg, level)
+            if "✔" in msg:
+                raise RuntimeError("log sink is down")
+
+    with Failing(tmp_path) as run:
+        for n in range(3):
+            (run.watch_folder / f"{n}.png").write_bytes(png_bytes())
+        assert wait_for(lambda: len(run.outputs()) == 3 and not any(
+            name.endswith(".png") for name in os.listdir(run.watch_folder)))
+    assert run.errors() == []
+    # Still there once the scheduler is done with them
+    assert len(run.outputs()) == 3
@@ -0,0 +1,99 @@
+import os
+import shutil
+import threading
+
+import pytest
+from PIL import Image as PILImage
+
+import fetchx.pipeline
+from fetchx import ImageEngine, Pipeline, Task
+from fetchx.imaging import backend_available
+
+
+def options(output_folder):
+    return {"output_folder": str(output_folder), "width": 32, "height": 24, "format": "png"}
+
+
+class Results:
+    def __init__(self):
+        self.order = []
+        self.errors = {}
+        self.lock = threading.Lock()
+
+    def callback(self, name):
+        def done(result, error):
+            with self.lock:
+                self.order.append(name)
+                if error is not None:
+                    self.errors[name] = error
+        return done
+
+
+@pytest.fixture
+def engine():
+    engine = ImageEngine(2)
+    yield engine
+    engine.shutdown(wait=True)
+
+
+@pytest.mark.parametrize('use_engine', [False, True])
+def test_errors_name_the_source_file(tmp_path, request, use_engine):
+    pipeline = Pipeline(request.getfixturevalue('engine') if use_engine else None)
+    src_path = tmp_path / "broken.png"
+    src_path.write_bytes(b"not a png at all")
+    results = Results()
+    pipeline.submit(Task("t", str(tmp_path), str(tmp_path), 32, 24), str(src_path), options(tmp_path),
+                    results.callback("broken"))
+    pipeline.shutdown(wait=True)
+    assert str(src_path) in str(results.errors["broken"])
+    assert "BytesIO" not in str(results.errors["broken"])
+
+
+def test_capped_task_does_not_hold_up_other_tasks(tmp_path, engine):
+    out = tmp_path / "out"
+    out.mkdir()
+    big = PILImage.effect_noise((2400, 1800), 64).convert('RGB')
+    capped = Task("capped", str(tmp_path), str(out), 32, 24, max_workers=1)
+    other = Task("other", str(tmp_path), str(out), 32, 24)
+    pipeline = Pipeline(engine)
+    results = Results()
+    big.save(tmp_path / "big0.png")
+    for n in range(1, 3):
+        shutil.copyfile(tmp_path / "big0.png", tmp_path / f"big{n}.png")
+    PILImage.new('RGB', (64, 48)).save(tmp_path / "small.png")
+    for n in range(3):
+        pipeline.submit(capped, str(tmp_path / f"big{n}.png"), options(out), results.callback(f"big{n}"))
+    pipeline.submit(other, str(tmp_path / "small.png"), options(out), results.callback("small"))
+    pipeline.shutdown(wait=True)
+    assert results.errors == {}
+    # Done while the capped task's first file still converts
+    assert results.order[0] == "small"
+    assert len(os.listdir(out)) == 4
+
+
+@pytest.mark.parametrize('backend', ['pillow', 'vips'])
+def test_sources_are_only_read_ahead_for_pillow_decodes(tmp_path, monkeypatch, backend):
+    if backend == 'vips' and not backend_available('vips'):
+        pytest.skip("pyvips is not installed")
+    read = []
+    read_source = fetchx.pipeline.read_source
+
+    def reading(path):
+        read.append(os.path.basename(path))
+        return read_source(path)
+
+    monkeypatch.setattr(fetchx.pipeline, 'read_source', reading)
+    out = tmp_path / "out"
+    out.mkdir()
+    PILImage.new('RGB', (32, 24), 'red').save(tmp_path / "same.png")
+    PILImage.new('RGB', (64, 48), 'red').save(tmp_path / "big.png")
+    pipeline = Pipeline()
+    results = Results()
+    for name in ("same.png", "big.png"):
+        pipeline.submit(Task("t", str(tmp_path), str(out), 32, 24), str(tmp_path / name),
+                        dict(options(out), backend=backend), results.callback(name))
+    pipeline.shutdown(wait=True)
+    assert results.errors == {}
+    assert len(os.listdir(out)) == 2
+    # The matching file is only renamed, vips reads from the path itself
+    assert read == ([] if backend == 'vips' else ["big.png"])
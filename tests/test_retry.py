@@ -0,0 +1,63 @@
+import json
+import time
+
+from fetchx.retry import RetryQueue, QUARANTINE_DIR, FAILURES_FILE
+
+
+def key(name, ino=1, size=10, mtime_ns=100):
+    return (name, ino, size, mtime_ns)
+
+
+def test_backoff_grows_up_to_the_limit(tmp_path):
+    retries = RetryQueue(str(tmp_path), max_attempts=0, base_delay=2.0, max_delay=10.0)
+    delays = [retries.failed("a.png", key("a.png"), ValueError("bad"))[1] for _ in range(5)]
+    assert delays == [2.0, 4.0, 8.0, 10.0, 10.0]
+
+
+def test_blocked_until_due(tmp_path):
+    retries = RetryQueue(str(tmp_path), base_delay=0.2)
+    assert not retries.blocked("a.png", key("a.png"))
+    assert retries.failed("a.png", key("a.png"), ValueError("bad")) == ('retry', 0.2)
+    assert retries.blocked("a.png", key("a.png"))
+    assert retries.due() == []
+    time.sleep(0.25)
+    assert not retries.blocked("a.png", key("a.png"))
+    assert retries.due() == ["a.png"]
+
+
+def test_rewritten_file_gets_fresh_attempts(tmp_path):
+    retries = RetryQueue(str(tmp_path), base_delay=60.0)
+    retries.failed("a.png", key("a.png"), ValueError("bad"))
+    assert retries.blocked("a.png", key("a.png"))
+    assert not retries.blocked("a.png", key("a.png", size=20))
+    assert "a.png" not in retries
+    assert retries.failed("a.png", key("a.png", size=20), ValueError("bad")) == ('retry', 60.0)
+
+
+def test_quarantine_after_max_attempts(tmp_path):
+    (tmp_path / "a.png").write_bytes(b"corrupt")
+    retries = RetryQueue(str(tmp_path), max_attempts=3, base_delay=0.01)
+    for _ in range(2):
+        assert retries.failed("a.png", key("a.png"), ValueError("cannot identify image"))[0] == 'retry'
+    action, path = retries.failed("a.png", key("a.png"), ValueError("cannot identify image"))
+    assert action == 'quarantine'
+    assert path == str(tmp_path / QUARANTINE_DIR / "a.png")
+    assert not (tmp_path / "a.png").exists()
+    assert "a.png" not in retries
+
+    with open(tmp_path / QUARANTINE_DIR / FAILURES_FILE, encoding='utf-8') as f:
+        data = json.load(f)
+    assert data["pending"] == {}
+    [record] = data["quarantined"]
+    assert record["name"] == "a.png"
+    assert record["attempts"] == 3
+    assert record["error"] == "cannot identify image"
+
+
+def test_pending_retries_survive_restart(tmp_path):
+    retries = RetryQueue(str(tmp_path), base_delay=60.0)
+    retries.failed("a.png", key("a.png"), OSError())
+    retries = RetryQueue(str(tmp_path), base_delay=60.0)
+    assert retries.blocked("a.png", key("a.png"))
+    retries.succeeded("a.png")
+    assert "a.png" not in RetryQueue(str(tmp_path))
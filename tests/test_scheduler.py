@@ -0,0 +1,234 @@
+import io
+import os
+import time
+import logging
+
+import pytest
+from PIL import Image as PILImage
+
+import fetchx.pipeline
+from fetchx import Scheduler, Task, QUARANTINE_DIR
+from fetchx.metrics import METRICS
+from fetchx.scheduler import TaskState
+from fetchx.watch import file_key
+
+
+def png_bytes(size=(64, 48)):
+    buf = io.BytesIO()
+    PILImage.new('RGB', size, 'red').save(buf, 'PNG')
+    return buf.getvalue()
+
+
+def wait_for(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+class Run:
+    def __init__(self, tmp_path, **task_options):
+        self.watch_folder = tmp_path / "watch"
+        self.output_folder = tmp_path / "out"
+        self.watch_folder.mkdir()
+        self.output_folder.mkdir()
+        self.logs = []
+        self.task = Task("t", str(self.watch_folder), str(self.output_folder), 32, 24, settle_time=0.1, **task_options)
+        self.scheduler = Scheduler(self.log)
+
+    def log(self, msg, level=logging.INFO):
+        self.logs.append((level, msg))
+
+    def errors(self):
+        return [msg for level, msg in self.logs if level >= logging.ERROR]
+
+    def outputs(self):
+        return os.listdir(self.output_folder)
+
+    def __enter__(self):
+        self.scheduler.start()
+        self.scheduler.add_task(self.task, 1)
+        assert wait_for(lambda: any("Watcher started" in msg for _, msg in self.logs))
+        return self
+
+    def __exit__(self, *exc):
+        self.task.running = False
+        self.scheduler.remove_task(self.task)
+        self.scheduler.stop()
+
+
+@pytest.mark.parametrize('shared', [False, True])
+def test_write_then_rename_producers_are_left_alone(tmp_path, shared):
+    data = png_bytes()
+    with Run(tmp_path, shared=shared) as run:
+        for n in range(5):
+            tmp_name = run.watch_folder / f".tmp{n}.png"
+            with open(tmp_name, "wb") as f:
+                f.write(data)
+            time.sleep(0.3)
+            # Fails if the temp file was claimed (renamed away) meanwhile
+            os.rename(tmp_name, run.watch_folder / f"shot{n}.png")
+        assert wait_for(lambda: len(run.outputs()) == 5)
+    assert run.errors() == []
+    assert not os.path.exists(run.watch_folder / QUARANTINE_DIR)
+    assert not [name for name in os.listdir(run.watch_folder) if name.endswith(".png")]
+
+
+def test_source_that_vanishes_mid_job_is_not_a_failure(tmp_path, monkeypatch):
+    read_source = fetchx.pipeline.read_source
+
+    def vanish(path):
+        os.remove(path)
+        return read_source(path)
+
+    monkeypatch.setattr(fetchx.pipeline, "read_source", vanish)
+    with Run(tmp_path, log_level='debug') as run:
+        (run.watch_folder / "shot.png").write_bytes(png_bytes())
+        assert wait_for(lambda: any("was gone" in msg for _, msg in run.logs))
+        time.sleep(0.2)
+    assert run.errors() == []
+    assert run.outputs() == []
+    assert not os.path.exists(run.watch_folder / QUARANTINE_DIR)
+
+
+class Queues:
+    # A scheduler that isn't started: files go into the task queues by hand,
+    # and dispatching records what would have been handed to the pipeline
+    def __init__(self, tmp_path):
+        self.tmp_path = tmp_path
+        self.scheduler = Scheduler(lambda *args: None)
+        self.scheduler._submit = self.submit
+        self.served = []
+
+    def submit(self, state, filename, key):
+        self.served.append((state.task.name, filename))
+        self.scheduler._in_flight += 1
+
+    def add(self, name, **task_options):
+        folder = self.tmp_path / name
+        folder.mkdir()
+        task = Task(name, str(folder), str(self.tmp_path / "out"), 32, 24, **task_options)
+        state = self.scheduler._states[task] = TaskState(task, len(self.scheduler._states) + 1, lambda *args: None)
+        state.backend = 'polling'
+        state.snapshot.scan()
+        return state
+
+    def enqueue(self, state, *names):
+        folder = state.task.watch_folder
+        for name in names:
+            with open(os.path.join(folder, name), "wb") as f:
+                f.write(name.encode())
+        # Seen by a scan, as the scheduler would
+        assert sorted(state.snapshot.scan()) == sorted(names)
+        for name in names:
+            self.scheduler._enqueue(state, name, file_key(folder, name))
+
+    def dispatch(self, count=None):
+        # Hands out count files, or everything queued when count is None
+        self.served = []
+        while True:
+            served = len(self.served)
+            self.scheduler._in_flight = self.scheduler.capacity - count if count else 0
+            self.scheduler._dispatch()
+            if count or len(self.served) == served:
+                break
+        self.scheduler._in_flight = 0
+        return [filename for _, filename in self.served]
+
+
+def metric(gauge, task_name):
+    return dict(gauge.samples()).get((task_name,))
+
+
+@pytest.mark.parametrize('overflow', ['block', 'defer'])
+def test_full_queue_turns_new_files_away(tmp_path, overflow):
+    queues = Queues(tmp_path)
+    state = queues.add(f"turn-away-{overflow}", queue_limit=2, overflow=overflow)
+    state.next_scan = 100.0
+    queues.enqueue(state, "a.png", "b.png", "c.png")
+    assert list(state.pending) == ["a.png", "b.png"]
+    assert metric(METRICS.deferred, state.task.name) == 1
+    assert metric(METRICS.queue_high_water, state.task.name) == 2
+    # Left in the folder, the next scan finds it again
+    assert state.snapshot.scan() == ["c.png"]
+    assert queues.dispatch() == ["a.png", "b.png"]
+    assert not state.overflowed
+    # block looks for the rest as soon as there is room, defer waits for the next scan
+    assert state.next_scan == (0.0 if overflow == 'block' else 100.0)
+
+
+def test_drop_oldest_drops_until_the_file_changes(tmp_path):
+    queues = Queues(tmp_path)
+    state = queues.add("drop-oldest", queue_limit=2, overflow='drop-oldest')
+    queues.enqueue(state, "a.png", "b.png", "c.png")
+    assert list(state.pending) == ["b.png", "c.png"]
+    assert metric(METRICS.dropped, state.task.name) == 1
+    assert queues.dispatch() == ["b.png", "c.png"]
+    queues.scheduler._handle(state, "a.png", True)
+    assert not state.pending
+    assert (tmp_path / "drop-oldest" / "a.png").exists()
+
+
+def test_newest_first_serves_the_newest_and_rescans_the_oldest(tmp_path):
+    queues = Queues(tmp_path)
+    state = queues.add("newest-first", queue_limit=2, overflow='newest-first')
+    queues.enqueue(state, "a.png", "b.png", "c.png")
+    assert list(state.pending) == ["b.png", "c.png"]
+    assert metric(METRICS.deferred, state.task.name) == 1
+    assert metric(METRICS.dropped, state.task.name) is None
+    assert state.snapshot.scan() == ["a.png"]
+    assert queues.dispatch() == ["c.png", "b.png"]
+
+
+def test_high_water_mark_keeps_the_peak(tmp_path):
+    queues = Queues(tmp_path)
+    state = queues.add("high-water", queue_limit=0)
+    queues.enqueue(state, "a.png", "b.png", "c.png")
+    queues.dispatch()
+    queues.enqueue(state, "d.png")
+    assert metric(METRICS.queue_depth, state.task.name) == 1
+    assert metric(METRICS.queue_high_water, state.task.name) == 3
+
+
+def test_priority_first_then_weight(tmp_path):
+    queues = Queues(tmp_path)
+    light = queues.add("light", weight=1)
+    heavy = queues.add("heavy", weight=3)
+    urgent = queues.add("urgent", priority=1)
+    queues.enqueue(light, *[f"l{n}.png" for n in range(4)])
+    queues.enqueue(heavy, *[f"h{n}.png" for n in range(12)])
+    queues.enqueue(urgent, "u0.png", "u1.png")
+    queues.dispatch()
+    tasks = [task for task, _ in queues.served]
+    assert tasks[:2] == ["urgent", "urgent"]
+    # Equal priority: three files of the heavier task for every one of the other
+    assert tasks[2:10].count("heavy") == 6
+    assert tasks[2:10].count("light") == 2
+    assert len(tasks) == 18
+
+
+def test_idle_task_does_not_catch_up(tmp_path):
+    queues = Queues(tmp_path)
+    busy = queues.add("busy")
+    idle = queues.add("idle")
+    queues.enqueue(busy, *[f"b{n}.png" for n in range(6)])
+    assert queues.dispatch(4) == ["b0.png", "b1.png", "b2.png", "b3.png"]
+    queues.enqueue(idle, "i0.png", "i1.png")
+    queues.dispatch()
+    # Takes turns with busy instead of being owed the four it missed
+    assert [task for task, _ in queues.served] == ["idle", "busy", "idle", "busy"]
+
+
+@pytest.mark.parametrize('watch_backend', ['polling', 'inotify'])
+def test_recursive_watch_mirrors_subfolders(tmp_path, watch_backend):
+    with Run(tmp_path, recursive=True, mirror_paths=True, exclude=["skip"], watch_backend=watch_backend) as run:
+        for rel_dir in ("", "raw", os.path.join("raw", "deep"), "skip"):
+            (run.watch_folder / rel_dir).mkdir(exist_ok=True)
+            (run.watch_folder / rel_dir / "shot.png").write_bytes(png_bytes())
+        assert wait_for(lambda: len(list(run.output_folder.rglob("*.png"))) == 3)
+    assert run.errors() == []
+    mirrored = sorted(str(path.parent.relative_to(run.output_folder)) for path in run.output_folder.rglob("*.png"))
+    assert mirrored == [".", "raw", os.path.join("raw", "deep")]
+    assert (run.watch_folder / "skip" / "shot.png").exists()
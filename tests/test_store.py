@@ -0,0 +1,88 @@
+import os
+import time
+
+from fetchx import Task
+from fetchx.config import load_config, save_config
+from fetchx.store import ConfigStore, diff_tasks
+
+
+def make_task(name, width=100, **options):
+    return Task(name, "/in/" + name, "/out/" + name, width, 50, **options)
+
+
+def edit_outside(path, tasks):
+    # Another program saving the file; bump the mtime in case it lands in the same tick
+    stamp = os.stat(path).st_mtime_ns
+    save_config(tasks, path=path)
+    os.utime(path, ns=(stamp + 10 ** 9, stamp + 10 ** 9))
+
+
+def test_diff_tasks_updates_in_place():
+    a, b, c = make_task("a"), make_task("b"), make_task("c")
+    tasks, added, removed, changed = diff_tasks([a, b, c], [make_task("c"), make_task("a", width=200), make_task("d")])
+    assert [t.name for t in tasks] == ["c", "a", "d"]
+    # Existing tasks are kept, only their fields change
+    assert tasks[0] is c and tasks[1] is a
+    assert a.width == 200
+    assert [t.name for t in added] == ["d"]
+    assert removed == [b]
+    assert changed == [(a, ["width"])]
+
+
+def test_diff_tasks_matches_duplicate_names_in_order():
+    first, second = make_task("a"), make_task("a", width=300)
+    tasks, added, removed, changed = diff_tasks([first, second], [make_task("a")])
+    assert tasks == [first]
+    assert removed == [second]
+    assert added == [] and changed == []
+
+
+def test_saves_are_written_once_quiet(tmp_path):
+    path = str(tmp_path / "config.json")
+    save_config([make_task("a")], path=path)
+    store = ConfigStore(path, save_delay=0.2)
+    for width in (110, 120, 130):
+        store.tasks[0].width = width
+        store.save()
+        assert store.poll() is None
+    assert store.dirty
+    assert load_config(path)[0].width == 100
+    time.sleep(0.25)
+    assert store.poll() is None
+    assert not store.dirty
+    assert load_config(path)[0].width == 130
+    # Our own write isn't taken for an outside edit
+    assert store.poll() is None
+
+
+def test_outside_edit_is_reloaded(tmp_path):
+    path = str(tmp_path / "config.json")
+    save_config([make_task("a"), make_task("b")], path=path)
+    logs = []
+    store = ConfigStore(path, log_callback=logs.append)
+    tasks = store.tasks
+    a = tasks[0]
+    edit_outside(path, [make_task("a", enabled=False), make_task("c")])
+    result = store.poll()
+    assert result is not None
+    assert result[0] is tasks
+    assert [t.name for t in tasks] == ["a", "c"]
+    assert tasks[0] is a and not a.enabled
+    assert [t.name for t in result[1]] == ["c"]
+    assert [t.name for t in result[2]] == ["b"]
+    assert result[3] == [(a, ["enabled"])]
+    assert logs == [f"Reloaded {path}: 1 added, 1 removed, 1 changed"]
+
+
+def test_outside_edit_wins_over_unsaved_changes(tmp_path):
+    path = str(tmp_path / "config.json")
+    save_config([make_task("a")], path=path)
+    logs = []
+    store = ConfigStore(path, log_callback=logs.append, save_delay=60)
+    store.tasks[0].width = 999
+    store.save()
+    edit_outside(path, [make_task("a", width=200)])
+    store.poll()
+    assert store.tasks[0].width == 200
+    assert not store.dirty
+    assert "unsaved changes were dropped" in logs[0]
@@ -0,0 +1,93 @@
+import os
+import sys
+import subprocess
+
+import pytest
+
+from fetchx.watch import DirectorySnapshot, match_path
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+# Opens the file for writing from another process while is_held_open holds
+# its read lease, which breaks the lease
+LEASE_BREAK = """
+import sys, time, fcntl, subprocess, threading
+sys.path.insert(0, sys.argv[1])
+from fetchx import Scheduler, watch
+
+path = sys.argv[2]
+real_fcntl = fcntl.fcntl
+writers = []
+
+def fcntl_with_writer(fd, cmd, arg=0):
+    result = real_fcntl(fd, cmd, arg)
+    if cmd == watch.F_SETLEASE and arg == watch.F_RDLCK:
+        writers.append(subprocess.Popen([sys.executable, "-c", "import sys; open(sys.argv[1], 'ab').close()", path]))
+        time.sleep(0.5)
+    return result
+
+fcntl.fcntl = fcntl_with_writer
+scheduler = Scheduler(lambda *args: None)
+scheduler.start()
+held = threading.Thread(target=lambda: print(watch.is_held_open(path)))
+held.start()
+held.join()
+scheduler.stop()
+print(writers[0].wait())
+"""
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason="needs file leases")
+def test_writer_breaking_the_lease_does_not_kill_the_process(tmp_path):
+    path = tmp_path / "shot.png"
+    path.write_bytes(b"image")
+    proc = subprocess.run([sys.executable, "-c", LEASE_BREAK, SRC, str(path)],
+                          capture_output=True, text=True, timeout=30)
+    assert proc.returncode == 0, proc.stderr
+    assert proc.stdout.split() == ["False", "0"]
+
+
+@pytest.mark.parametrize('rel_path, include, exclude, matched', [
+    ("a.png", (), (), True),
+    ("raw/a.png", ("*.png",), (), True),
+    ("raw/a.jpg", ("*.png",), (), False),
+    ("raw/a.png", ("raw/*",), (), True),
+    ("other/a.png", ("raw/*",), (), False),
+    ("raw/deep/a.png", ("raw/*",), (), True),
+    ("raw/a.png", (), ("raw/*",), False),
+    ("raw/a.png", ("*.png",), ("raw/*",), False),
+    # A folder name excludes the folder itself, so a recursive scan doesn't go in
+    ("thumbs", (), ("thumbs",), False),
+    ("thumbs/a.png", (), ("thumbs",), True),
+    (os.path.join("raw", "a.png"), ("raw/a.png",), (), True),
+])
+def test_match_path(rel_path, include, exclude, matched):
+    assert match_path(rel_path, include, exclude) == matched
+
+
+def tree(root, *names):
+    for name in names:
+        path = root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"image")
+
+
+def test_recursive_snapshot_walks_subfolders(tmp_path):
+    tree(tmp_path, "a.png", "raw/b.png", "raw/deep/c.jpg", "raw/notes.txt", "out/d.png",
+         ".fetchx_journal/e.png", "raw/.tmp.png")
+    flat = DirectorySnapshot(str(tmp_path))
+    assert flat.scan() == ["a.png"]
+    snapshot = DirectorySnapshot(str(tmp_path), recursive=True, skip=[str(tmp_path / "out")])
+    found = {path.replace(os.sep, '/') for path in snapshot.scan()}
+    # Its own folders, the output folder inside the tree and temp files are left out
+    assert found == {"a.png", "raw/b.png", "raw/deep/c.jpg"}
+    assert snapshot.scan() == []
+    tree(tmp_path, "raw/deep/new.png")
+    assert [p.replace(os.sep, '/') for p in snapshot.scan()] == ["raw/deep/new.png"]
+
+
+def test_recursive_snapshot_applies_globs(tmp_path):
+    tree(tmp_path, "a.png", "a.jpg", "raw/b.png", "skip/c.png")
+    snapshot = DirectorySnapshot(str(tmp_path), recursive=True, include=["*.png"], exclude=["skip"])
+    assert {p.replace(os.sep, '/') for p in snapshot.scan()} == {"a.png", "raw/b.png"}
+    assert sorted(d.replace(os.sep, '/') for d in snapshot.dirs()) == ["", "raw"]